@@ -1,12 +1,15 @@
 # d:\Projects\Vibes\treescord\cogs\achievements_cog.py
 import discord
 from discord.ext import commands
-import aiosqlite
 import logging
 import datetime
 import os
 import asyncio
+import bisect
+from collections import OrderedDict
 import config
+from db_manager import db_manager
+from migrations import migrate, ACHIEVEMENTS_MIGRATIONS
 
 ACHIEVEMENTS_DB_FILE = config.ACHIEVEMENTS_DB
 
@@ -47,68 +50,88 @@ ACHIEVEMENTS_LIST = [
     {"id": "secret_society", "name": "His Name was Robert Paulson", "description": "Joined Toke Club! Regain your humanity after the dehumanization caused by the consumerist society.", "emoji": "🏢", "hidden": True, "source_cog": "TokeCogEvent"},
 ]
 
+def _build_threshold_tables():
+    """Precompiles, per criteria stat, the stat-based achievements sorted by threshold."""
+    tables = {}
+    for ach in sorted((ach for ach in ACHIEVEMENTS_LIST if ach["source_cog"] == "TreesTrackerCog"), key=lambda ach: ach["threshold"]):
+        thresholds, achievements = tables.setdefault(ach["criteria_stat"], ([], []))
+        thresholds.append(ach["threshold"])
+        achievements.append(ach)
+    return tables
+
+# criteria_stat -> (sorted thresholds, achievements in the same order)
+THRESHOLD_TABLES = _build_threshold_tables()
+
 class AchievementsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db_file = ACHIEVEMENTS_DB_FILE
+        # LRU cache of user_id -> {"earned": set of achievement ids, "checked_stats": {stat: value last evaluated}}
+        self._user_cache = OrderedDict()
 
     async def cog_load(self):
         await self._initialize_database()
 
     async def _initialize_database(self):
-        async with aiosqlite.connect(self.db_file) as conn:
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS user_achievements (
-                    user_id INTEGER NOT NULL,
-                    achievement_id TEXT NOT NULL,
-                    timestamp_earned DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, achievement_id)
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS earlytoke_attempts (
-                    user_id INTEGER PRIMARY KEY,
-                    attempts INTEGER DEFAULT 0
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS earlytoke_lifetime (
-                    user_id INTEGER PRIMARY KEY,
-                    count INTEGER DEFAULT 0
-                )
-            ''')
-            await conn.commit()
-        logging.info(f"Database '{self.db_file}' initialized and tables ensured.")
+        async with db_manager.connection(self.db_file) as conn:
+            version = await migrate(conn, ACHIEVEMENTS_MIGRATIONS, self.db_file)
+        logging.info(f"Database '{self.db_file}' initialized at schema version {version}.")
+
+    async def _get_cached_user(self, user_id: int):
+        """Returns the user's cache entry, loading their earned achievements on a miss."""
+        entry = self._user_cache.get(user_id)
+        if entry is not None:
+            self._user_cache.move_to_end(user_id)
+            return entry
+
+        async with db_manager.reader(self.db_file) as conn:
+            async with conn.execute("SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,)) as cursor:
+                earned = {row[0] for row in await cursor.fetchall()}
+
+        entry = self._user_cache.get(user_id) # Another task may have loaded it meanwhile
+        if entry is None:
+            entry = {"earned": earned, "checked_stats": {}}
+            self._user_cache[user_id] = entry
+            while len(self._user_cache) > config.ACHIEVEMENT_CACHE_SIZE:
+                self._user_cache.popitem(last=False)
+        return entry
 
     async def _has_achievement(self, user_id: int, achievement_id: str):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
-                async with conn.execute("SELECT 1 FROM user_achievements WHERE user_id = ? AND achievement_id = ?", (user_id, achievement_id)) as cursor:
-                    return await cursor.fetchone() is not None
+            entry = await self._get_cached_user(user_id)
+            return achievement_id in entry["earned"]
         except Exception as e:
             logging.error(f"DB error in _has_achievement for user {user_id}, achievement {achievement_id}: {e}")
             return False
 
     async def _award_achievement(self, user_id: int, achievement_id: str):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.connection(self.db_file) as conn:
                 await conn.execute("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)", (user_id, achievement_id))
                 await conn.commit()
-                return True # Assuming success if no exception, rowcount check is harder with aiosqlite execute shortcut but we can assume INSERT OR IGNORE works
+            entry = self._user_cache.get(user_id)
+            if entry is not None:
+                entry["earned"].add(achievement_id)
+            return True # Assuming success if no exception, rowcount check is harder with aiosqlite execute shortcut but we can assume INSERT OR IGNORE works
         except Exception as e:
             logging.error(f"DB error in _award_achievement for user {user_id}, achievement {achievement_id}: {e}")
             return False
 
-    async def check_and_award_achievements(self, user: discord.User, ctx_to_notify: commands.Context = None):
+    async def check_and_award_achievements(self, user: discord.User, ctx_to_notify: commands.Context = None, user_stats: tuple = None):
+        """
+        Awards any stat-based achievements the user qualifies for.
+        Callers that have just written the user's stats can pass them as user_stats to skip re-reading them.
+        """
         if user.bot:
             return
 
-        trees_tracker_cog = self.bot.get_cog("TreesTrackerCog")
-        if not trees_tracker_cog:
-            logging.warning("TreesTrackerCog not found, cannot check achievements.")
-            return
-
-        user_stats_tuple = await trees_tracker_cog._get_user_stats_from_db(user.id)
+        user_stats_tuple = user_stats
+        if user_stats_tuple is None:
+            trees_tracker_cog = self.bot.get_cog("TreesTrackerCog")
+            if not trees_tracker_cog:
+                logging.warning("TreesTrackerCog not found, cannot check achievements.")
+                return
+            user_stats_tuple = await trees_tracker_cog._get_user_stats_from_db(user.id)
         if not user_stats_tuple:
             return # No stats for this user yet
 
@@ -122,24 +145,39 @@ class AchievementsCog(commands.Cog):
             "wake_and_bake_tokes_count": user_stats_tuple[5] if len(user_stats_tuple) > 5 else 0,
         }
 
-        for ach in ACHIEVEMENTS_LIST:
-            if ach["source_cog"] == "TreesTrackerCog": # For now, all are from here
-                user_stat_value = user_stats_map.get(ach["criteria_stat"], 0)
-                
-                if user_stat_value >= ach["threshold"]:
-                    if not await self._has_achievement(user.id, ach["id"]):
-                        awarded = await self._award_achievement(user.id, ach["id"])
-                        if awarded and ctx_to_notify:
-                            try:
-                                await ctx_to_notify.send(
-                                    f"🏆 Achievement Unlocked! {user.mention} earned **{ach['name']}**! {ach['emoji']}\n"
-                                    f"> *{ach['description']}*"
-                                )
-                                logging.info(f"User {user.name} (ID: {user.id}) earned achievement: {ach['name']}")
-                            except discord.HTTPException as e:
-                                logging.error(f"Failed to send achievement notification for {user.name}: {e}")
-                        elif awarded: # Awarded but no context to notify (e.g. background check)
-                             logging.info(f"User {user.name} (ID: {user.id}) earned achievement (no ctx): {ach['name']}")
+        try:
+            entry = await self._get_cached_user(user.id)
+        except Exception as e:
+            logging.error(f"DB error loading achievements for user {user.id}: {e}")
+            return
+
+        for stat_name, (thresholds, stat_achievements) in THRESHOLD_TABLES.items():
+            user_stat_value = user_stats_map.get(stat_name) or 0
+            # Only the thresholds crossed since the value last evaluated for this user need checking.
+            # A freshly loaded user starts from 0, so anything missed earlier is still caught up on.
+            last_checked_value = entry["checked_stats"].get(stat_name, 0)
+            entry["checked_stats"][stat_name] = user_stat_value
+            if user_stat_value <= last_checked_value:
+                continue
+
+            start = bisect.bisect_right(thresholds, last_checked_value)
+            end = bisect.bisect_right(thresholds, user_stat_value)
+            for ach in stat_achievements[start:end]:
+                if ach["id"] not in entry["earned"]:
+                    awarded = await self._award_achievement(user.id, ach["id"])
+                    if awarded and ctx_to_notify:
+                        try:
+                            await ctx_to_notify.send(
+                                f"🏆 Achievement Unlocked! {user.mention} earned **{ach['name']}**! {ach['emoji']}\n"
+                                f"> *{ach['description']}*"
+                            )
+                            logging.info(f"User {user.name} (ID: {user.id}) earned achievement: {ach['name']}")
+                        except discord.HTTPException as e:
+                            logging.error(f"Failed to send achievement notification for {user.name}: {e}")
+                    elif awarded: # Awarded but no context to notify (e.g. background check)
+                         logging.info(f"User {user.name} (ID: {user.id}) earned achievement (no ctx): {ach['name']}")
+                    else:
+                        self._user_cache.pop(user.id, None) # Forget what was checked so the next check retries
 
     async def user_triggered_early_toke(self, user: discord.User, ctx_to_notify: commands.Context):
         """Awards the 'Early Riser!' achievement if not already earned."""
@@ -220,7 +258,7 @@ class AchievementsCog(commands.Cog):
 
     async def _get_user_earned_achievements(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.reader(self.db_file) as conn:
                 async with conn.execute("SELECT achievement_id FROM user_achievements WHERE user_id = ? ORDER BY timestamp_earned ASC", (user_id,)) as cursor:
                     rows = await cursor.fetchall()
                     return [row[0] for row in rows]
@@ -230,7 +268,7 @@ class AchievementsCog(commands.Cog):
 
     async def get_earlytoke_attempts(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.reader(self.db_file) as conn:
                 async with conn.execute("SELECT attempts FROM earlytoke_attempts WHERE user_id = ?", (user_id,)) as cursor:
                     row = await cursor.fetchone()
                     return row[0] if row else 0
@@ -240,7 +278,7 @@ class AchievementsCog(commands.Cog):
 
     async def increment_earlytoke_attempts(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.connection(self.db_file) as conn:
                 await conn.execute('''
                     INSERT INTO earlytoke_attempts (user_id, attempts) VALUES (?, 1)
                     ON CONFLICT(user_id) DO UPDATE SET attempts = attempts + 1
@@ -251,7 +289,7 @@ class AchievementsCog(commands.Cog):
 
     async def reset_earlytoke_attempts(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.connection(self.db_file) as conn:
                 await conn.execute("UPDATE earlytoke_attempts SET attempts = 0 WHERE user_id = ?", (user_id,))
                 await conn.commit()
         except Exception as e:
@@ -259,7 +297,7 @@ class AchievementsCog(commands.Cog):
 
     async def increment_earlytoke_lifetime(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.connection(self.db_file) as conn:
                 await conn.execute('''
                     INSERT INTO earlytoke_lifetime (user_id, count) VALUES (?, 1)
                     ON CONFLICT(user_id) DO UPDATE SET count = count + 1
@@ -270,7 +308,7 @@ class AchievementsCog(commands.Cog):
 
     async def get_earlytoke_lifetime(self, user_id: int):
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.reader(self.db_file) as conn:
                 async with conn.execute("SELECT count FROM earlytoke_lifetime WHERE user_id = ?", (user_id,)) as cursor:
                     row = await cursor.fetchone()
                     return row[0] if row else 0
@@ -347,9 +385,10 @@ class AchievementsCog(commands.Cog):
         if target is None and (ctx.message.content.strip().endswith('all') or ctx.message.content.strip().endswith('all>')):
             # Wipe all users
             try:
-                async with aiosqlite.connect(self.db_file) as conn:
+                async with db_manager.connection(self.db_file) as conn:
                     await conn.execute("DELETE FROM user_achievements")
                     await conn.commit()
+                self._user_cache.clear()
                 await ctx.send("All achievements have been wiped for all users.")
                 logging.info(f"Admin {ctx.author} wiped all achievements.")
             except Exception as e:
@@ -357,9 +396,10 @@ class AchievementsCog(commands.Cog):
                 await ctx.send("Error wiping achievements.")
         elif target is not None:
             try:
-                async with aiosqlite.connect(self.db_file) as conn:
+                async with db_manager.connection(self.db_file) as conn:
                     await conn.execute("DELETE FROM user_achievements WHERE user_id = ?", (target.id,))
                     await conn.commit()
+                self._user_cache.pop(target.id, None)
                 await ctx.send(f"All achievements have been wiped for {target.display_name}.")
                 logging.info(f"Admin {ctx.author} wiped achievements for user {target.display_name} (ID: {target.id}).")
             except Exception as e:
@@ -1,10 +1,16 @@
 # database_cog.py
 import discord
 from discord.ext import commands
-import aiosqlite
 import logging
 import asyncio
+import difflib
+import json
+import os
+import re
 import config
+from db_manager import db_manager
+from migrations import migrate, MEDIA_MIGRATIONS
+import media_index
 
 DATABASE_FILE = config.MEDIA_DB
 
@@ -13,20 +19,225 @@ class DatabaseCog(commands.Cog):
         self.bot = bot
         self.DATABASE_FILE = DATABASE_FILE
         self.pagination_sessions = {}  # Stores active pagination sessions
+        self._library_index_lock = asyncio.Lock()
+        self._media_library = {} # Cached name -> file path, in library order
+        self._media_names = () # Cached names in the same order, for numbered lookups
+        self._media_library_generation = None # library_generation of the media table the cache was loaded at
+        self._media_library_file_signature = None # Database file stats when the generation was last checked
+
+    async def cog_load(self):
+        async with db_manager.connection(self.DATABASE_FILE) as conn:
+            version = await migrate(conn, MEDIA_MIGRATIONS, self.DATABASE_FILE)
+        logging.info(f"Database '{self.DATABASE_FILE}' initialized at schema version {version}.")
+        self.bot.loop.create_task(self.refresh_library_index())
+
+    def _file_signature(self):
+        """mtime and size of the database file and its WAL. Every commit touches one of the two."""
+        signature = []
+        for path in (self.DATABASE_FILE, f"{self.DATABASE_FILE}-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
 
     async def get_media_library(self):
         """
-        Retrieves all media files from the database and returns them as a dictionary.
-        The dictionary maps media names to their file paths.
+        Returns the media library as a dictionary mapping media names to their file paths, in library order.
+        The dictionary is a cached snapshot that is only re-read when the media table changes; don't modify it.
+        Until the database files change, that check is two stats; after any commit, one generation read.
         """
+        file_signature = self._file_signature() # Taken before the query, so a commit during it is seen next time
+        if file_signature == self._media_library_file_signature:
+            return self._media_library
+
         try:
-            async with aiosqlite.connect(self.DATABASE_FILE) as db:
-                async with db.execute("SELECT name, file_path FROM media") as cursor:
+            async with db_manager.reader(self.DATABASE_FILE) as db:
+                # Bumped by triggers on the media table, so writes to the other tables don't invalidate the snapshot
+                async with db.execute("SELECT generation FROM library_generation WHERE name = 'media'") as cursor:
+                    (generation,) = await cursor.fetchone()
+                if generation == self._media_library_generation:
+                    self._media_library_file_signature = file_signature
+                    return self._media_library
+                async with db.execute("SELECT name, file_path FROM media ORDER BY rowid") as cursor:
                     rows = await cursor.fetchall()
-                    return {name: file_path for name, file_path in rows}
         except Exception as e:
-            logging.error(f"Database error: {e}")
-            return {}
+            logging.error(f"Database error, serving the cached media library: {e}")
+            return self._media_library
+
+        self._media_library = {name: file_path for name, file_path in rows}
+        self._media_names = tuple(self._media_library)
+        self._media_library_generation = generation
+        self._media_library_file_signature = file_signature
+        logging.info(f"Loaded media library snapshot ({len(rows)} entries).")
+        return self._media_library
+
+    async def get_media_names(self):
+        """Returns the media names in library order (the numbering used by !media and !play <number>)."""
+        await self.get_media_library()
+        return self._media_names
+
+    async def refresh_library_index(self, names=None):
+        """
+        Brings the tracks table and search index in line with the media library: playlists whose XSPF file changed
+        since they were last ingested are re-read, and playlists no longer in the library are dropped.
+        Pass names to only check those playlists.
+        """
+        async with self._library_index_lock:
+            try:
+                # With names, only those playlists' rows are read
+                where, parameters = ("", ()) if names is None else (" WHERE name IN (SELECT value FROM json_each(?))", (json.dumps(list(names)),))
+                async with db_manager.reader(self.DATABASE_FILE) as conn:
+                    async with conn.execute(f"SELECT name, file_path FROM media{where}", parameters) as cursor:
+                        media_rows = await cursor.fetchall()
+                    async with conn.execute(f"SELECT name, file_path, mtime, size FROM playlist_sources{where}", parameters) as cursor:
+                        indexed_sources = {name: (file_path, mtime, size) for name, file_path, mtime, size in await cursor.fetchall()}
+
+                media_names = {name for name, _ in media_rows}
+                removed = [name for name in indexed_sources if name not in media_names]
+                changed = await asyncio.to_thread(media_index.read_changed_playlists, media_rows, indexed_sources)
+                if not changed and not removed:
+                    return
+
+                async with db_manager.connection(self.DATABASE_FILE) as conn:
+                    for sql, rows in media_index.index_statements(changed, removed):
+                        await conn.executemany(sql, rows)
+                    await conn.commit()
+                logging.info(f"Media index refreshed: {len(changed)} playlist(s) ingested, {len(removed)} removed.")
+                probe_cog = self.bot.get_cog('ProbeCog')
+                if probe_cog:
+                    await probe_cog.refresh_durations() # Pick up the XSPF durations of what was just ingested
+            except Exception as e:
+                logging.error(f"Error refreshing media index: {e}", exc_info=True)
+
+    async def get_playlist_tracks(self, name):
+        """
+        Returns a playlist's (title, location) tracks in order from the tracks table.
+        The playlist is re-ingested first if its XSPF file changed, so that costs one indexed lookup and one stat
+        when it hasn't. While a full refresh is running, a playlist that was indexed before is served as it is.
+        """
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    "SELECT m.file_path, s.file_path, s.mtime, s.size FROM media m LEFT JOIN playlist_sources s ON s.name = m.name WHERE m.name = ?",
+                    (name,)
+                ) as cursor:
+                    source = await cursor.fetchone()
+            if source is not None:
+                file_path, *indexed = source
+                indexed = tuple(indexed) if indexed[0] is not None else None
+                signature = (file_path, *await asyncio.to_thread(media_index.playlist_signature, file_path))
+                if indexed != signature and (indexed is None or not self._library_index_lock.locked()):
+                    await self.refresh_library_index([name])
+        except Exception as e:
+            logging.error(f"Database error checking playlist '{name}' for changes: {e}")
+
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute("SELECT title, location FROM tracks WHERE playlist = ? ORDER BY position", (name,)) as cursor:
+                    return await cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Database error loading tracks for '{name}': {e}")
+            return []
+
+    async def get_resume_point(self, name):
+        """
+        Returns (position, last_position_ms) of the first track in a playlist that hasn't been watched to the end,
+        or None if all of them have. Walks the playlist in order on the tracks key and looks each track up by location.
+        """
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    """
+                    SELECT t.position, COALESCE(h.last_position_ms, 0) FROM tracks t
+                    LEFT JOIN watch_history h ON h.location = t.location
+                    WHERE t.playlist = ? AND h.finished IS NOT 1
+                    ORDER BY t.position
+                    LIMIT 1
+                    """,
+                    (name,)
+                ) as cursor:
+                    return await cursor.fetchone()
+        except Exception as e:
+            logging.error(f"Database error finding the resume point for '{name}': {e}")
+            return None
+
+    async def search_media(self, query, limit=config.SEARCH_RESULT_LIMIT):
+        """
+        Searches playlist names and track titles. Returns up to `limit` (playlist name, track position, title) rows,
+        best first; position is None when the row is the playlist itself.
+        Word-prefix matches come from the FTS5 index; if there are none, typos are handled by trigram similarity.
+        """
+        words = re.findall(r"\w+", query.lower())
+        if not words:
+            return []
+
+        normalized_query = " ".join(words)
+        trigrams = {normalized_query[i:i + 3] for i in range(len(normalized_query) - 2)}
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    "SELECT name, position, title FROM media_search WHERE media_search MATCH ? ORDER BY rank LIMIT ?",
+                    (" ".join(f'"{word}"*' for word in words), limit)
+                ) as cursor:
+                    results = await cursor.fetchall()
+                if results or not trigrams:
+                    return results
+
+                async with conn.execute(
+                    "SELECT name, position, title FROM media_search_trigram WHERE media_search_trigram MATCH ? ORDER BY rank LIMIT ?",
+                    (" OR ".join(f'"{trigram}"' for trigram in trigrams), limit * config.SEARCH_FUZZY_CANDIDATES)
+                ) as cursor:
+                    candidates = await cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Search error for '{query}': {e}")
+            return []
+
+        # Score candidates by the share of the query's trigrams they contain, breaking ties on overall similarity.
+        scored = []
+        for name, position, title in candidates:
+            normalized_title = " ".join(re.findall(r"\w+", title.lower()))
+            similarity = sum(1 for trigram in trigrams if trigram in normalized_title) / len(trigrams)
+            if similarity >= config.SEARCH_MIN_SIMILARITY:
+                ratio = difflib.SequenceMatcher(None, normalized_query, normalized_title).ratio()
+                scored.append((similarity, ratio, (name, position, title)))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [row for _, _, row in scored[:limit]]
+
+    async def find_best_match(self, query):
+        """Returns the single best (playlist name, track position, title) for a query, or None."""
+        results = await self.search_media(query, limit=1)
+        return results[0] if results else None
+
+    @commands.command(brief="Searches playlists and episode titles 🔎. Usage: !find <text>")
+    async def find(self, ctx, *, query: str = None):
+        """Searches playlist names and every track title in the media library, tolerating typos."""
+        if not query:
+            await ctx.send("Usage: `!find <text>`")
+            return
+
+        results = await self.search_media(query)
+        if not results:
+            await ctx.send(f"Nothing in the media library matches '{query}'. 🤷")
+            return
+
+        lines = []
+        for name, position, title in results:
+            if position is None:
+                lines.append(f"📃 **{name}**")
+            else:
+                lines.append(f"🎬 {title} — *{name}* #{position + 1}")
+        embed = discord.Embed(title=f"🔎 Results for '{query}'", description="\n".join(lines))
+        embed.set_footer(text="Use !play <text> to play the best match.")
+        await ctx.send(embed=embed)
+
+    @commands.command(brief="Re-reads playlists that changed on disk (owner only) 🔄.")
+    @commands.is_owner()
+    async def reindex(self, ctx):
+        """Re-ingests the tracks and search entries of playlists whose XSPF file changed."""
+        await self.refresh_library_index()
+        await ctx.send("Media index refreshed. 🔄")
 
     def _create_media_embed(self, media_list_chunk, page_num, total_pages):
         """
@@ -76,14 +287,11 @@ class DatabaseCog(commands.Cog):
         Lists all media files in the library with pagination.
         """
         try:
-            media_library = await self.get_media_library()
-            if not media_library:
+            media_list = await self.get_media_names()
+            if not media_list:
                 await ctx.send("The media library is empty.")
                 return
 
-            # Convert media library keys to a list
-            media_list = list(media_library.keys())
-
             # Start pagination
             await self._send_initial_media_page(ctx, media_list)
         except Exception as e:
@@ -1,28 +1,23 @@
 # playback_cog.py
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import vlc
 import logging
 import asyncio
-import defusedxml.ElementTree as ET
-from urllib.parse import unquote
-import os
-import yt_dlp
-
-def parse_xspf(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    namespace = {'xspf': 'http://xspf.org/ns/0/'}
-    media_files = []
-
-    for track in root.findall('.//xspf:track', namespace):
-        location = track.find('xspf:location', namespace)
-        file_path = unquote(location.text) if location is not None and location.text else None
-        title = track.find('xspf:title', namespace)
-        title = title.text if title is not None else os.path.basename(file_path)
-        if file_path:
-            media_files.append((title, file_path))
-    return media_files
+import datetime
+import time
+import config
+from db_manager import db_manager
+import media_probe
+import prefetch
+import youtube
+from media_index import location_to_path
+
+PLAYER_END_EVENTS = (
+    vlc.EventType.MediaPlayerEndReached,
+    vlc.EventType.MediaPlayerEncounteredError,
+    vlc.EventType.MediaPlayerStopped,
+)
 
 class PlaybackCog(commands.Cog):
     playing = False
@@ -32,39 +27,161 @@ class PlaybackCog(commands.Cog):
         self.instance = instance
         self.media_player = None
         self.last_ctx = None # store the last context.
+        self.media_generation = 0 # Bumped on every play_media, so events from a replaced item are ignored
+        self.track_selection_task = None
+        self.prefetch_task = None
+        self.prefetched_location = None # Next item already pulled into the page cache
+        self.switch_started_at = None # When the last item ended, for measuring the gap to the next one
+        self.switch_measurement = None # (started_at, prefetched) while waiting for the next item's first frame
+        self.last_switch_gap_ms = None
+        self.list_player = None # MediaListPlayer, when config.GAPLESS_PLAYBACK is on
+        self.media_list = None
+        self.media_list_items = {} # libvlc media pointer -> playlist index
+        self.media_list_source = None # Tracks of shared_playlist, in play order, the media list was built from
+        self.media_list_version = None # shared_playlist.version at the time
+        self.media_list_track_choices = {} # location -> (audio track, subtitle track) applied to the list's items
+        self.list_item_requested = None # Index play_media asked the list player for
+        self.youtube_cache = {} # video id -> (title, stream URL, unix time to stop using it)
+        self.youtube_extractions = {} # video id -> running yt-dlp extraction task
+        self.stream_prefetch_task = None
+        self.current_location = None # Playlist location of the item playing (the watch URL for YouTube), for watch history
+        self.watch_updates = {} # location -> buffered watch_history fields, written by flush_watch_history()
+        self.last_watch_sample = None # (location, position) last sampled, so an unchanged position isn't rewritten
+        self.youtube_resolver = youtube.YoutubeResolver(config.YOUTUBE_RESOLVER_WORKERS, config.YOUTUBE_RESOLVE_TIMEOUT_SECONDS, config.YOUTUBE_MAX_QUEUED_PER_USER)
 
     async def cog_load(self):
+        self.youtube_resolver.start()
+        self.watch_history_loop.start()
         self.media_player = self.instance.media_player_new()
         self.media_player.set_fullscreen(1)
 
+        # libvlc reports the end of playback from its own thread; hand the events to the bot's loop.
+        loop = asyncio.get_running_loop()
+        events = self.media_player.event_manager()
+        for event_type in PLAYER_END_EVENTS:
+            events.event_attach(event_type, self._on_vlc_event, loop)
+
+        if config.GAPLESS_PLAYBACK:
+            self.list_player = self.instance.media_list_player_new()
+            self.list_player.set_media_player(self.media_player)
+            list_events = self.list_player.event_manager()
+            for event_type in (vlc.EventType.MediaListPlayerNextItemSet, vlc.EventType.MediaListPlayerPlayed):
+                list_events.event_attach(event_type, self._on_list_event, loop)
+
     async def cog_unload(self):
+        self.youtube_resolver.shutdown()
+        self.watch_history_loop.stop()
+        self._sample_watch_position()
+        await self.flush_watch_history()
         if self.media_player:
+            events = self.media_player.event_manager()
+            for event_type in PLAYER_END_EVENTS:
+                events.event_detach(event_type)
+            self._stop_switch_measurement()
+            if self.list_player:
+                self.list_player.stop()
             self.media_player.stop()
 
-    async def play_media(self, ctx, title, file_or_url_path):
+    def _on_vlc_event(self, event, loop):
+        """libvlc callback (runs on a libvlc thread). Must not call back into libvlc; just schedules the handler."""
+        loop.call_soon_threadsafe(self._handle_player_event, event.type.value, self.media_generation)
+
+    def _handle_player_event(self, event_type, generation):
+        """Runs on the event loop for every end/error/stop event of the media player."""
+        if generation != self.media_generation:
+            return # Belongs to an item that has since been replaced
+        PlaybackCog.playing = False
+        for task in (self.track_selection_task, self.prefetch_task):
+            if task:
+                task.cancel()
+
+        if event_type == vlc.EventType.MediaPlayerEndReached.value:
+            self.switch_started_at = time.perf_counter()
+            if self.current_location:
+                update = self._watch_update(self.current_location)
+                update["finished"] = 1
+                update["ended_at"] = datetime.datetime.now().isoformat()
+                if update["duration_ms"]:
+                    update["position_ms"] = update["duration_ms"]
+            if self.media_list_source is not None:
+                return # The MediaListPlayer moves to the next item itself
+            logging.info("Playback ended; advancing the playlist.")
+            playlist_cog = self.bot.get_cog('PlaylistCog')
+            if playlist_cog and self.last_ctx:
+                self.bot.loop.create_task(playlist_cog.play_next(self.last_ctx))
+        elif event_type == vlc.EventType.MediaPlayerEncounteredError.value:
+            logging.error("VLC reported a playback error.")
+        else:
+            logging.info("Playback stopped.")
+
+    async def play_media(self, ctx, title, file_or_url_path, start_ms=None):
+        """Plays one item, from start_ms into it if given (libvlc seeks as it opens the item, not after it starts)."""
         if not self.media_player:
             await ctx.send("Error: Media player is not initialized.")
             return
 
         try:
             logging.info(f"Attempting to play media: {title}, Path/URL: {file_or_url_path}")
+            # Queued YouTube items keep their watch URL; the stream URL is resolved (or taken from the cache the
+            # prefetch window filled) only now, so it can't have expired while the item waited in the queue.
+            media_location = file_or_url_path
+            if youtube.is_youtube_url(file_or_url_path):
+                resolved = await self._resolve_queued_stream(ctx, file_or_url_path)
+                if resolved is None:
+                    return
+                title, media_location = resolved
+
+            for task in (self.track_selection_task, self.prefetch_task, self.stream_prefetch_task):
+                if task:
+                    task.cancel()
+            self._stop_switch_measurement()
+            switch_started_at, self.switch_started_at = self.switch_started_at, None
+            self._sample_watch_position() # How far the item being replaced got
             if self.media_player.is_playing() or self.media_player.get_state() == vlc.State.Paused:
                 self.media_player.stop()
                 logging.info("Stopped previous media.")
 
-            media = self.instance.media_new(file_or_url_path)
-            if not media:
-                await ctx.send(f"Error: Failed to load media: {file_or_url_path}")
-                logging.error(f"VLC media_new failed for: {file_or_url_path}")
-                return
+            # Gapless mode: play the current playlist item through the MediaListPlayer, which then moves
+            # from item to item inside libvlc.
+            list_index = self._current_playlist_index(file_or_url_path) if self.list_player and media_location == file_or_url_path and not start_ms else None
+            if list_index is not None:
+                if self.media_list_version != self.bot.get_cog('PlaylistCog').shared_playlist.version:
+                    await self._load_media_list()
+                tracks_applied = file_or_url_path in self.media_list_track_choices
+                self.media_generation += 1 # Stop/end events of the previous item no longer count
+                self.list_item_requested = list_index
+                play_success = self.list_player.play_item_at_index(list_index)
+            else:
+                if self.media_list_source:
+                    self._unload_media_list() # Otherwise the list player would resume its list when this item ends
+
+                media = self.instance.media_new(media_location)
+                if not media:
+                    await ctx.send(f"Error: Failed to load media: {file_or_url_path}")
+                    logging.error(f"VLC media_new failed for: {file_or_url_path}")
+                    return
+
+                # Apply the audio/subtitle choice from the background probe up front, if the item has been probed
+                tracks_applied = False
+                probe_cog = self.bot.get_cog('ProbeCog')
+                probe = await probe_cog.get_probe(file_or_url_path) if probe_cog else None
+                if probe:
+                    self._apply_track_options(media, probe["audio_track"], probe["subtitle_track"])
+                    tracks_applied = True
+                    logging.info(f"Applied probed tracks for {title}: audio {probe['audio_track']}, subtitles {probe['subtitle_track']}")
+                if start_ms:
+                    media.add_option(f":start-time={start_ms / 1000:.3f}")
 
-            self.media_player.set_media(media)
-            media.release() # Release media object after setting it to player
+                self.media_player.set_media(media)
+                media.release() # Release media object after setting it to player
 
-            # Re-asserting fullscreen can cause flashes. It's set once in cog_load.
-            # self.media_player.set_fullscreen(1)
+                # Re-asserting fullscreen can cause flashes. It's set once in cog_load.
+                # self.media_player.set_fullscreen(1)
+
+                # From here on, stop/end events of the previous item (including the stop above) no longer count
+                self.media_generation += 1
+                play_success = self.media_player.play()
 
-            play_success = self.media_player.play()
             if play_success == -1:
                 await ctx.send(f"Error: Failed to start playback for: {title}")
                 logging.error(f"media_player.play() failed for {title} - {file_or_url_path}")
@@ -73,102 +190,328 @@ class PlaybackCog(commands.Cog):
             PlaybackCog.playing = True
             await ctx.send(f'Playing: {title}')
             self.last_ctx = ctx # store the context.
-            
-            # Start monitoring playback in the background
-            self.bot.loop.create_task(self.monitor_playback(ctx, title))
+            self._on_item_started(file_or_url_path, tracks_applied, switch_started_at, start_ms)
 
         except Exception as e:
             logging.error(f"Error playing media {title}: {e}", exc_info=True)
             await ctx.send(f"Error playing media: {e}")
 
-    async def monitor_playback(self, ctx, title):
-        """Background task to wait for media to finish."""
+    def _on_item_started(self, location, tracks_applied, switch_started_at, start_ms=None):
+        """Starts the per-item helpers once an item is playing, whichever engine started it."""
+        self.current_location = location
+        update = self._watch_update(location)
+        update["started_at"] = update["started_at"] or datetime.datetime.now().isoformat()
+        update["position_ms"] = start_ms or 0
+        # End of playback arrives as a libvlc event; only unprobed items still need a look at their tracks.
+        if not tracks_applied:
+            self.track_selection_task = self.bot.loop.create_task(self._select_tracks_after_start())
+        if switch_started_at is not None:
+            self._start_switch_measurement(switch_started_at, prefetched=location == self.prefetched_location)
+        self.prefetched_location = None
+        self.prefetch_task = self.bot.loop.create_task(self._prefetch_next_near_end())
+        self.prefetch_upcoming_streams()
+
+    def _watch_update(self, location):
+        return self.watch_updates.setdefault(location, {"started_at": None, "ended_at": None, "position_ms": 0, "duration_ms": None, "finished": 0})
+
+    def _sample_watch_position(self):
+        """Buffers the playing item's position, marking it finished once it's past WATCH_FINISHED_FRACTION."""
+        if not self.current_location or not self.media_player:
+            return
+        position_ms = self.media_player.get_time()
+        if position_ms <= 0 or (self.current_location, position_ms) == self.last_watch_sample:
+            return
+        self.last_watch_sample = (self.current_location, position_ms)
+        update = self._watch_update(self.current_location)
+        update["position_ms"] = position_ms
+        length_ms = self.media_player.get_length()
+        if length_ms > 0:
+            update["duration_ms"] = length_ms
+            if position_ms >= length_ms * config.WATCH_FINISHED_FRACTION and not update["finished"]:
+                update["finished"] = 1
+                update["ended_at"] = datetime.datetime.now().isoformat()
+
+    @tasks.loop(seconds=config.WATCH_HISTORY_FLUSH_SECONDS)
+    async def watch_history_loop(self):
+        self._sample_watch_position()
+        await self.flush_watch_history()
+
+    async def flush_watch_history(self):
+        """
+        Writes the buffered watch progress of every item touched since the last flush in one transaction.
+        Goes straight to the media database, since DatabaseCog is already unloaded when this runs on shutdown.
+        None for started_at, ended_at or duration_ms keeps the stored value; the first start is kept.
+        """
+        if not self.watch_updates:
+            return
+        updates, self.watch_updates = self.watch_updates, {}
+        now = datetime.datetime.now().isoformat()
         try:
-            # Wait for VLC to actually start playing (sometimes takes a split second)
-            await asyncio.sleep(1) 
-            
-            # Audio track selection
-            audio_track_id = -1
-            selected_audio_track_name = "Default"
-            try:
-                descriptions = self.media_player.audio_get_track_description() # Call without arguments
-                logging.info(f"Available audio tracks: {descriptions}")
-                if descriptions:
-                    for track_id_val, track_name_bytes in descriptions:
-                        track_name_str = track_name_bytes.decode('utf-8', errors='ignore') if track_name_bytes else ""
-                        if track_name_str and "english" in track_name_str.lower():
-                            audio_track_id = track_id_val
-                            selected_audio_track_name = track_name_str
-                            logging.info(f"Selected English audio track: ID {track_id_val}, Name {track_name_str}")
-                            break
-                    # Fallback: if no English track, and tracks are available, select the first one (excluding 'Disable' if present)
-                    if audio_track_id == -1 and descriptions:
-                        for track_id_val, track_name_bytes in descriptions:
-                            if track_id_val != -1: # -1 is often 'Disable'
-                                audio_track_id = track_id_val
-                                selected_audio_track_name = track_name_bytes.decode('utf-8', errors='ignore') if track_name_bytes else "Unknown"
-                                logging.info(f"No English audio track. Selected first available: ID {audio_track_id}, Name {selected_audio_track_name}")
-                                break
-            except Exception as e:
-                logging.error(f"Error processing audio track descriptions: {e}", exc_info=True)
-
-            # Subtitle track selection
-            subtitle_track_id = -1
-            selected_subtitle_track_name = "None"
-            forced_english_track_id = -1
-            forced_english_track_name = ""
-            try:
-                descriptions = self.media_player.video_get_spu_description() # Call without arguments
-                logging.info(f"Available subtitle tracks: {descriptions}")
-                if descriptions:
-                    for track_id_val, track_name_bytes in descriptions:
-                        track_name_str = track_name_bytes.decode('utf-8', errors='ignore') if track_name_bytes else ""
-                        if track_name_str:
-                            track_name_lower = track_name_str.lower()
-                            if "english" in track_name_lower:
-                                if "forced" in track_name_lower:
-                                    # Store forced English track in case no other English track is found
-                                    if forced_english_track_id == -1: # Only take the first forced one
-                                        forced_english_track_id = track_id_val
-                                        forced_english_track_name = track_name_str
-                                        logging.info(f"Found Forced English subtitle track: ID {track_id_val}, Name {track_name_str}")
-                                else:
-                                    # Prefer non-forced English track
-                                    subtitle_track_id = track_id_val
-                                    selected_subtitle_track_name = track_name_str
-                                    logging.info(f"Selected non-Forced English subtitle track: ID {track_id_val}, Name {track_name_str}")
-                                    break # Found a preferred English track
-                    if subtitle_track_id == -1 and forced_english_track_id != -1:
-                        # If no non-forced English track was found, use the forced one
-                        subtitle_track_id = forced_english_track_id
-                        selected_subtitle_track_name = forced_english_track_name
-                        logging.info(f"Using Forced English subtitle track as fallback: ID {subtitle_track_id}, Name {selected_subtitle_track_name}")
-            except Exception as e:
-                logging.error(f"Error processing subtitle track descriptions: {e}", exc_info=True)
-
-            if audio_track_id != -1:
+            async with db_manager.connection(config.MEDIA_DB) as conn:
+                await conn.executemany(
+                    """
+                    INSERT INTO watch_history (location, started_at, ended_at, last_position_ms, duration_ms, finished, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (location) DO UPDATE SET
+                        started_at = COALESCE(watch_history.started_at, excluded.started_at),
+                        ended_at = COALESCE(excluded.ended_at, watch_history.ended_at),
+                        last_position_ms = excluded.last_position_ms,
+                        duration_ms = COALESCE(excluded.duration_ms, watch_history.duration_ms),
+                        finished = MAX(watch_history.finished, excluded.finished),
+                        updated_at = excluded.updated_at
+                    """,
+                    [
+                        (location, update["started_at"], update["ended_at"], update["position_ms"], update["duration_ms"], update["finished"], now)
+                        for location, update in updates.items()
+                    ]
+                )
+                await conn.commit()
+        except Exception as e:
+            logging.error(f"Database error writing watch history, keeping it buffered: {e}")
+            for location, update in updates.items():
+                newer = self.watch_updates.get(location)
+                if newer is None:
+                    self.watch_updates[location] = update
+                else:
+                    newer["started_at"] = update["started_at"] or newer["started_at"]
+                    newer["ended_at"] = newer["ended_at"] or update["ended_at"]
+                    newer["duration_ms"] = newer["duration_ms"] or update["duration_ms"]
+                    newer["finished"] = max(update["finished"], newer["finished"])
+
+    async def _resolve_queued_stream(self, ctx, location):
+        """
+        Resolves a queued YouTube watch URL to (title, stream URL) right before it plays, and names the playlist
+        entry after the video. Returns None after telling the user if it can't be resolved, skipping ahead
+        when there are more items queued behind it.
+        """
+        processing_msg = None
+        if not self._cached_youtube_stream(youtube.video_id(location) or location):
+            processing_msg = await ctx.send(f"⏳ Fetching YouTube video: <{location}>...")
+        title, stream_url_or_error = await self.get_youtube_info(location, ctx.author.id)
+
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if title:
+            if processing_msg:
+                await processing_msg.delete()
+            if playlist_cog:
+                playlist_cog.shared_playlist.set_title(location, title)
+            return title, stream_url_or_error
+
+        error_message = f"❌ Error: {stream_url_or_error}"
+        if processing_msg:
+            await processing_msg.edit(content=error_message)
+        else:
+            await ctx.send(error_message)
+        if playlist_cog and self._current_playlist_index(location) is not None and playlist_cog.current_index + 1 < len(playlist_cog.shared_playlist):
+            self.bot.loop.create_task(playlist_cog.play_next(ctx))
+        return None
+
+    def prefetch_upcoming_streams(self):
+        """(Re)starts resolving the YouTube items in the next YOUTUBE_PREFETCH_ITEMS playlist slots in the background."""
+        if self.stream_prefetch_task:
+            self.stream_prefetch_task.cancel()
+        self.stream_prefetch_task = self.bot.loop.create_task(self._prefetch_upcoming_streams())
+
+    async def _prefetch_upcoming_streams(self):
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if not playlist_cog:
+            return
+        start = playlist_cog.current_index + 1
+        upcoming = [location for _, location in playlist_cog.shared_playlist[start:start + config.YOUTUBE_PREFETCH_ITEMS]]
+        user = self.last_ctx.author.id if self.last_ctx else None
+        try:
+            for location in upcoming:
+                if not youtube.is_youtube_url(location):
+                    continue
+                title, _ = await self.get_youtube_info(location, user)
+                if title:
+                    playlist_cog.shared_playlist.set_title(location, title)
+        except asyncio.CancelledError:
+            pass
+
+    @staticmethod
+    def _apply_track_options(media, audio_track, subtitle_track):
+        if audio_track is not None:
+            media.add_option(f":audio-track-id={audio_track}")
+        if subtitle_track is not None:
+            media.add_option(f":sub-track-id={subtitle_track}")
+
+    def _current_playlist_index(self, location):
+        """Returns PlaylistCog.current_index if location is the current playlist item, else None."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if playlist_cog and 0 <= playlist_cog.current_index < len(playlist_cog.shared_playlist):
+            if playlist_cog.shared_playlist[playlist_cog.current_index].location == location:
+                return playlist_cog.current_index
+        return None
+
+    async def _load_media_list(self):
+        """(Re)builds the MediaListPlayer's list from PlaylistCog.shared_playlist, with probed track choices applied."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        items = list(playlist_cog.shared_playlist)
+        version = playlist_cog.shared_playlist.version
+        probe_cog = self.bot.get_cog('ProbeCog')
+        track_choices = await probe_cog.get_track_choices([location for _, location in items]) if probe_cog else {}
+
+        media_list = self.instance.media_list_new()
+        media_list_items = {}
+        for index, (_, location) in enumerate(items):
+            media = self.instance.media_new(location)
+            if location in track_choices:
+                self._apply_track_options(media, *track_choices[location])
+            media_list.add_media(media)
+            media_list_items[media._as_parameter_.value] = index # Matched against the pointer in NextItemSet events
+            media.release() # The list holds its own reference
+
+        self.list_player.set_media_list(media_list)
+        if self.media_list is not None:
+            self.media_list.release()
+        self.media_list = media_list
+        self.media_list_items = media_list_items
+        self.media_list_source = items
+        self.media_list_version = version
+        self.media_list_track_choices = track_choices
+        logging.info(f"Loaded {len(items)} items into the gapless media list.")
+
+    def _unload_media_list(self):
+        if self.media_list is not None:
+            self.list_player.set_media_list(self.instance.media_list_new())
+            self.media_list.release()
+        self.media_list = None
+        self.media_list_items = {}
+        self.media_list_source = None
+        self.media_list_version = None
+        self.media_list_track_choices = {}
+
+    def _on_list_event(self, event, loop):
+        """libvlc callback for the MediaListPlayer (runs on a libvlc thread)."""
+        loop.call_soon_threadsafe(self._handle_list_event, event.type.value, event.u.media)
+
+    def _handle_list_event(self, event_type, media_pointer):
+        """Keeps PlaylistCog's index in step with the MediaListPlayer. Runs on the event loop."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if not playlist_cog or self.media_list_source is None:
+            return
+
+        if event_type == vlc.EventType.MediaListPlayerPlayed.value:
+            # The list ran out. Let play_next wrap around, or continue with items added since the list was built.
+            playlist_cog.current_index = len(self.media_list_source) - 1
+            if self.last_ctx:
+                self.bot.loop.create_task(playlist_cog.play_next(self.last_ctx))
+            return
+
+        index = self.media_list_items.get(media_pointer)
+        if index is None:
+            return
+        if self.list_item_requested == index:
+            self.list_item_requested = None # Started by play_media, which has done the bookkeeping
+            return
+
+        # libvlc moved on to the next item by itself
+        self.list_item_requested = None
+        playlist_cog.current_index = index
+        title, location = self.media_list_source[index]
+        if youtube.is_youtube_url(location) and self.last_ctx:
+            # Watch URLs need resolving first; play_media does that and takes the item off the list player
+            self.bot.loop.create_task(self.play_media(self.last_ctx, title, location))
+            return
+        PlaybackCog.playing = True
+        logging.info(f"Gapless playback moved to item {index + 1}: {title}")
+        switch_started_at, self.switch_started_at = self.switch_started_at, None
+        self._stop_switch_measurement()
+        self._on_item_started(location, location in self.media_list_track_choices, switch_started_at)
+        if self.last_ctx:
+            self.bot.loop.create_task(self.last_ctx.send(f'Playing: {title}'))
+
+    def _select_tracks_live(self):
+        """Picks English audio and subtitle tracks from the playing media (for items the prober hasn't seen)."""
+        try:
+            descriptions = self.media_player.audio_get_track_description() # Call without arguments
+            logging.info(f"Available audio tracks: {descriptions}")
+            audio_track_id = media_probe.choose_audio_track([(track_id, media_probe.decode_name(name)) for track_id, name in descriptions or []])
+            if audio_track_id is not None:
                 self.media_player.audio_set_track(audio_track_id)
                 logging.info(f"Audio track set to {audio_track_id}")
+        except Exception as e:
+            logging.error(f"Error processing audio track descriptions: {e}", exc_info=True)
 
-            if subtitle_track_id != -1:
+        try:
+            descriptions = self.media_player.video_get_spu_description() # Call without arguments
+            logging.info(f"Available subtitle tracks: {descriptions}")
+            subtitle_track_id = media_probe.choose_subtitle_track([(track_id, media_probe.decode_name(name)) for track_id, name in descriptions or []])
+            if subtitle_track_id is not None:
                 self.media_player.video_set_spu(subtitle_track_id)
                 logging.info(f"Subtitle track set to {subtitle_track_id}")
-
-            while self.media_player.get_state() not in [vlc.State.Ended, vlc.State.Error, vlc.State.Stopped]:
-                await asyncio.sleep(1)
-            
-            logging.info(f"Playback loop finished. State: {self.media_player.get_state()}")
-
-            if self.media_player.get_state() == vlc.State.Ended:
-                playlist_cog = self.bot.get_cog('PlaylistCog')
-                if playlist_cog:
-                    # This is now safe because we are in a separate task, not the recursion stack
-                    await playlist_cog.play_next(ctx)
-                    
         except Exception as e:
-            logging.error(f"Error in monitor_playback for {title}: {e}")
-        finally:
-            PlaybackCog.playing = False
+            logging.error(f"Error processing subtitle track descriptions: {e}", exc_info=True)
+
+    def _next_local_item(self):
+        """Returns (location, local path) of the next playlist item, or None if there is none or it isn't a local file."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if not playlist_cog or playlist_cog.current_index + 1 >= len(playlist_cog.shared_playlist):
+            return None
+        _, location = playlist_cog.shared_playlist[playlist_cog.current_index + 1]
+        path = location_to_path(location)
+        return (location, path) if path else None
+
+    async def _prefetch_next_near_end(self):
+        """Warms the next local playlist item PREFETCH_LEAD_SECONDS before the current one ends."""
+        try:
+            while True:
+                length_ms = self.media_player.get_length()
+                time_ms = self.media_player.get_time()
+                if length_ms <= 0 or time_ms < 0:
+                    await asyncio.sleep(5) # Length isn't known until VLC has opened the item
+                    continue
+                wait_seconds = (length_ms - time_ms) / 1000 - config.PREFETCH_LEAD_SECONDS
+                if wait_seconds <= 0:
+                    break
+                await asyncio.sleep(min(wait_seconds, 60)) # Re-check now and then; seeks and pauses move the end
+
+            self.prefetch_upcoming_streams() # Re-resolves the next stream if its URL lapsed during this item
+            next_item = self._next_local_item()
+            if not next_item:
+                return
+            location, path = next_item
+            started = time.perf_counter()
+            warmed = await asyncio.to_thread(prefetch.warm_file, path, config.PREFETCH_HEAD_BYTES, config.PREFETCH_TAIL_BYTES)
+            self.prefetched_location = location
+            logging.info(f"Prefetched {warmed / (1024 * 1024):.1f} MB of next item '{path}' in {(time.perf_counter() - started) * 1000:.0f} ms.")
+        except asyncio.CancelledError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not prefetch next item: {e}")
+
+    def _start_switch_measurement(self, started_at, prefetched):
+        """Times the gap from the end of the last item to the first frame of this one (its first time change)."""
+        self.switch_measurement = (started_at, prefetched)
+        loop = asyncio.get_running_loop()
+        generation = self.media_generation
+        self.media_player.event_manager().event_attach(
+            vlc.EventType.MediaPlayerTimeChanged,
+            lambda event: loop.call_soon_threadsafe(self._finish_switch_measurement, generation)
+        )
+
+    def _stop_switch_measurement(self):
+        if self.switch_measurement is not None:
+            self.switch_measurement = None
+            self.media_player.event_manager().event_detach(vlc.EventType.MediaPlayerTimeChanged)
+
+    def _finish_switch_measurement(self, generation):
+        if self.switch_measurement is None or generation != self.media_generation:
+            return
+        started_at, prefetched = self.switch_measurement
+        self._stop_switch_measurement()
+        self.last_switch_gap_ms = (time.perf_counter() - started_at) * 1000
+        logging.info(f"Switch gap: {self.last_switch_gap_ms:.0f} ms to the next item's first frame ({'prefetched' if prefetched else 'cold read'}).")
+
+    async def _select_tracks_after_start(self):
+        """Picks tracks for an unprobed item once VLC has had a moment to open it."""
+        try:
+            # Wait for VLC to actually start playing (sometimes takes a split second)
+            await asyncio.sleep(1)
+            self._select_tracks_live()
+        except asyncio.CancelledError:
+            pass
 
     def format_time(self, milliseconds):
         seconds = milliseconds // 1000
@@ -189,103 +532,98 @@ class PlaybackCog(commands.Cog):
             await ctx.send(f'Error: {e}')
 
     async def get_playlist_from_input(self, ctx, playlist_input):
+        """
+        Resolves a playlist number, exact playlist name, or free-text search to (playlist name, start_index).
+        Free text plays the best search match: a matching playlist from the start, or a matching episode's playlist from that episode.
+        Returns (None, 0) after telling the user when nothing matches.
+        """
         database_cog = self.bot.get_cog('DatabaseCog')
         if not database_cog:
             await ctx.send("Error: Database cog not loaded.")
-            return None
+            return None, 0
 
         media_library = await database_cog.get_media_library()
-        keys = list(media_library.keys())
+        keys = await database_cog.get_media_names()
 
         try:
             index = int(playlist_input) - 1
             if 0 <= index < len(keys):
-                return media_library[keys[index]]
+                return keys[index], 0
             else:
                 await ctx.send(f"Invalid playlist number. Please provide a number between 1 and {len(keys)}.")
-                return None
+                return None, 0
         except ValueError:
             if playlist_input in media_library:
-                return media_library[playlist_input]
-            else:
-                await ctx.send(f"Playlist '{playlist_input}' not found.")
-                return None
-
-    async def get_youtube_info(self, url):
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-        }
-        try:
-            logging.info(f"yt-dlp: Attempting to extract info for {url}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                video_url = info.get('url')
-                title = info.get('title', 'Unknown YouTube Video')
-
-                if not video_url:
-                    logging.error(f"yt-dlp: Could not extract 'url' directly from info for {url} using primary format. Checking 'formats' list as fallback.")
-                    
-                    selected_format_info = None
-                    if 'formats' in info:
-                        # Priority 1: MP4 with video and audio
-                        for f_info in reversed(info['formats']):
-                            if f_info.get('url','').startswith('http') and \
-                               f_info.get('vcodec') != 'none' and f_info.get('vcodec') is not None and \
-                               f_info.get('acodec') != 'none' and f_info.get('acodec') is not None and \
-                               f_info.get('ext') == 'mp4':
-                                selected_format_info = f_info
-                                break
-                        
-                        # Priority 2: Any format with video and audio
-                        if not selected_format_info:
-                            for f_info in reversed(info['formats']):
-                                if f_info.get('url','').startswith('http') and \
-                                   f_info.get('vcodec') != 'none' and f_info.get('vcodec') is not None and \
-                                   f_info.get('acodec') != 'none' and f_info.get('acodec') is not None:
-                                    selected_format_info = f_info
-                                    break
-                        
-                        # Priority 3: As a last resort for audio, pick any format with audio, even if audio-only.
-                        # This might be less desirable if video is expected, but ensures audio if the above fail.
-                        if not selected_format_info:
-                            for f_info in reversed(info['formats']):
-                                if f_info.get('url','').startswith('http') and \
-                                   f_info.get('acodec') != 'none' and f_info.get('acodec') is not None:
-                                    selected_format_info = f_info
-                                    logging.warning(f"yt-dlp: Fallback selected a format that might be audio-only to ensure audio presence: {f_info.get('format_id')}")
-                                    break
-                    
-                    if selected_format_info:
-                        video_url = selected_format_info.get('url')
-                        title = info.get('title', selected_format_info.get('title', 'Unknown YouTube Video')) # Keep original title if possible
-                        logging.info(f"yt-dlp: Using fallback format. URL: {video_url} (Format ID: {selected_format_info.get('format_id')}, vcodec: {selected_format_info.get('vcodec')}, acodec: {selected_format_info.get('acodec')})")
-                
-                if not video_url:
-                    logging.error(f"yt-dlp: Failed to get a streamable URL for {url}.")
-                    return None, "Failed to get a streamable URL from YouTube."
-
-                logging.info(f"yt-dlp: Extracted title='{title}', url='{video_url}'")
-                return title, video_url
-        except yt_dlp.utils.DownloadError as e:
-            logging.error(f"yt-dlp DownloadError for {url}: {e}")
-            error_message = str(e)
-            user_friendly_error = "Could not process YouTube link (video may be unavailable, private, or region-locked)."
-            if "is not available" in error_message or "Private video" in error_message or "Video unavailable" in error_message:
-                pass # Default message is good
-            return None, user_friendly_error
-        except Exception as e:
-            logging.error(f"yt-dlp: Unexpected error for {url}: {e}", exc_info=True)
-            return None, "An unexpected error occurred while fetching YouTube video information."
+                return playlist_input, 0
+
+            match = await database_cog.find_best_match(playlist_input)
+            if match and match[0] in media_library:
+                name, position, title = match
+                if position is None:
+                    await ctx.send(f"🔎 Best match for '{playlist_input}': playlist **{name}**.")
+                    return name, 0
+                await ctx.send(f"🔎 Best match for '{playlist_input}': **{title}** (#{position + 1} in *{name}*).")
+                return name, position
+
+            await ctx.send(f"Playlist '{playlist_input}' not found.")
+            return None, 0
+
+    async def get_youtube_info(self, url, user=None):
+        """
+        Returns (title, stream URL), or (None, error message). Resolved streams are cached per video id until
+        shortly before their URL expires, and concurrent requests for the same video share one extraction.
+        Extractions run in the resolver's worker processes, queued fairly per user (a Discord user id).
+        """
+        key = youtube.video_id(url) or url
+        cached = self._cached_youtube_stream(key)
+        if cached:
+            logging.info(f"yt-dlp: Using cached stream for {key} ('{cached[0]}')")
+            return cached
+
+        extraction = self.youtube_extractions.get(key)
+        if extraction is None:
+            extraction = self.bot.loop.create_task(self._resolve_youtube(key, url, user))
+            self.youtube_extractions[key] = extraction
+            extraction.add_done_callback(lambda _: self.youtube_extractions.pop(key, None))
+        else:
+            logging.info(f"yt-dlp: Joining the extraction already running for {key}")
+        # Shielded so one caller being cancelled doesn't cancel the extraction for the others
+        return await asyncio.shield(extraction)
+
+    async def _resolve_youtube(self, key, url, user):
+        title, stream_url_or_error = await self.youtube_resolver.resolve(url, user)
+        if title:
+            self._cache_youtube_stream(key, title, stream_url_or_error)
+        return title, stream_url_or_error
+
+    def _cached_youtube_stream(self, key):
+        """Returns (title, stream URL) if key's stream is cached and still fresh, else None."""
+        cached = self.youtube_cache.get(key)
+        if not cached:
+            return None
+        title, stream_url, expires_at = cached
+        if time.time() >= expires_at:
+            del self.youtube_cache[key]
+            return None
+        return title, stream_url
+
+    def _cache_youtube_stream(self, key, title, stream_url):
+        now = time.time()
+        expire = youtube.stream_expiry(stream_url)
+        expires_at = (expire if expire else now + config.YOUTUBE_CACHE_DEFAULT_TTL_SECONDS) - config.YOUTUBE_CACHE_EXPIRY_MARGIN_SECONDS
+        if expires_at <= now:
+            return
+        for stale_key in [k for k, (_, _, stale_at) in self.youtube_cache.items() if stale_at <= now]:
+            del self.youtube_cache[stale_key]
+        while len(self.youtube_cache) >= config.YOUTUBE_CACHE_SIZE:
+            del self.youtube_cache[next(iter(self.youtube_cache))] # Oldest first
+        self.youtube_cache[key] = (title, stream_url, expires_at)
 
     @commands.command(brief="Plays a media playlist file or YouTube URL ▶️.", aliases=['p'])
     async def play(self, ctx, *, media_input: str = None):
         try:
             if not media_input:
-                await ctx.send("Usage: `!play <XSPF_playlist_name_or_number | YouTube_URL>`")
+                await ctx.send("Usage: `!play <XSPF_playlist_name_or_number | search text | YouTube_URL>`")
                 return
 
             playlist_cog = self.bot.get_cog('PlaylistCog')
@@ -294,54 +632,101 @@ class PlaybackCog(commands.Cog):
                 return
 
             # Stop any current playback before clearing playlist and loading new media.
-            if self.media_player and (self.media_player.is_playing() or self.media_player.get_state() == vlc.State.Paused):
-                self.media_player.stop()
-                logging.info("Stopped current playback due to new !play command.")
-
-            playlist_cog.shared_playlist.clear()
-            playlist_cog.original_playlist.clear()
-            playlist_cog.current_index = 0 # Reset index for the new playlist
-            playlist_cog.shuffled = False
-            self.last_ctx = ctx # store the context.
+            self._reset_playlist(ctx)
 
             # Check if input is a YouTube URL
-            if "youtube.com/" in media_input or "youtu.be/" in media_input:
-                processing_msg = await ctx.send(f"⏳ Fetching YouTube video: <{media_input}>...")
-                title, stream_url_or_error = await self.get_youtube_info(media_input)
-                
-                if title and stream_url_or_error and stream_url_or_error.startswith('http'): # Successfully got URL
-                    playlist_cog.shared_playlist.append((title, stream_url_or_error))
-                    await processing_msg.edit(content=f"✅ Added '{title}' to playlist from YouTube.")
-                    await self.play_media(ctx, title, stream_url_or_error) # current_index is 0
-                else: # stream_url_or_error contains the error message
-                    error_detail = stream_url_or_error if isinstance(stream_url_or_error, str) else "Could not play YouTube video. Check logs."
-                    await processing_msg.edit(content=f"❌ Error: {error_detail}")
+            collection = youtube.collection_url(media_input)
+            if collection:
+                await playlist_cog.queue_youtube_collection(ctx, collection, start_playback=True)
+                return
+            if youtube.is_youtube_url(media_input):
+                # The watch URL is queued as is; play_media resolves it to a stream
+                title = youtube.placeholder_title(media_input)
+                playlist_cog.shared_playlist.append(title, media_input)
+                await self.play_media(ctx, title, media_input) # current_index is 0
                 return
             else: # Existing XSPF playlist logic
-                file_path = await self.get_playlist_from_input(ctx, media_input)
-                if not file_path: # get_playlist_from_input sends its own message
+                playlist_name, start_index = await self.get_playlist_from_input(ctx, media_input)
+                if not playlist_name: # get_playlist_from_input sends its own message
                     return
 
-                media_files = parse_xspf(file_path)
-                if not media_files:
-                    await ctx.send(f"Error: No valid media files found in XSPF playlist: {media_input}")
-                    return
-
-                for title, media_file_path_item in media_files:
-                    playlist_cog.shared_playlist.append((title, media_file_path_item))
-                
-                if not playlist_cog.shared_playlist:
-                    await ctx.send(f"Playlist '{media_input}' is empty or could not be loaded.")
-                    return
-                
-                await ctx.send(f"Added {len(media_files)} items to playlist from '{media_input}'.")
-                first_title, first_file_path = playlist_cog.shared_playlist[0] # current_index is 0
-                await self.play_media(ctx, first_title, first_file_path)
+                database_cog = self.bot.get_cog('DatabaseCog')
+                media_files = await database_cog.get_playlist_tracks(playlist_name)
+                await self._play_tracks(ctx, media_files, media_input, start_index)
 
         except Exception as e:
             logging.error(f"General Error in play command: {e}", exc_info=True)
             await ctx.send(f'Error in play command: {e}')
 
+    def _reset_playlist(self, ctx):
+        """Stops playback and empties the shared playlist before a new one is loaded."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if self.media_player and (self.media_player.is_playing() or self.media_player.get_state() == vlc.State.Paused):
+            self._sample_watch_position()
+            self.media_player.stop()
+            logging.info("Stopped current playback for a new playlist.")
+
+        playlist_cog.ingest_generation += 1 # Stops a YouTube playlist still being queued
+        playlist_cog.shared_playlist.clear()
+        playlist_cog.current_index = 0 # Reset index for the new playlist
+        self.last_ctx = ctx # store the context.
+
+    async def _play_tracks(self, ctx, media_files, label, start_index=0, start_ms=None):
+        """Fills the (already reset) shared playlist with a library playlist's tracks and plays from start_index."""
+        playlist_cog = self.bot.get_cog('PlaylistCog')
+        if not media_files:
+            await ctx.send(f"Error: No valid media files found in XSPF playlist: {label}")
+            return
+
+        playlist_cog.shared_playlist.extend(media_files)
+
+        if not playlist_cog.shared_playlist:
+            await ctx.send(f"Playlist '{label}' is empty or could not be loaded.")
+            return
+
+        await ctx.send(f"Added {len(media_files)} items to playlist from '{label}'.")
+        if 0 <= start_index < len(playlist_cog.shared_playlist):
+            playlist_cog.current_index = start_index # Searched for an episode; start there
+        first_title, first_file_path = playlist_cog.shared_playlist[playlist_cog.current_index]
+        await self.play_media(ctx, first_title, first_file_path, start_ms=start_ms)
+
+    @commands.command(brief="Resumes a playlist at the first episode not watched to the end ⏯️.", aliases=['res'])
+    async def resume(self, ctx, *, playlist_input: str = None):
+        """Loads a library playlist and starts at its first unfinished item, a few seconds before where it was left."""
+        try:
+            if not playlist_input:
+                await ctx.send("Usage: `!resume <XSPF_playlist_name_or_number | search text>`")
+                return
+
+            playlist_cog = self.bot.get_cog('PlaylistCog')
+            database_cog = self.bot.get_cog('DatabaseCog')
+            if not playlist_cog or not database_cog:
+                await ctx.send("Error: Playlist or database cog not loaded.")
+                return
+
+            playlist_name, _ = await self.get_playlist_from_input(ctx, playlist_input)
+            if not playlist_name: # get_playlist_from_input sends its own message
+                return
+
+            self._reset_playlist(ctx)
+            media_files = await database_cog.get_playlist_tracks(playlist_name) # Re-ingests first, so positions match
+            await self.flush_watch_history() # Include the progress of what was just stopped
+            resume_point = await database_cog.get_resume_point(playlist_name)
+            if resume_point is None:
+                await ctx.send(f"Everything in '{playlist_name}' has been watched; starting from the beginning.")
+                start_index, start_ms = 0, None
+            else:
+                start_index, last_position_ms = resume_point
+                start_ms = max(last_position_ms - config.WATCH_RESUME_REWIND_SECONDS * 1000, 0) or None
+                if 0 <= start_index < len(media_files):
+                    where = f" at {self.format_time(start_ms)}" if start_ms else ""
+                    await ctx.send(f"⏯️ Resuming '{playlist_name}' at #{start_index + 1}: **{media_files[start_index][0]}**{where}.")
+            await self._play_tracks(ctx, media_files, playlist_name, start_index, start_ms)
+
+        except Exception as e:
+            logging.error(f"General Error in resume command: {e}", exc_info=True)
+            await ctx.send(f'Error in resume command: {e}')
+
     @commands.command(brief="Pauses and unpauses the current playback ⏯️.", aliases=['pa'])
     async def pause(self, ctx):
         await self._handle_playback_command(ctx, self.media_player.pause, "Playback paused ⏸️." if self.media_player.is_playing() else "Playback resumed▶️.")
@@ -1,67 +1,50 @@
 import discord
 from discord.ext import commands
 import logging
-import random
-from copy import deepcopy
 import asyncio
 import vlc # Required for vlc.State
+import config
+import youtube
+from track_queue import TrackQueue
 
 class PlaylistCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.shared_playlist = []
-        self.original_playlist = []
+        self.shared_playlist = TrackQueue()
         self.current_index = 0
-        self.shuffled = False
         self.first_next = False  # flag to track first next call.
+        self.ingest_generation = 0 # Bumped when the playlist is replaced, to stop a running YouTube playlist ingest
+        self._runtime_cache = None # ((queue version, durations generation, known durations), prefix sums, unknown count) for the runtime footer
 
-    @commands.command(brief="Displays the current playlist📃.", aliases=['pl'])
-    async def playlist(self, ctx):
+    @commands.command(brief="Displays the current playlist📃. Usage: !playlist [page]", aliases=['pl'])
+    async def playlist(self, ctx, page: int = 1):
         """
-        Displays the current playlist with pagination and an exit button.
-        The currently playing video is shown first.
+        Displays the current playlist with pagination, a jump-to-page control and an exit button.
+        The currently playing video is shown first. Only the page being viewed is ever rendered.
         """
         if not self.shared_playlist:
             await ctx.send("The shared playlist is empty.")
             return
 
-        playlist_display = []
-        if 0 <= self.current_index < len(self.shared_playlist):
-            current_title, _ = self.shared_playlist[self.current_index]
-            playlist_display.append(f"**Currently Playing:** {current_title}")
+        current_page = page - 1
 
-        # Display the rest of the playlist starting from the next item
-        for i in range(self.current_index + 1, len(self.shared_playlist)):
-            title, _ = self.shared_playlist[i]
-            playlist_display.append(f"{i + 1}. {title}")
-
-        # Display the items before the currently playing item
-        for i in range(0, self.current_index):
-            title, _ = self.shared_playlist[i]
-            playlist_display.append(f"{i + 1}. {title}")
-
-        chunk_size = 10  # Number of items per page
-        chunks = [playlist_display[i:i + chunk_size] for i in range(0, len(playlist_display), chunk_size)]
-        current_page = 0
-
-        if not chunks:  # Check if chunks is empty.
-            await ctx.send("The playlist is empty or could not be displayed.")
-            return
-
-        async def update_message(page):
-            if not chunks:
-                return discord.Embed(title="Now Playing 🍿", description="Playlist is empty")
-            playlist_str = "\n".join(chunks[page])
-            embed = discord.Embed(title="Now Playing 🍿", description=playlist_str)
-            embed.set_footer(text=f"Page {page + 1}/{len(chunks)}")
-            return embed
+        def update_message(page):
+            page_count = self._page_count()
+            if not page_count:
+                return discord.Embed(title="Now Playing 🍿", description="Playlist is empty"), 0
+            page = min(max(page, 0), page_count - 1) # The queue may have shrunk since the view opened
+            embed = discord.Embed(title="Now Playing 🍿", description="\n".join(self._render_page(page)))
+            runtime_summary = self._runtime_summary() # Whole playlist, as of this render; cached per queue version
+            embed.set_footer(text=f"Page {page + 1}/{page_count}" + (f" • Whole playlist: {runtime_summary}" if runtime_summary else ""))
+            return embed, page
 
-        embed = await update_message(current_page)
+        embed, current_page = update_message(current_page)
         message = await ctx.send(embed=embed)
 
-        if len(chunks) > 1:
+        if self._page_count() > 1:
             await message.add_reaction("⬅️")
             await message.add_reaction("➡️")
+            await message.add_reaction("🔢") # Jump to page
             await message.add_reaction("❌")  # exit button.
             await message.add_reaction("📱") # Show Remote
             await message.add_reaction("🍃") # Join/Start Toke
@@ -72,15 +55,20 @@ class PlaylistCog(commands.Cog):
 
 
         def check(reaction, user):
-            return user == ctx.author and str(reaction.emoji) in ["⬅️", "➡️", "❌", "📱", "🍃"] and reaction.message.id == message.id
+            return user == ctx.author and str(reaction.emoji) in ["⬅️", "➡️", "🔢", "❌", "📱", "🍃"] and reaction.message.id == message.id
 
         while True:
             try:
                 reaction, user = await self.bot.wait_for("reaction_add", timeout=60.0, check=check)
+                page_count = max(self._page_count(), 1)
                 if str(reaction.emoji) == "➡️":
-                    current_page = (current_page + 1) % len(chunks)
+                    current_page = (current_page + 1) % page_count
                 elif str(reaction.emoji) == "⬅️":
-                    current_page = (current_page - 1) % len(chunks)
+                    current_page = (current_page - 1) % page_count
+                elif str(reaction.emoji) == "🔢":
+                    requested_page = await self._ask_for_page(ctx, page_count)
+                    if requested_page is not None:
+                        current_page = requested_page
                 elif str(reaction.emoji) == "❌":
                     try:
                         await message.delete()
@@ -104,12 +92,81 @@ class PlaylistCog(commands.Cog):
                     await message.remove_reaction(reaction, user)
                     continue # Continue listening for other reactions
 
-                await message.edit(embed=await update_message(current_page))
+                embed, current_page = update_message(current_page)
+                await message.edit(embed=embed)
                 await message.remove_reaction(reaction, user)
             except asyncio.TimeoutError:
                 await message.clear_reactions()
                 break
 
+    def _page_count(self):
+        return -(-len(self.shared_playlist) // config.PLAYLIST_PAGE_SIZE)
+
+    def _render_page(self, page):
+        """
+        Returns the lines of one page of the playlist view: the current item first, then the items after it,
+        then the ones before it. Each line maps straight to a queue position, so only this page is formatted.
+        """
+        length = len(self.shared_playlist)
+        has_current = 0 <= self.current_index < length
+        first_row = page * config.PLAYLIST_PAGE_SIZE
+        lines = []
+        for row in range(first_row, min(first_row + config.PLAYLIST_PAGE_SIZE, length)):
+            if not has_current:
+                i = row
+            else:
+                i = (self.current_index + row) % length
+            title, _ = self.shared_playlist[i]
+            lines.append(f"**Currently Playing:** {title}" if has_current and row == 0 else f"{i + 1}. {title}")
+        return lines
+
+    async def _ask_for_page(self, ctx, page_count):
+        """Asks the playlist viewer for a page number. Returns it 0-based, or None if they don't answer with a valid one."""
+        prompt = await ctx.send(f"🔢 Which page? (1-{page_count})")
+
+        def check(reply):
+            return reply.author == ctx.author and reply.channel == ctx.channel and reply.content.strip().isdigit()
+
+        try:
+            reply = await self.bot.wait_for("message", timeout=20.0, check=check)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            try:
+                await prompt.delete()
+            except discord.HTTPException:
+                pass # Already deleted
+        try:
+            await reply.delete()
+        except discord.HTTPException:
+            pass # No permission to tidy up; the number stays in the channel
+        requested_page = int(reply.content) - 1
+        return requested_page if 0 <= requested_page < page_count else None
+
+    def _runtime_summary(self):
+        """Total and remaining runtime of the playlist from probed durations, e.g. 'Total 10:42:00 • Remaining 3:05:12'."""
+        probe_cog = self.bot.get_cog('ProbeCog')
+        playback_cog = self.bot.get_cog('PlaybackCog')
+        if not probe_cog or not playback_cog:
+            return ""
+
+        # Prefix sums over the queue, rebuilt only when the queue or the set of known durations changes
+        key = (self.shared_playlist.version, probe_cog.durations_generation, len(probe_cog.durations))
+        if self._runtime_cache is None or self._runtime_cache[0] != key:
+            self._runtime_cache = (key, *probe_cog.get_runtime_prefix(track.location for track in self.shared_playlist))
+        _, prefix, unknown = self._runtime_cache
+
+        total_ms = prefix[-1]
+        if not total_ms:
+            return ""
+        current_index = min(max(self.current_index, 0), len(prefix) - 1)
+        remaining_ms = total_ms - prefix[current_index]
+        if playback_cog.media_player and 0 <= self.current_index < len(self.shared_playlist) and prefix[self.current_index + 1] > prefix[self.current_index]:
+            elapsed_ms = max(playback_cog.media_player.get_time(), 0)
+            remaining_ms = max(remaining_ms - elapsed_ms, 0)
+        approximate = "+" if unknown else "" # Some items have no known duration yet
+        return f"Total {playback_cog.format_time(total_ms)}{approximate} • Remaining {playback_cog.format_time(remaining_ms)}{approximate}"
+
     async def play_next(self, ctx):
         try:
             logging.info(f"play_next called. Current index: {self.current_index}, Playlist length: {len(self.shared_playlist)}")
@@ -191,13 +248,13 @@ class PlaylistCog(commands.Cog):
             logging.error(f'Error in jump command: {e}')
             await ctx.send(f'Error in jump command: {e}')
 
-    @commands.command(brief="Adds a YouTube video to the current playlist ➕.", aliases=['q', 'enqueue'])
+    @commands.command(brief="Adds a YouTube video, playlist or channel to the current playlist ➕.", aliases=['q', 'enqueue'])
     async def add(self, ctx, *, youtube_url: str = None):
         if not youtube_url:
-            await ctx.send("Usage: `!add <YouTube_URL>`")
+            await ctx.send("Usage: `!add <YouTube video, playlist or channel URL>`")
             return
 
-        if not ("youtube.com/" in youtube_url or "youtu.be/" in youtube_url):
+        if not youtube.is_youtube_url(youtube_url):
             await ctx.send("Error: Only YouTube URLs are supported for the `!add` command.")
             return
 
@@ -209,30 +266,78 @@ class PlaylistCog(commands.Cog):
             await ctx.send("Error: Media player in PlaybackCog is not initialized.")
             return
 
-        processing_msg = await ctx.send(f"⏳ Fetching YouTube video to add: <{youtube_url}>...")
-        title, stream_url_or_error = await playback_cog.get_youtube_info(youtube_url)
-
-        if title and stream_url_or_error and stream_url_or_error.startswith('http'): # Successfully got URL
-            self.shared_playlist.append((title, stream_url_or_error))
-            # If the original playlist is being used (not shuffled), also add there.
-            if not self.shuffled:
-                 self.original_playlist.append((title, stream_url_or_error))
-
-            await processing_msg.edit(content=f"✅ Added '{title}' to the playlist.")
-
-            # If nothing is currently playing, start playing the newly added song.
-            is_player_idle = playback_cog.media_player.get_state() in [vlc.State.NothingSpecial, vlc.State.Stopped, vlc.State.Ended, vlc.State.Error]
-            
-            if not playback_cog.playing and is_player_idle:
-                logging.info(f"Nothing was playing. Starting playback for newly added: {title}")
-                self.current_index = len(self.shared_playlist) - 1 # Set index to the newly added item
-                await playback_cog.play_media(ctx, title, stream_url_or_error)
-            elif not self.shared_playlist: # If playlist was empty and something was added
-                self.current_index = 0
-                await playback_cog.play_media(ctx, title, stream_url_or_error)
-        else: # stream_url_or_error contains the error message
-            error_detail = stream_url_or_error if isinstance(stream_url_or_error, str) else "Could not process YouTube video. Check logs."
-            await processing_msg.edit(content=f"❌ Error adding video: {error_detail}")
+        # If nothing is currently playing, start playing the newly added song.
+        is_player_idle = playback_cog.media_player.get_state() in [vlc.State.NothingSpecial, vlc.State.Stopped, vlc.State.Ended, vlc.State.Error]
+
+        collection = youtube.collection_url(youtube_url)
+        if collection:
+            await self.queue_youtube_collection(ctx, collection, start_playback=not playback_cog.playing and is_player_idle)
+            return
+
+        # Queued as the watch URL and resolved to a stream only when it comes up, so queueing is instant and
+        # the stream URL can't expire while the item waits.
+        title = youtube.placeholder_title(youtube_url)
+        self.shared_playlist.append(title, youtube_url)
+
+        await ctx.send(f"✅ Added <{youtube_url}> to the playlist at #{len(self.shared_playlist)}.")
+
+        if not playback_cog.playing and is_player_idle:
+            logging.info(f"Nothing was playing. Starting playback for newly added: {youtube_url}")
+            self.current_index = len(self.shared_playlist) - 1 # Set index to the newly added item
+            await playback_cog.play_media(ctx, title, youtube_url)
+        elif len(self.shared_playlist) - 1 - self.current_index <= config.YOUTUBE_PREFETCH_ITEMS:
+            playback_cog.prefetch_upcoming_streams() # Landed in the prefetch window
+
+    async def queue_youtube_collection(self, ctx, url, start_playback):
+        """
+        Streams a YouTube playlist or channel into the shared playlist a page at a time with flat extraction, editing
+        one progress message as it goes. Entries are queued as watch URLs and resolved when they come up. Starts
+        playback on the first entry if start_playback is set. Stops early if the playlist is cleared or replaced.
+        """
+        playback_cog = self.bot.get_cog('PlaybackCog')
+        generation = self.ingest_generation
+        progress_msg = await ctx.send(f"⏳ Reading YouTube playlist: <{url}>...")
+        playlist_title = url
+        queued = 0
+        capped = False
+        start = 1
+        page_size = config.YOUTUBE_PLAYLIST_FIRST_PAGE # Small, so playback starts right away
+        while True:
+            end = min(start + page_size - 1, config.YOUTUBE_PLAYLIST_MAX_ITEMS)
+            title, entries = await playback_cog.youtube_resolver.list_playlist(url, start, end, ctx.author.id)
+            if generation != self.ingest_generation:
+                await progress_msg.edit(content=f"⏹️ Stopped queuing *{playlist_title}* after {queued} videos.")
+                return
+            if title is None: # entries holds the error message
+                await progress_msg.edit(content=f"❌ Error: {entries}" + (f" ({queued} videos were queued.)" if queued else ""))
+                return
+
+            playlist_title = title
+            videos = [entry for entry in entries if entry]
+            first_new = len(self.shared_playlist)
+            self.shared_playlist.extend(videos)
+            queued += len(videos)
+            if videos and start_playback:
+                start_playback = False
+                self.current_index = first_new
+                self.bot.loop.create_task(playback_cog.play_media(ctx, *self.shared_playlist[first_new]))
+            elif videos and first_new - self.current_index <= config.YOUTUBE_PREFETCH_ITEMS:
+                playback_cog.prefetch_upcoming_streams() # Landed in the prefetch window
+
+            if len(entries) < end - start + 1: # Last page
+                break
+            if end >= config.YOUTUBE_PLAYLIST_MAX_ITEMS:
+                capped = True
+                break
+            start = end + 1
+            page_size = config.YOUTUBE_PLAYLIST_PAGE_SIZE
+            await progress_msg.edit(content=f"⏳ Queuing *{playlist_title}*: {queued} videos so far...")
+
+        if not queued:
+            await progress_msg.edit(content=f"❌ No playable videos found in <{url}>.")
+            return
+        limit_note = f" (stopped at the first {config.YOUTUBE_PLAYLIST_MAX_ITEMS} entries)" if capped else ""
+        await progress_msg.edit(content=f"✅ Queued {queued} videos from *{playlist_title}*{limit_note}.")
 
     @commands.command(brief="Shuffles the playlist🔀.")
     async def shuffle(self, ctx):
@@ -241,13 +346,8 @@ class PlaylistCog(commands.Cog):
             await ctx.send("Playlist is empty!")
             return
 
-        # Backup original order before first shuffle
-        if not self.original_playlist:
-            self.original_playlist = deepcopy(self.shared_playlist)
-
-        random.shuffle(self.shared_playlist)
+        self.shared_playlist.shuffle() # Only the play order changes; the queue order is kept for unshuffle
         self.current_index = 0 # change to 0 from -1.
-        self.shuffled = True
         await ctx.send("🔀 Playlist shuffled!")
 
         # Immediately play the first track of the shuffled playlist
@@ -263,23 +363,13 @@ class PlaylistCog(commands.Cog):
     @commands.command(brief="Restores original playlist order 🔙.")
     async def unshuffle(self, ctx):
         """Restores the playlist to its pre-shuffle order, maintaining current playback position"""
-        if not self.original_playlist:
+        if not self.shared_playlist:
             await ctx.send("No original order to restore!")
             return
 
-        if self.shuffled:
-            # Find current item in original playlist
-            if 0 <= self.current_index < len(self.shared_playlist):
-                current_item = self.shared_playlist[self.current_index]
-                try:
-                    self.current_index = self.original_playlist.index(current_item)
-                except ValueError:
-                    self.current_index = -1  # if current item is not found.
-            else:
-                self.current_index = -1
-
-            self.shared_playlist = deepcopy(self.original_playlist)
-            self.shuffled = False
+        if self.shared_playlist.shuffled:
+            # The current item's place in the original order comes straight from the shuffle permutation
+            self.current_index = self.shared_playlist.unshuffle(self.current_index)
             await ctx.send("⏮️ Original playlist restored!")
         else:
             await ctx.send("Playlist is not currently shuffled.")
@@ -287,10 +377,9 @@ class PlaylistCog(commands.Cog):
     @commands.command(brief="Clears the current playlist 🥊.", aliases = ["cl"])
     async def clear(self, ctx):
         """Clears the current playlist."""
+        self.ingest_generation += 1
         self.shared_playlist.clear()
-        self.original_playlist.clear()
         self.current_index = 0
-        self.shuffled = False
         playback_cog = self.bot.get_cog('PlaybackCog')
         if playback_cog and playback_cog.media_player:
             playback_cog.media_player.stop()  # Stop playback
@@ -0,0 +1,183 @@
+# probe_cog.py
+from discord.ext import commands, tasks
+import logging
+import asyncio
+import datetime
+import json
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import config
+from db_manager import db_manager
+import media_probe
+
+class ProbeCog(commands.Cog):
+    """
+    Probes library items with libvlc in the background and keeps the results (duration, audio and subtitle
+    tracks, chosen tracks) in the media database, so playback and !playlist never have to open the files.
+    """
+    def __init__(self, bot, instance):
+        self.bot = bot
+        self.instance = instance
+        self.DATABASE_FILE = config.MEDIA_DB
+        self.executor = None
+        self.durations = {} # location -> duration in ms, from probes or else the XSPF
+        self.durations_generation = None # library_generation of playlist_sources when durations were loaded
+
+    async def cog_load(self):
+        await self.refresh_durations()
+        if self.instance is None:
+            logging.warning("No VLC instance; media probing is disabled.")
+            return
+        self.executor = ThreadPoolExecutor(max_workers=config.PROBE_WORKERS, thread_name_prefix="media-probe")
+        self.probe_loop.start()
+
+    async def cog_unload(self):
+        self.probe_loop.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def refresh_durations(self):
+        """(Re)loads the known durations if playlists were ingested since they were last loaded."""
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute("SELECT generation FROM library_generation WHERE name = 'playlist_sources'") as cursor:
+                    (generation,) = await cursor.fetchone()
+                if generation == self.durations_generation:
+                    return
+                async with conn.execute("SELECT location, duration_ms FROM tracks WHERE duration_ms > 0") as cursor:
+                    durations = dict(await cursor.fetchall())
+                async with conn.execute("SELECT location, duration_ms FROM media_probe WHERE duration_ms > 0") as cursor:
+                    durations.update(await cursor.fetchall())
+            self.durations = durations
+            self.durations_generation = generation
+            logging.info(f"Loaded {len(self.durations)} known media durations.")
+        except Exception as e:
+            logging.error(f"Error loading media durations: {e}")
+
+    @tasks.loop(seconds=config.PROBE_INTERVAL_SECONDS)
+    async def probe_loop(self):
+        await self.refresh_durations()
+        await self.probe_pending()
+
+    async def probe_pending(self):
+        """
+        Probes local library items that were never probed or whose file size changed, a batch at a time.
+        The pending set is read once per pass, so an item whose probe doesn't settle it waits for the next interval.
+        """
+        loop = asyncio.get_running_loop()
+        probed_count = 0
+        try:
+            # A location listed in several playlists can carry different recorded sizes (one XSPF re-ingested after
+            # the file was replaced, the other not); the largest is compared, so the probe row can settle it.
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    """
+                    SELECT t.location, t.file_size FROM (
+                        SELECT location, MAX(file_size) AS file_size FROM tracks WHERE file_size IS NOT NULL GROUP BY location
+                    ) t
+                    LEFT JOIN media_probe p ON p.location = t.location
+                    WHERE p.location IS NULL OR p.file_size IS NOT t.file_size
+                    """
+                ) as cursor:
+                    all_pending = await cursor.fetchall()
+
+            for batch_start in range(0, len(all_pending), config.PROBE_BATCH_SIZE):
+                pending = all_pending[batch_start:batch_start + config.PROBE_BATCH_SIZE]
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(self.executor, media_probe.probe_media, self.instance, location, config.PROBE_TIMEOUT_MS)
+                    for location, _ in pending
+                ), return_exceptions=True)
+
+                probed_at = datetime.datetime.now().isoformat()
+                rows = []
+                for (location, file_size), result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        logging.warning(f"Probe of '{location}' failed: {result}")
+                        result = None
+                    if result is None:
+                        rows.append((location, file_size, None, None, None, None, None, probed_at))
+                        continue
+                    rows.append((
+                        location, file_size, result["duration_ms"],
+                        json.dumps(result["audio_tracks"]), json.dumps(result["subtitle_tracks"]),
+                        media_probe.choose_audio_track(result["audio_tracks"]),
+                        media_probe.choose_subtitle_track(result["subtitle_tracks"]),
+                        probed_at,
+                    ))
+                    if result["duration_ms"]:
+                        self.durations[location] = result["duration_ms"]
+
+                async with db_manager.connection(self.DATABASE_FILE) as conn:
+                    await conn.executemany(
+                        """
+                        INSERT OR REPLACE INTO media_probe
+                            (location, file_size, duration_ms, audio_tracks, subtitle_tracks, audio_track, subtitle_track, probed_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        rows
+                    )
+                    await conn.commit()
+                probed_count += len(rows)
+        except Exception as e:
+            logging.error(f"Error probing media: {e}", exc_info=True)
+        if probed_count:
+            logging.info(f"Probed {probed_count} media item(s).")
+
+    async def get_probe(self, location):
+        """
+        Returns the stored probe for a location as a dict (duration_ms, audio_tracks, subtitle_tracks, audio_track,
+        subtitle_track), or None if it hasn't been probed successfully.
+        """
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    "SELECT duration_ms, audio_tracks, subtitle_tracks, audio_track, subtitle_track FROM media_probe WHERE location = ?",
+                    (location,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logging.error(f"Error reading probe for '{location}': {e}")
+            return None
+        if row is None or row[1] is None:
+            return None
+        duration_ms, audio_tracks, subtitle_tracks, audio_track, subtitle_track = row
+        return {
+            "duration_ms": duration_ms,
+            "audio_tracks": json.loads(audio_tracks),
+            "subtitle_tracks": json.loads(subtitle_tracks),
+            "audio_track": audio_track,
+            "subtitle_track": subtitle_track,
+        }
+
+    async def get_track_choices(self, locations):
+        """Returns {location: (audio_track, subtitle_track)} for the probed ones among locations, in one query."""
+        try:
+            async with db_manager.reader(self.DATABASE_FILE) as conn:
+                async with conn.execute(
+                    """
+                    SELECT location, audio_track, subtitle_track FROM media_probe
+                    WHERE location IN (SELECT value FROM json_each(?)) AND audio_tracks IS NOT NULL
+                    """,
+                    (json.dumps(locations),)
+                ) as cursor:
+                    return {location: (audio_track, subtitle_track) for location, audio_track, subtitle_track in await cursor.fetchall()}
+        except Exception as e:
+            logging.error(f"Error reading track choices: {e}")
+            return {}
+
+    def get_runtime_prefix(self, locations):
+        """
+        Returns (prefix, unknown) for a sequence of locations: prefix[i] is the total ms of the known durations of the
+        first i items, so any range's runtime is one subtraction; unknown is the number of items with no known duration.
+        """
+        prefix = array("q", [0])
+        total_ms = 0
+        unknown = 0
+        for location in locations:
+            duration_ms = self.durations.get(location)
+            if duration_ms:
+                total_ms += duration_ms
+            else:
+                unknown += 1
+            prefix.append(total_ms)
+        return prefix, unknown
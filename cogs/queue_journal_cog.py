@@ -0,0 +1,183 @@
+# queue_journal_cog.py
+import discord
+from discord.ext import commands, tasks
+import logging
+import datetime
+import json
+import time
+import vlc
+import config
+from db_manager import db_manager
+from migrations import migrate, QUEUE_MIGRATIONS
+
+ACTIVE_STATES = (vlc.State.Opening, vlc.State.Buffering, vlc.State.Playing, vlc.State.Paused)
+
+class QueueJournalCog(commands.Cog):
+    """
+    Keeps the shared playlist and the playback position in the queue database, so a restart picks up where it left off.
+    Queue changes are recorded as TrackQueue mutations and appended to a journal every few seconds, together with a
+    checkpoint of the current item and position. On startup the journal is replayed and playback resumes from there.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.db_file = config.QUEUE_DB
+        self.pending = [] # TrackQueue mutations not yet in the journal; the queue appends to this list
+        self.journal_rows = 0
+        self.saved_checkpoint = None # Last checkpoint written, so an unchanged one isn't rewritten
+        self.resume_task = None
+        self.unloading = False # Set once cog_unload starts; PlaybackCog may already have stopped the player by then
+        # Bot.close() removes cogs in the order they were added, so PlaylistCog and PlaybackCog are gone
+        # by the time this one unloads; keep them from cog_load so the final flush still reaches their state.
+        self.playlist_cog = None
+        self.playback_cog = None
+
+    async def cog_load(self):
+        self.playlist_cog = self.bot.get_cog('PlaylistCog')
+        self.playback_cog = self.bot.get_cog('PlaybackCog')
+        async with db_manager.connection(self.db_file) as conn:
+            version = await migrate(conn, QUEUE_MIGRATIONS, self.db_file)
+        logging.info(f"Database '{self.db_file}' initialized at schema version {version}.")
+        checkpoint = await self._restore_queue()
+        if checkpoint:
+            self.resume_task = self.bot.loop.create_task(self._resume_playback(checkpoint))
+        self.checkpoint_loop.start()
+
+    async def cog_unload(self):
+        self.unloading = True
+        self.checkpoint_loop.stop()
+        if self.resume_task:
+            self.resume_task.cancel()
+        await self.flush()
+        self.playlist_cog.shared_playlist.journal = None
+
+    @tasks.loop(seconds=config.QUEUE_CHECKPOINT_SECONDS)
+    async def checkpoint_loop(self):
+        await self.flush()
+
+    async def _restore_queue(self):
+        """
+        Rebuilds PlaylistCog's queue from the journal and starts recording its changes.
+        Returns the checkpoint row if playback was running when it was saved and it still matches the queue, else None.
+        """
+        playlist_cog = self.playlist_cog
+        queue = playlist_cog.shared_playlist
+        checkpoint = None
+        try:
+            started = time.perf_counter()
+            async with db_manager.reader(self.db_file) as conn:
+                async with conn.execute("SELECT op, data FROM queue_journal ORDER BY seq") as cursor:
+                    rows = await cursor.fetchall()
+                async with conn.execute(
+                    "SELECT current_index, location, position_ms, playing, channel_id, message_id FROM playback_checkpoint WHERE id = 1"
+                ) as cursor:
+                    checkpoint = await cursor.fetchone()
+            for op, data in rows:
+                queue.replay(op, json.loads(data))
+            self.journal_rows = len(rows)
+            if queue:
+                logging.info(f"Restored {len(queue)} queued items from {len(rows)} journal entries in {(time.perf_counter() - started) * 1000:.0f} ms.")
+        except Exception as e:
+            logging.error(f"Error restoring the queue journal, starting with an empty queue: {e}", exc_info=True)
+            queue.replay("clear", None)
+            self.journal_rows = float("inf") # Rewritten as a snapshot on the first flush
+            checkpoint = None
+        queue.journal = self.pending
+
+        if checkpoint is None or not queue:
+            return None
+        current_index, location, position_ms, playing, channel_id, message_id = checkpoint
+        if not (0 <= current_index < len(queue) and queue[current_index].location == location):
+            logging.warning("The saved playback checkpoint doesn't match the restored queue; not resuming.")
+            return None
+        playlist_cog.current_index = current_index
+        self.saved_checkpoint = tuple(checkpoint)
+        return checkpoint if playing else None
+
+    async def _resume_playback(self, checkpoint):
+        """Plays the checkpointed item from its saved position, replying in the channel playback was last started from."""
+        current_index, location, position_ms, _, channel_id, message_id = checkpoint
+        try:
+            await self.bot.wait_until_ready()
+            if channel_id is None or message_id is None:
+                logging.warning("Not resuming playback: no channel was saved with the checkpoint.")
+                return
+            channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+            ctx = await self.bot.get_context(await channel.fetch_message(message_id))
+        except discord.HTTPException as e:
+            logging.warning(f"Not resuming playback: the channel or message it was started from is gone ({e}).")
+            return
+
+        playlist_cog = self.playlist_cog
+        playback_cog = self.playback_cog
+        if not playback_cog or not playback_cog.media_player or playback_cog.media_player.get_state() in ACTIVE_STATES:
+            return # Someone started something else in the meantime
+        if playlist_cog.current_index != current_index or playlist_cog.shared_playlist[current_index].location != location:
+            return
+
+        title, _ = playlist_cog.shared_playlist[current_index]
+        await ctx.send(f"♻️ Resuming after a restart: **{title}** at {playback_cog.format_time(position_ms or 0)}.")
+        await playback_cog.play_media(ctx, title, location, start_ms=position_ms)
+
+    def _current_checkpoint(self):
+        """Returns (current_index, location, position_ms, playing, channel_id, message_id) as things are now."""
+        playlist_cog = self.playlist_cog
+        playback_cog = self.playback_cog
+        queue = playlist_cog.shared_playlist
+        index = playlist_cog.current_index
+        location = queue[index].location if 0 <= index < len(queue) else None
+        player = playback_cog.media_player if playback_cog else None
+        playing = bool(player and location and player.get_state() in ACTIVE_STATES)
+        position_ms = max(player.get_time(), 0) if playing else None
+        ctx = playback_cog.last_ctx if playback_cog else None
+        return (index, location, position_ms, int(playing), ctx.channel.id if ctx else None, ctx.message.id if ctx else None)
+
+    async def flush(self):
+        """
+        Appends pending queue mutations to the journal and saves the playback checkpoint, in one transaction.
+        treescord's close() calls this before the cogs are unloaded, to checkpoint the position while the player still runs.
+        """
+        playlist_cog = self.playlist_cog
+        if not playlist_cog:
+            return
+        if self.unloading or (self.resume_task and not self.resume_task.done()):
+            # Keep the one being resumed until playback is back, and keep the last one taken while playing on shutdown
+            checkpoint = self.saved_checkpoint
+        else:
+            checkpoint = self._current_checkpoint()
+        pending = list(self.pending)
+        if not pending and checkpoint == self.saved_checkpoint:
+            return
+
+        # Everything before a clear is moot, and a long journal is rewritten as a snapshot of the queue.
+        # The snapshot is taken together with the pending copy, so it covers exactly those mutations.
+        last_clear = max((i for i, (op, _) in enumerate(pending) if op == "clear"), default=None)
+        if self.journal_rows + len(pending) > config.QUEUE_JOURNAL_COMPACT_ROWS:
+            rows, reset = playlist_cog.shared_playlist.snapshot(), True
+        elif last_clear is not None:
+            rows, reset = pending[last_clear:], True
+        else:
+            rows, reset = pending, False
+
+        try:
+            async with db_manager.connection(self.db_file) as conn:
+                if reset:
+                    await conn.execute("DELETE FROM queue_journal")
+                await conn.executemany("INSERT INTO queue_journal (op, data) VALUES (?, ?)", [(op, json.dumps(data)) for op, data in rows])
+                if checkpoint != self.saved_checkpoint and checkpoint is not None:
+                    await conn.execute(
+                        """
+                        INSERT OR REPLACE INTO playback_checkpoint
+                            (id, current_index, location, position_ms, playing, channel_id, message_id, saved_at)
+                        VALUES (1, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (*checkpoint, datetime.datetime.now().isoformat())
+                    )
+                await conn.commit()
+        except Exception as e:
+            logging.error(f"Database error writing the queue journal, keeping changes queued: {e}")
+            return
+        del self.pending[:len(pending)] # Mutations made during the write stay queued
+        self.journal_rows = len(rows) if reset else self.journal_rows + len(rows)
+        self.saved_checkpoint = checkpoint
+        if reset:
+            logging.info(f"Queue journal rewritten with {len(rows)} entries.")
@@ -20,6 +20,8 @@ class TokeCog(commands.Cog):
         self.cooldown_end_time = None
         self.current_countdown = config.TOKE_COUNTDOWN_SECONDS
         self.toke_start_time = None
+        self.toke_club_session = False # Whether the active toke was started by a successful !earlytoke
+        self.session_participants = [] # Joins for the session log, written when the countdown finishes
 
     def _create_toke_view(self):
         view = discord.ui.View() # Buttons will use default timeout (180 seconds)
@@ -29,21 +31,32 @@ class TokeCog(commands.Cog):
         view.add_item(remote_button)
         return view
 
-    async def start_toke(self, ctx):
-        self.toke_active = True
-        self.tokers.add(ctx.author)
+    async def _record_join(self, ctx, saved_toke=False):
+        """Records the join and its 4:20 / wake and bake / saved toke counters in one tracker write."""
+        now = datetime.datetime.now()
+        four_twenty = (now.hour == 4 or now.hour == 16) and (now.minute == 19 or now.minute == 20) # 4:20 join time
+        wake_and_bake = 5 <= now.hour < 9 # 5 AM to 8:59 AM
+        if not ctx.author.bot:
+            self.session_participants.append({
+                "user_id": ctx.author.id,
+                "user_name": ctx.author.name,
+                "joined_at": now,
+                "saved_toke": saved_toke,
+                "four_twenty": four_twenty,
+                "wake_and_bake": wake_and_bake,
+            })
         tracker_cog = self.bot.get_cog("TreesTrackerCog")
         if tracker_cog:
-            await tracker_cog.user_joined_toke(ctx.author, ctx) # This increments the general toke count
-            # Check for 4:20 join time
-            now = datetime.datetime.now()
-            if (now.hour == 4 or now.hour == 16) and (now.minute == 19 or now.minute == 20):
-                await tracker_cog.user_joined_at_420(ctx.author, ctx)
-            # Check for Wake and Bake time
-            if 5 <= now.hour < 9: # 5 AM to 8:59 AM
-                await tracker_cog.user_joined_wake_and_bake(ctx.author, ctx)
-        
+            await tracker_cog.record_join(ctx.author, ctx, four_twenty=four_twenty, wake_and_bake=wake_and_bake, saved_toke=saved_toke)
+
+    async def start_toke(self, ctx, toke_club=False):
+        self.toke_active = True
+        self.toke_club_session = toke_club
+        self.session_participants = []
         self.toke_start_time = datetime.datetime.now()
+        self.tokers.add(ctx.author)
+        await self._record_join(ctx)
+        
         self.current_countdown = self.countdown_seconds
         view = self._create_toke_view()
 
@@ -84,6 +97,17 @@ class TokeCog(commands.Cog):
             else:
                 toker_names = ", ".join(toker.mention for toker in self.tokers)
                 await ctx.send(f"Take a toke {toker_names}! 🌬️🍃😶‍🌫️")
+            tracker_cog = self.bot.get_cog("TreesTrackerCog")
+            if tracker_cog:
+                await tracker_cog.log_toke_session(
+                    started_at=self.toke_start_time,
+                    ended_at=datetime.datetime.now(),
+                    started_by=ctx.author.id,
+                    toke_club=self.toke_club_session,
+                    participants=self.session_participants,
+                )
+                await tracker_cog.flush_pending_stats() # Write this session's buffered stats now it's over
+            self.session_participants = []
             self.toke_active = False
             self.tokers.clear()
             self.countdown_task = None
@@ -116,16 +140,8 @@ class TokeCog(commands.Cog):
                 return
 
             self.tokers.add(ctx.author)
-            tracker_cog = self.bot.get_cog("TreesTrackerCog")
-            if tracker_cog:
-                await tracker_cog.user_joined_toke(ctx.author, ctx)
-                # Check for 4:20 join time
-                now = datetime.datetime.now()
-                if (now.hour == 4 or now.hour == 16) and (now.minute == 19 or now.minute == 20):
-                    await tracker_cog.user_joined_at_420(ctx.author, ctx) # This increments the 4:20 count
-                # Check for Wake and Bake time
-                if 5 <= now.hour < 9: # 5 AM to 8:59 AM
-                    await tracker_cog.user_joined_wake_and_bake(ctx.author, ctx)
+            saved_toke = self.current_countdown <= 10 # Joining with little time left saves the toke
+            await self._record_join(ctx, saved_toke=saved_toke)
             
             # Check for 4:21 achievement (You're Too Slow!)
             # The achievement description says "Joined a toke that started at 4:21!"
@@ -137,10 +153,8 @@ class TokeCog(commands.Cog):
                         await achievements_cog.user_joined_421_toke_late(ctx.author, ctx)
 
 
-            if self.current_countdown <= 10:
+            if saved_toke:
                 self.current_countdown += 5
-                if tracker_cog: # Increment tokes_saved_count
-                    await tracker_cog.user_saved_toke(ctx.author, ctx)
                 await ctx.send(f"{ctx.author.mention} joined with little time left! Added 5 seconds to the toke timer. ⏳")
             view = self._create_toke_view()
             
@@ -193,7 +207,7 @@ class TokeCog(commands.Cog):
                 if achievements_cog:
                     await achievements_cog.user_triggered_early_toke(ctx.author, ctx)
                     await achievements_cog.user_joined_secret_society(ctx.author, ctx)
-                await self.start_toke(ctx)
+                await self.start_toke(ctx, toke_club=True)
             else:
                 # Add variety to the failure message
                 fail_msgs = [
@@ -1,12 +1,14 @@
 # trees_tracker_cog.py
 import discord
-from discord.ext import commands
-import aiosqlite
+from discord.ext import commands, tasks
 import logging
 import os
 import asyncio
 import datetime
+import bisect
 import config
+from db_manager import db_manager
+from migrations import migrate, TOKERS_MIGRATIONS
 
 DATABASE_FILE = config.TOKERS_DB
 
@@ -22,6 +24,72 @@ LEADERBOARD_STATS = [
     {"db_column": "longest_streak", "display_name": "Longest Streak", "emoji": "🏰"},
 ]
 
+# Counter columns that are only ever incremented. Increments to these are buffered in memory
+# and written in batches by TreesTrackerCog.flush_pending_stats().
+COUNTER_COLUMNS = [
+    "toke_count",
+    "solo_toke_count",
+    "tokes_saved_count",
+    "four_twenty_tokes_count",
+    "wake_and_bake_tokes_count",
+    "toke_club_sessions_count",
+]
+
+# Column order returned by TreesTrackerCog._get_user_stats_from_db.
+USER_STATS_COLUMNS = ["user_name"] + COUNTER_COLUMNS + ["current_streak", "longest_streak"]
+
+class RankIndex:
+    """
+    In-memory order statistics for the leaderboard columns, kept in sync by TreesTrackerCog on every write.
+    Holds each column's non-zero values in a sorted list, so a user's rank is a single bisection.
+    """
+    def __init__(self, stat_columns):
+        self.stat_columns = stat_columns
+        self.clear()
+
+    def clear(self):
+        self._user_values = {}  # user_id -> tuple of values in stat_columns order
+        self._sorted_values = {column: [] for column in self.stat_columns}
+
+    def load(self, rows):
+        """Rebuilds the index from (user_id, *values) rows."""
+        self.clear()
+        for user_id, *values in rows:
+            self._user_values[user_id] = tuple(value or 0 for value in values)
+        for i, column in enumerate(self.stat_columns):
+            self._sorted_values[column] = sorted(values[i] for values in self._user_values.values() if values[i] > 0)
+
+    def update(self, user_id, new_values: dict):
+        """Sets a user's values for the given columns, moving them within each sorted list."""
+        old = self._user_values.get(user_id, (0,) * len(self.stat_columns))
+        new = tuple((new_values.get(column, old[i]) or 0) for i, column in enumerate(self.stat_columns))
+        for i, column in enumerate(self.stat_columns):
+            if old[i] == new[i]:
+                continue
+            sorted_values = self._sorted_values[column]
+            if old[i] > 0:
+                del sorted_values[bisect.bisect_left(sorted_values, old[i])]
+            if new[i] > 0:
+                bisect.insort(sorted_values, new[i])
+        self._user_values[user_id] = new
+
+    def add(self, user_id, deltas: dict):
+        """Applies increments to a user's values."""
+        old = self._user_values.get(user_id, (0,) * len(self.stat_columns))
+        self.update(user_id, {column: old[i] + deltas[column] for i, column in enumerate(self.stat_columns) if column in deltas})
+
+    def get_ranks(self, user_id):
+        """Returns {column: (value, rank, users ranked)} for a user, or None if they aren't indexed."""
+        values = self._user_values.get(user_id)
+        if values is None:
+            return None
+        ranks = {}
+        for i, column in enumerate(self.stat_columns):
+            sorted_values = self._sorted_values[column]
+            rank = len(sorted_values) - bisect.bisect_right(sorted_values, values[i]) + 1 if values[i] > 0 else None
+            ranks[column] = (values[i], rank, len(sorted_values))
+        return ranks
+
 class LeaderboardView(discord.ui.View):
     def __init__(self, bot, stats_to_show, initial_stat_index=0):
         super().__init__(timeout=180.0)
@@ -50,7 +118,7 @@ class LeaderboardView(discord.ui.View):
             embed.description = "This leaderboard is empty! 💨"
         else:
             description = []
-            for i, (user_name, count) in enumerate(leaderboard_data[:10], 1): # Show top 10
+            for i, (user_name, count) in enumerate(leaderboard_data[:config.LEADERBOARD_PAGE_SIZE], 1): # Show top 10
                 rank_emoji = {1: "🥇 ", 2: "🥈 ", 3: "🥉 "}.get(i, f"**{i}.** ")
                 description.append(f"{rank_emoji}{user_name}: {count}")
             embed.description = "\n".join(description)
@@ -74,153 +142,179 @@ class TreesTrackerCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db_file = DATABASE_FILE
+        self._pending_stats = {}  # user_id -> {"user_name": str, "deltas": {column: int}}
+        self._leaderboard_cache = {}  # stat column -> (limit, top rows), dropped whenever that column is written
+        self._leaderboard_generation = 0  # Bumped on every invalidation so a read racing a write isn't cached
+        self.rank_index = RankIndex([stat["db_column"] for stat in LEADERBOARD_STATS])
 
     async def cog_load(self):
         await self._initialize_database()
+        await self._load_rank_index()
+        self.flush_stats_loop.start()
 
-    async def _initialize_database(self):
-        """Initializes the database and ensures all necessary columns exist."""
-        async with aiosqlite.connect(self.db_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS toke_stats (
-                        user_id INTEGER PRIMARY KEY,
-                        user_name TEXT
-                    )
-                ''')
-
-                # A list of all stat columns that should be in the table.
-                # To add a new stat, just add its column name here.
-                columns_to_ensure = [
-                    ("toke_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("solo_toke_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("tokes_saved_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("four_twenty_tokes_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("wake_and_bake_tokes_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("toke_club_sessions_count", "INTEGER NOT NULL DEFAULT 0"),
-                    ("current_streak", "INTEGER NOT NULL DEFAULT 0"),
-                    ("longest_streak", "INTEGER NOT NULL DEFAULT 0"),
-                    ("last_toke_date", "TEXT"),
-                ]
-
-                for column_name, column_type in columns_to_ensure:
-                    try:
-                        await cursor.execute(f"ALTER TABLE toke_stats ADD COLUMN {column_name} {column_type}")
-                        logging.info(f"Added '{column_name}' column to 'toke_stats' table.")
-                    except Exception as e:
-                        if "duplicate column name" in str(e).lower():
-                            logging.info(f"'{column_name}' column already exists in 'toke_stats' table.")
-                        else:
-                            logging.error(f"An unexpected error occurred when adding column '{column_name}': {e}")
+    async def cog_unload(self):
+        self.flush_stats_loop.stop()
+        await self.flush_pending_stats()
 
-                await conn.commit()
-        logging.info(f"Database '{self.db_file}' initialized and 'toke_stats' table ensured.")
+    @tasks.loop(seconds=config.STAT_FLUSH_INTERVAL_SECONDS)
+    async def flush_stats_loop(self):
+        await self.flush_pending_stats()
 
-    async def _update_streak(self, user_id: int):
-        """Calculates and updates the user's daily toke streak."""
+    async def _initialize_database(self):
+        """Brings the database schema up to date. Once migrated, this is a single user_version check."""
+        async with db_manager.connection(self.db_file) as conn:
+            version = await migrate(conn, TOKERS_MIGRATIONS, self.db_file)
+        logging.info(f"Database '{self.db_file}' initialized at schema version {version}.")
+
+    async def _load_rank_index(self):
+        """Loads every user's leaderboard values into the in-memory rank index."""
+        columns = ", ".join(self.rank_index.stat_columns)
+        async with db_manager.reader(self.db_file) as conn:
+            async with conn.execute(f"SELECT user_id, {columns} FROM toke_stats") as cursor:
+                rows = await cursor.fetchall()
+        self.rank_index.load(rows)
+        logging.info(f"Loaded leaderboard ranks for {len(rows)} user(s).")
+
+    async def _record_toke_activity(self, user_id: int, user_name: str, deltas: dict):
+        """
+        Applies a toke's counter increments and the daily streak update in a single UPSERT transaction.
+        Any increments still buffered for the user are folded into the same statement.
+        Returns the user's updated stats in USER_STATS_COLUMNS order.
+        """
+        today = datetime.date.today()
+        params = {
+            "user_id": user_id,
+            "user_name": user_name,
+            "today": today.isoformat(),
+            "yesterday": (today - datetime.timedelta(days=1)).isoformat(),
+        }
+        # It's safe to use an f-string for the column names because they come from COUNTER_COLUMNS.
+        columns = ", ".join(COUNTER_COLUMNS)
+        placeholders = ", ".join(f":{column}" for column in COUNTER_COLUMNS)
+        increments = ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNTER_COLUMNS)
+        # Streak: unchanged if the user already toked today, +1 if they toked yesterday, otherwise it starts over.
+        new_streak = "CASE WHEN last_toke_date = :today THEN current_streak WHEN last_toke_date = :yesterday THEN current_streak + 1 ELSE 1 END"
+        query = f"""
+            INSERT INTO toke_stats (user_id, user_name, {columns}, current_streak, longest_streak, last_toke_date)
+            VALUES (:user_id, :user_name, {placeholders}, 1, 1, :today)
+            ON CONFLICT(user_id) DO UPDATE SET
+                user_name = excluded.user_name,
+                {increments},
+                current_streak = {new_streak},
+                longest_streak = MAX(longest_streak, {new_streak}),
+                last_toke_date = :today
+            RETURNING {", ".join(USER_STATS_COLUMNS)}
+        """
         try:
-            today = datetime.date.today()
-            today_str = today.isoformat()
-            yesterday = today - datetime.timedelta(days=1)
-            yesterday_str = yesterday.isoformat()
-
-            async with aiosqlite.connect(self.db_file) as conn:
-                async with conn.cursor() as cursor:
-                    # Get streak info. 
-                    await cursor.execute("SELECT current_streak, last_toke_date, longest_streak FROM toke_stats WHERE user_id = ?", (user_id,))
-                    row = await cursor.fetchone()
-                    
-                    current_streak = 0
-                    last_toke_date = None
-                    longest_streak = 0
-                    
-                    if row:
-                        current_streak = row[0] if row[0] is not None else 0
-                        last_toke_date = row[1]
-                        longest_streak = row[2] if row[2] is not None else 0
-
-                    if last_toke_date == today_str:
-                        # Already toked today
-                        return
-
-                    new_streak = 1
-                    if last_toke_date == yesterday_str:
-                        new_streak = current_streak + 1
-                    
-                    # Update longest streak if current is greater
-                    new_longest = max(longest_streak, new_streak)
-
-                    await cursor.execute("""
-                        UPDATE toke_stats 
-                        SET current_streak = ?, longest_streak = ?, last_toke_date = ? 
-                        WHERE user_id = ?
-                    """, (new_streak, new_longest, today_str, user_id))
-                    
+            async with db_manager.connection(self.db_file) as conn:
+                pending = self._pending_stats.pop(user_id, None)
+                for column in COUNTER_COLUMNS:
+                    params[column] = deltas.get(column, 0) + (pending["deltas"].get(column, 0) if pending else 0)
+                try:
+                    async with conn.execute(query, params) as cursor:
+                        row = await cursor.fetchone()
                     await conn.commit()
-                    logging.info(f"Updated streak for user {user_id}: Current: {new_streak}, Longest: {new_longest}")
-                    
+                    self._invalidate_leaderboards([column for column in COUNTER_COLUMNS if params[column]] + ["current_streak", "longest_streak"])
+                    self.rank_index.update(user_id, dict(zip(USER_STATS_COLUMNS, row)))
+                except Exception:
+                    if pending:
+                        for stat_column, value in pending["deltas"].items():
+                            self._queue_stat_delta(user_id, pending["user_name"], stat_column, value)
+                    raise
+            logging.info(f"Recorded toke activity {deltas} for user {user_name} (ID: {user_id}). Current streak: {row[-2]}, Longest: {row[-1]}")
+            return row
         except Exception as e:
-            logging.error(f"Error updating streak for user {user_id}: {e}")
+            logging.error(f"Error recording toke activity for user {user_id}: {e}")
+            return None
+
+    def _queue_stat_delta(self, user_id: int, user_name: str, stat_column: str, value: int):
+        entry = self._pending_stats.setdefault(user_id, {"user_name": user_name, "deltas": {}})
+        if user_name is not None:
+            entry["user_name"] = user_name
+        entry["deltas"][stat_column] = entry["deltas"].get(stat_column, 0) + value
 
     async def _update_stat(self, user_id: int, user_name: str, stat_column: str, value: int = 1):
-        """A generic function to update a user's stat in the database."""
-        async with aiosqlite.connect(self.db_file) as conn:
-            async with conn.cursor() as cursor:
-                # Ensure the user exists in the table
-                await cursor.execute("INSERT OR IGNORE INTO toke_stats (user_id, user_name) VALUES (?, ?)", (user_id, user_name))
-                
-                # Increment the specific stat column and update the username
-                # It's safe to use an f-string for the column name because we control the input.
-                query = f"UPDATE toke_stats SET {stat_column} = {stat_column} + ?, user_name = ? WHERE user_id = ?"
-                await cursor.execute(query, (value, user_name, user_id))
-                await conn.commit()
-                logging.info(f"Updated stat '{stat_column}' for user {user_name} (ID: {user_id}) by {value}.")
+        """
+        Queues an increment of a user's stat. The write-behind buffer coalesces increments per user and column,
+        and flush_pending_stats() writes them to the database in one transaction.
+        """
+        if stat_column not in COUNTER_COLUMNS:
+            raise ValueError(f"'{stat_column}' is not a counter column.")
+        self._queue_stat_delta(user_id, user_name, stat_column, value)
+        logging.info(f"Queued stat '{stat_column}' for user {user_name} (ID: {user_id}) by {value}.")
+
+    async def flush_pending_stats(self):
+        """Writes all buffered stat increments to the database in a single executemany transaction."""
+        if not self._pending_stats:
+            return
+
+        # It's safe to use an f-string for the column names because they come from COUNTER_COLUMNS.
+        columns = ", ".join(COUNTER_COLUMNS)
+        placeholders = ", ".join("?" for _ in COUNTER_COLUMNS)
+        increments = ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNTER_COLUMNS)
+        query = f"""
+            INSERT INTO toke_stats (user_id, user_name, {columns})
+            VALUES (?, ?, {placeholders})
+            ON CONFLICT(user_id) DO UPDATE SET user_name = COALESCE(excluded.user_name, user_name), {increments}
+        """
+        try:
+            async with db_manager.connection(self.db_file) as conn:
+                # The buffer is swapped out while holding the writer connection, so a reader that also holds it
+                # always sees each increment exactly once: either committed or still pending.
+                pending, self._pending_stats = self._pending_stats, {}
+                if not pending:
+                    return
+                rows = [
+                    (user_id, entry["user_name"], *(entry["deltas"].get(column, 0) for column in COUNTER_COLUMNS))
+                    for user_id, entry in pending.items()
+                ]
+                try:
+                    await conn.executemany(query, rows)
+                    await conn.commit()
+                    self._invalidate_leaderboards({column for entry in pending.values() for column in entry["deltas"]})
+                    for user_id, entry in pending.items():
+                        self.rank_index.add(user_id, entry["deltas"])
+                except Exception:
+                    # Put the deltas back underneath anything queued while the flush was running.
+                    newer, self._pending_stats = self._pending_stats, pending
+                    for user_id, entry in newer.items():
+                        for stat_column, value in entry["deltas"].items():
+                            self._queue_stat_delta(user_id, entry["user_name"], stat_column, value)
+                    raise
+            logging.info(f"Flushed buffered stats for {len(rows)} user(s).")
+        except Exception as e:
+            logging.error(f"Database error flushing buffered stats, keeping them queued: {e}")
 
     async def _increment_stat(self, user_id: int, user_name: str, stat_column: str, value: int = 1):
         """Asynchronously calls the generic stat update function."""
         await self._update_stat(user_id, user_name, stat_column, value)
 
-    async def user_joined_toke(self, user: discord.User, ctx: commands.Context = None):
+    async def record_join(self, user: discord.User, ctx: commands.Context = None, *, four_twenty: bool = False, wake_and_bake: bool = False, saved_toke: bool = False):
+        """
+        Records everything about one toke join (group toke count, 4:20 / wake and bake / saved toke counters
+        and the streak) in one transaction, then checks achievements once against the returned stats.
+        """
         if user.bot: # Don't track bots
             return
-        await self._increment_stat(user.id, user.name, "toke_count")
-        await self._update_streak(user.id)
+        deltas = {"toke_count": 1}
+        if four_twenty:
+            deltas["four_twenty_tokes_count"] = 1
+        if wake_and_bake:
+            deltas["wake_and_bake_tokes_count"] = 1
+        if saved_toke:
+            deltas["tokes_saved_count"] = 1
+        user_stats = await self._record_toke_activity(user.id, user.name, deltas)
         achievements_cog = self.bot.get_cog("AchievementsCog")
-        if achievements_cog and ctx:
-            await achievements_cog.check_and_award_achievements(user, ctx)
+        if achievements_cog and ctx and user_stats:
+            await achievements_cog.check_and_award_achievements(user, ctx, user_stats=user_stats)
 
     async def user_solo_toked(self, user: discord.User, ctx: commands.Context = None):
         if user.bot: # Don't track bots
             return
-        await self._increment_stat(user.id, user.name, "solo_toke_count")
-        await self._update_streak(user.id)
+        user_stats = await self._record_toke_activity(user.id, user.name, {"solo_toke_count": 1})
         achievements_cog = self.bot.get_cog("AchievementsCog")
-        if achievements_cog and ctx:
-            await achievements_cog.check_and_award_achievements(user, ctx)
-
-    async def user_saved_toke(self, user: discord.User, ctx: commands.Context = None):
-        if user.bot: # Don't track bots
-            return
-        await self._increment_stat(user.id, user.name, "tokes_saved_count")
-        achievements_cog = self.bot.get_cog("AchievementsCog")
-        if achievements_cog and ctx:
-            await achievements_cog.check_and_award_achievements(user, ctx)
-
-    async def user_joined_at_420(self, user: discord.User, ctx: commands.Context = None):
-        if user.bot: # Don't track bots
-            return
-        await self._increment_stat(user.id, user.name, "four_twenty_tokes_count")
-        achievements_cog = self.bot.get_cog("AchievementsCog")
-        if achievements_cog and ctx:
-            await achievements_cog.check_and_award_achievements(user, ctx)
-
-    async def user_joined_wake_and_bake(self, user: discord.User, ctx: commands.Context = None):
-        if user.bot: # Don't track bots
-            return
-        await self._increment_stat(user.id, user.name, "wake_and_bake_tokes_count")
-        achievements_cog = self.bot.get_cog("AchievementsCog")
-        if achievements_cog and ctx:
-            await achievements_cog.check_and_award_achievements(user, ctx)
+        if achievements_cog and ctx and user_stats:
+            await achievements_cog.check_and_award_achievements(user, ctx, user_stats=user_stats)
 
     async def user_joined_toke_club(self, user: discord.User, ctx: commands.Context = None):
         if user.bot: # Don't track bots
@@ -230,14 +324,106 @@ class TreesTrackerCog(commands.Cog):
         if achievements_cog and ctx:
             await achievements_cog.check_and_award_achievements(user, ctx)
 
-    async def _get_leaderboard_data(self, stat_column: str):
+    async def log_toke_session(self, started_at: datetime.datetime, ended_at: datetime.datetime, started_by: int, toke_club: bool, participants: list):
+        """
+        Appends a finished session and its participants to the session log in one transaction.
+        Each participant is a dict with user_id, user_name, joined_at, saved_toke, four_twenty and wake_and_bake.
+        """
+        if not participants:
+            return
+        try:
+            async with db_manager.connection(self.db_file) as conn:
+                cursor = await conn.execute(
+                    "INSERT INTO toke_sessions (started_at, ended_at, started_by, participant_count, toke_club) VALUES (?, ?, ?, ?, ?)",
+                    (started_at.isoformat(sep=" ", timespec="seconds"), ended_at.isoformat(sep=" ", timespec="seconds"), started_by, len(participants), int(toke_club))
+                )
+                session_id = cursor.lastrowid
+                await cursor.close()
+                await conn.executemany(
+                    "INSERT OR IGNORE INTO toke_participants (session_id, user_id, user_name, joined_at, saved_toke, four_twenty, wake_and_bake) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (session_id, p["user_id"], p["user_name"], p["joined_at"].isoformat(sep=" ", timespec="seconds"), int(p["saved_toke"]), int(p["four_twenty"]), int(p["wake_and_bake"]))
+                        for p in participants
+                    ]
+                )
+                await conn.commit()
+            logging.info(f"Logged toke session {session_id} with {len(participants)} participant(s).")
+        except Exception as e:
+            logging.error(f"Database error logging toke session: {e}")
+
+    async def _rebuild_stats_from_log(self):
+        """Recomputes every row of toke_stats from the session log with set-based SQL, in one transaction."""
+        await self.flush_pending_stats()
+        async with db_manager.connection(self.db_file) as conn:
+            await conn.execute("DELETE FROM toke_stats")
+            await conn.execute('''
+                WITH totals AS (
+                    -- The bare user_name column takes its value from the row holding MAX(joined_at), i.e. the latest name.
+                    SELECT p.user_id, p.user_name, MAX(p.joined_at),
+                           COUNT(*) AS toke_count,
+                           SUM(s.participant_count = 1) AS solo_toke_count,
+                           SUM(p.saved_toke) AS tokes_saved_count,
+                           SUM(p.four_twenty) AS four_twenty_tokes_count,
+                           SUM(p.wake_and_bake) AS wake_and_bake_tokes_count,
+                           SUM(s.toke_club AND s.started_by = p.user_id) AS toke_club_sessions_count
+                    FROM toke_participants AS p
+                    JOIN toke_sessions AS s USING (session_id)
+                    GROUP BY p.user_id
+                ),
+                toke_days AS (
+                    SELECT DISTINCT user_id, date(joined_at) AS day FROM toke_participants
+                ),
+                -- Consecutive days share the same (day - row number), so each island is one streak.
+                islands AS (
+                    SELECT user_id, day, julianday(day) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS island
+                    FROM toke_days
+                ),
+                runs AS (
+                    SELECT user_id, COUNT(*) AS length, MAX(day) AS last_day
+                    FROM islands
+                    GROUP BY user_id, island
+                ),
+                streaks AS (
+                    -- The bare length column comes from the run holding MAX(last_day), i.e. the current streak.
+                    SELECT user_id, length AS current_streak, MAX(last_day) AS last_toke_date,
+                           (SELECT MAX(length) FROM runs AS r WHERE r.user_id = runs.user_id) AS longest_streak
+                    FROM runs
+                    GROUP BY user_id
+                )
+                INSERT INTO toke_stats (user_id, user_name, toke_count, solo_toke_count, tokes_saved_count, four_twenty_tokes_count,
+                                        wake_and_bake_tokes_count, toke_club_sessions_count, current_streak, longest_streak, last_toke_date)
+                SELECT t.user_id, t.user_name, t.toke_count, t.solo_toke_count, t.tokes_saved_count, t.four_twenty_tokes_count,
+                       t.wake_and_bake_tokes_count, t.toke_club_sessions_count, st.current_streak, st.longest_streak, st.last_toke_date
+                FROM totals AS t
+                JOIN streaks AS st USING (user_id)
+            ''')
+            await conn.commit()
+        self._invalidate_leaderboards(list(self._leaderboard_cache))
+        await self._load_rank_index()
+
+    def _invalidate_leaderboards(self, stat_columns):
+        """Drops the cached leaderboards for columns that were just written."""
+        self._leaderboard_generation += 1
+        for stat_column in stat_columns:
+            self._leaderboard_cache.pop(stat_column, None)
+
+    async def _get_leaderboard_data(self, stat_column: str, limit: int = config.LEADERBOARD_PAGE_SIZE):
+        """Returns the top (user_name, value) rows for a stat, served from cache until the column is written again."""
+        await self.flush_pending_stats() # Rankings should include increments still in the buffer
+        cached = self._leaderboard_cache.get(stat_column)
+        if cached is not None and cached[0] >= limit:
+            return cached[1][:limit]
+        generation = self._leaderboard_generation
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            async with db_manager.reader(self.db_file) as conn:
                 async with conn.cursor() as cursor:
                     # It's safe to use an f-string for the column name because we control the input from LEADERBOARD_STATS
-                    query = f"SELECT user_name, {stat_column} FROM toke_stats WHERE {stat_column} > 0 ORDER BY {stat_column} DESC"
-                    await cursor.execute(query)
-                    return await cursor.fetchall()
+                    query = f"SELECT user_name, {stat_column} FROM toke_stats WHERE {stat_column} > 0 ORDER BY {stat_column} DESC LIMIT ?"
+                    await cursor.execute(query, (limit,))
+                    rows = await cursor.fetchall()
+            if generation == self._leaderboard_generation:
+                self._leaderboard_cache[stat_column] = (limit, rows)
+            return rows
         except Exception as e:
             logging.error(f"Database error in _get_leaderboard_data for stat '{stat_column}': {e}")
             return None
@@ -270,6 +456,10 @@ class TreesTrackerCog(commands.Cog):
         """Deletes the toker.db file. This action is irreversible."""
         try:
             if os.path.exists(self.db_file):
+                self._pending_stats.clear() # Buffered increments belong to the database being deleted
+                self._invalidate_leaderboards(list(self._leaderboard_cache))
+                self.rank_index.clear()
+                await db_manager.close(self.db_file) # Release pooled connections before removing the file
                 await self.bot.loop.run_in_executor(None, os.remove, self.db_file)
                 logging.info(f"Database file '{self.db_file}' deleted by {ctx.author.name}.")
                 await ctx.send(f"Toke tracker database (`{self.db_file}`) has been deleted. It will be recreated on next use or bot restart.")
@@ -280,17 +470,49 @@ class TreesTrackerCog(commands.Cog):
             logging.error(f"Error deleting database file '{self.db_file}': {e}")
             await ctx.send(f"An error occurred while trying to delete the database: {e}")
 
+    @commands.command(brief="Recomputes all toke stats from the session log (owner only) 🔄.")
+    @commands.is_owner()
+    async def rebuildtokestats(self, ctx):
+        """Rebuilds toke_stats from the session log. Stats from before the log existed are not in it and will be dropped."""
+        toke_cog = self.bot.get_cog("TokeCog")
+        if toke_cog and toke_cog.toke_active:
+            await ctx.send("A toke is in progress. Rebuild once it's finished, so its joins are in the log. 🍃")
+            return
+        try:
+            await self._rebuild_stats_from_log()
+            logging.info(f"Toke stats rebuilt from the session log by {ctx.author.name}.")
+            await ctx.send("Toke stats have been rebuilt from the session log. 🔄")
+        except Exception as e:
+            logging.error(f"Error rebuilding toke stats from the session log: {e}")
+            await ctx.send(f"An error occurred while rebuilding toke stats: {e}")
+
     async def _get_user_stats_from_db(self, user_id: int):
-        """Fetches user_name and toke_count for a given user_id from the database."""
+        """
+        Fetches a user's name and stats (in USER_STATS_COLUMNS order) from the database,
+        with any increments still waiting in the write-behind buffer applied on top.
+        """
         try:
-            async with aiosqlite.connect(self.db_file) as conn:
+            # Read through the writer connection so a flush can't be half-way through moving this user's deltas.
+            async with db_manager.connection(self.db_file) as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.execute("SELECT user_name, toke_count, solo_toke_count, tokes_saved_count, four_twenty_tokes_count, wake_and_bake_tokes_count, toke_club_sessions_count, current_streak, longest_streak FROM toke_stats WHERE user_id = ?", (user_id,))
-                    return await cursor.fetchone()
+                    await cursor.execute(f"SELECT {', '.join(USER_STATS_COLUMNS)} FROM toke_stats WHERE user_id = ?", (user_id,))
+                    row = await cursor.fetchone()
+                pending = self._pending_stats.get(user_id)
         except Exception as e:
             logging.error(f"Database error in _get_user_stats_from_db for user_id {user_id}: {e}")
             return None
 
+        if not pending:
+            return row
+
+        stats = list(row) if row else [None] + [0] * (len(USER_STATS_COLUMNS) - 1)
+        if pending["user_name"] is not None:
+            stats[0] = pending["user_name"]
+        for stat_column, value in pending["deltas"].items():
+            index = USER_STATS_COLUMNS.index(stat_column)
+            stats[index] = (stats[index] or 0) + value
+        return tuple(stats)
+
     @commands.command(brief="Displays your or another user's toke statistics 📊. Usage: !stats [@user]")
     async def stats(self, ctx, member: discord.Member = None):
         """Displays toke statistics for yourself or a mentioned user."""
@@ -333,5 +555,30 @@ class TreesTrackerCog(commands.Cog):
         else:
             await ctx.send(f"{target_user.display_name} hasn't participated in any tokes yet, or their stats couldn't be found. 🤷")
 
+    async def get_user_ranks(self, user_id: int):
+        """
+        Returns {stat column: (value, rank, users ranked)} for every stat in LEADERBOARD_STATS, or None if the user has no stats.
+        Rank is 1 + the number of users with a strictly higher value, and None when the value is 0.
+        """
+        await self.flush_pending_stats() # Ranks should include increments still in the buffer
+        return self.rank_index.get_ranks(user_id)
+
+    @commands.command(brief="Shows your or another user's rank on every leaderboard 🏅. Usage: !rank [@user]")
+    async def rank(self, ctx, member: discord.Member = None):
+        """Displays a user's position on each leaderboard."""
+        target_user = member or ctx.author
+        ranks = await self.get_user_ranks(target_user.id)
+        if not ranks:
+            await ctx.send(f"{target_user.display_name} hasn't participated in any tokes yet, or their stats couldn't be found. 🤷")
+            return
+
+        embed = discord.Embed(title=f"🏅 Leaderboard Ranks for {target_user.display_name} 🏅", color=discord.Color.gold())
+        embed.set_thumbnail(url=target_user.display_avatar.url)
+        for stat in LEADERBOARD_STATS:
+            value, rank, ranked_count = ranks[stat["db_column"]]
+            rank_text = f"#{rank} of {ranked_count}" if rank else "Unranked"
+            embed.add_field(name=f"{stat['display_name']} {stat['emoji']}", value=f"{rank_text} ({value})", inline=True)
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(TreesTrackerCog(bot))
\ No newline at end of file
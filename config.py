@@ -5,6 +5,12 @@ import os
 ACHIEVEMENTS_DB = "achievements.db"
 MEDIA_DB = "media_library.db"
 TOKERS_DB = "tokers.db"
+QUEUE_DB = "queue.db"
+
+# Database Connection Settings
+DB_POOL_SIZE = 4  # Pooled read-only connections kept open per database file
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 8192
 
 # VLC Settings
 VLC_PATH = r"C:\Program Files\VideoLAN\VLC"
@@ -15,14 +21,66 @@ VLC_ARGS = [
     "--avcodec-hw=auto",
     "--network-caching=2000",
 ]
+GAPLESS_PLAYBACK = False  # Hand playlists to libvlc's MediaListPlayer, which moves between items without a round trip through the bot
+
+# YouTube Settings
+YOUTUBE_RESOLVER_WORKERS = 2  # yt-dlp worker processes; extraction is CPU heavy and kept off the bot's process
+YOUTUBE_RESOLVE_TIMEOUT_SECONDS = 60  # Per link, including time spent waiting in the queue
+YOUTUBE_MAX_QUEUED_PER_USER = 10
+YOUTUBE_PREFETCH_ITEMS = 2  # Queued YouTube links resolved ahead of time, counting from the next item
+YOUTUBE_PLAYLIST_FIRST_PAGE = 5  # Entries read before playback of a YouTube playlist or channel starts
+YOUTUBE_PLAYLIST_PAGE_SIZE = 100  # Entries read per page after that (YouTube serves 100 per listing page)
+YOUTUBE_PLAYLIST_MAX_ITEMS = 1000
+YOUTUBE_CACHE_SIZE = 200  # Resolved stream URLs kept, keyed by video id
+YOUTUBE_CACHE_DEFAULT_TTL_SECONDS = 1800  # For stream URLs without an expire parameter
+YOUTUBE_CACHE_EXPIRY_MARGIN_SECONDS = 300  # Stop handing out a stream URL this long before it expires
+
+# Queue Journal Settings
+QUEUE_CHECKPOINT_SECONDS = 5  # How often queue changes and the playback position are written out
+QUEUE_JOURNAL_COMPACT_ROWS = 2000  # Journal rows after which it is rewritten as a snapshot of the queue
 
 # Toke Settings
 TOKE_COUNTDOWN_SECONDS = 60
 TOKE_COOLDOWN_SECONDS = 240
 
+# Toke Tracker Settings
+STAT_FLUSH_INTERVAL_SECONDS = 5  # How often buffered stat increments are written to the database
+ACHIEVEMENT_CACHE_SIZE = 1000  # Users whose earned achievements are kept in memory
+
 # Remote Settings
 REMOTE_TIMEOUT_SECONDS = 300
 
+# Library Scanner Settings (populate_db.py)
+PLAYLIST_ROOTS = ["playlists", r"F:\VLC PLaylists"]  # Every .xspf under these becomes a playlist named after the file
+MEDIA_ROOTS = []  # Folders holding the media files themselves, e.g. [r"F:\Shows"]
+MEDIA_EXTENSIONS = {".mkv", ".mp4", ".avi", ".mov", ".m4v", ".webm", ".wmv", ".mpg", ".mpeg", ".ts", ".flv", ".mp3", ".flac", ".m4a", ".ogg", ".wav"}
+SCAN_WORKERS = 8  # Threads listing directories in parallel
+
+# Media Probe Settings
+PROBE_WORKERS = 2  # libvlc parses running at once; keep low so probing doesn't starve playback on slow drives
+PROBE_BATCH_SIZE = 20
+PROBE_TIMEOUT_MS = 10000
+PROBE_INTERVAL_SECONDS = 300  # How often the library is checked for unprobed or changed items
+
+# Watch History Settings
+WATCH_HISTORY_FLUSH_SECONDS = 30  # How often the playing item's position is sampled and buffered progress written
+WATCH_FINISHED_FRACTION = 0.95  # Share of an item that counts as watched to the end (skips the credits)
+WATCH_RESUME_REWIND_SECONDS = 5  # !resume starts this far before the saved position
+
+# Prefetch Settings
+PREFETCH_LEAD_SECONDS = 30  # How long before the current item ends to warm the next one
+PREFETCH_HEAD_BYTES = 32 * 1024 * 1024
+PREFETCH_TAIL_BYTES = 2 * 1024 * 1024
+
+# Playlist Cache Settings
+XSPF_CACHE_DIR = "xspf_cache"  # Parsed playlists, reused until the XSPF file's mtime or size changes
+XSPF_MEMORY_CACHE_SIZE = 8  # Parsed playlists kept in memory
+
+# Search Settings
+SEARCH_RESULT_LIMIT = 10
+SEARCH_FUZZY_CANDIDATES = 5  # Trigram candidates fetched per result before re-scoring typo matches
+SEARCH_MIN_SIMILARITY = 0.5  # Share of the query's trigrams a typo match must contain
+
 # Pagination Settings
 MEDIA_PAGE_SIZE = 10
 PLAYLIST_PAGE_SIZE = 10
@@ -1,21 +1,15 @@
 import sqlite3
 import logging
+from migrations import migrate_sync, MEDIA_MIGRATIONS
 
 DATABASE_FILE = "media_library.db"
 
 def create_database():
     try:
         conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS media (
-                name TEXT PRIMARY KEY,
-                file_path TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
+        version = migrate_sync(conn, MEDIA_MIGRATIONS, DATABASE_FILE)
         conn.close()
-        logging.info(f"Database '{DATABASE_FILE}' and table 'media' created successfully.")
+        logging.info(f"Database '{DATABASE_FILE}' created successfully at schema version {version}.")
     except sqlite3.Error as e:
         logging.error(f"Database error: {e}")
 
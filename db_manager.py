@@ -0,0 +1,123 @@
+# db_manager.py
+import aiosqlite
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import config
+
+# Applied to every connection when it is opened.
+# WAL lets the pooled readers run alongside the writer without blocking it, and
+# synchronous=NORMAL is the recommended (and still crash-safe) pairing for WAL.
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA cache_size=-{config.DB_CACHE_SIZE_KB}",
+]
+
+class _FilePool:
+    """Connections held open for a single database file."""
+    def __init__(self, db_file, pool_size):
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.writer = None
+        self.write_lock = asyncio.Lock()
+        self.readers = asyncio.Queue()
+        self.reader_count = 0
+        self.closed = False
+
+class DatabaseManager:
+    """
+    Shared database service for all cogs.
+    Keeps one long-lived writer connection and a small pool of reader connections per database file,
+    so a command no longer pays for a fresh aiosqlite thread and file open on every query.
+    """
+    def __init__(self, pool_size=config.DB_POOL_SIZE):
+        self.pool_size = pool_size
+        self._pools = {}
+
+    def _get_pool(self, db_file):
+        pool = self._pools.get(db_file)
+        if pool is None or pool.closed:
+            pool = _FilePool(db_file, self.pool_size)
+            self._pools[db_file] = pool
+        return pool
+
+    async def _open(self, db_file, read_only=False):
+        conn = await aiosqlite.connect(db_file)
+        try:
+            for pragma in CONNECTION_PRAGMAS:
+                await conn.execute(pragma)
+            if read_only:
+                await conn.execute("PRAGMA query_only=ON")
+        except Exception:
+            await conn.close()
+            raise
+        logging.info(f"Opened {'reader' if read_only else 'writer'} connection to '{db_file}'.")
+        return conn
+
+    @asynccontextmanager
+    async def connection(self, db_file):
+        """
+        Yields the writer connection for a database file.
+        Only one task holds it at a time, so a caller's statements and its commit are never interleaved
+        with another cog's. Anything left uncommitted when the block raises is rolled back.
+        """
+        pool = self._get_pool(db_file)
+        async with pool.write_lock:
+            if pool.writer is None:
+                pool.writer = await self._open(db_file)
+            conn = pool.writer
+            try:
+                yield conn
+            except BaseException:
+                if conn.in_transaction:
+                    await conn.rollback()
+                raise
+
+    @asynccontextmanager
+    async def reader(self, db_file):
+        """Yields a pooled read-only connection for a database file."""
+        pool = self._get_pool(db_file)
+        if pool.readers.empty() and pool.reader_count < pool.pool_size:
+            pool.reader_count += 1
+            try:
+                conn = await self._open(db_file, read_only=True)
+            except Exception:
+                pool.reader_count -= 1
+                raise
+        else:
+            conn = await pool.readers.get()
+
+        try:
+            yield conn
+        finally:
+            if pool.closed:
+                await conn.close()
+            else:
+                pool.readers.put_nowait(conn)
+
+    async def close(self, db_file):
+        """Closes every pooled connection for a database file (e.g. before the file is deleted)."""
+        pool = self._pools.pop(db_file, None)
+        if pool is None:
+            return
+        pool.closed = True
+        async with pool.write_lock:
+            if pool.writer is not None:
+                await pool.writer.close()
+                pool.writer = None
+        while not pool.readers.empty():
+            await pool.readers.get_nowait().close()
+        logging.info(f"Closed pooled connections to '{db_file}'.")
+
+    async def close_all(self):
+        for db_file in list(self._pools):
+            try:
+                await self.close(db_file)
+            except Exception as e:
+                logging.error(f"Error closing database '{db_file}': {e}")
+
+# The single instance shared by every cog.
+db_manager = DatabaseManager()
@@ -0,0 +1,91 @@
+# media_index.py
+import logging
+import os
+import re
+from xspf import load_xspf
+
+# Expands XSPF playlists into the media database's tracks table and search index.
+# Shared by DatabaseCog and the command line scripts: the blocking file work is done here,
+# and each caller runs the returned statements on its own connection in one transaction.
+
+def location_to_path(location):
+    """Returns the local file path for a track location, or None for streams and other non-file locations."""
+    if location.startswith("file://"):
+        path = location[len("file://"):]
+        if re.match(r"^/[A-Za-z]:", path): # file:///F:/Shows -> F:/Shows
+            path = path[1:]
+        return os.path.normpath(path)
+    if "://" in location:
+        return None
+    return location
+
+def _file_size(location):
+    path = location_to_path(location)
+    if path is None:
+        return None
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def playlist_signature(file_path):
+    """Returns the (mtime, size) a playlist file is indexed at, or (0, -1) if it can't be read. Blocking (one stat)."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return 0, -1 # Ingested with no tracks until the file shows up
+    return stat.st_mtime, stat.st_size
+
+def read_changed_playlists(media_rows, indexed_sources):
+    """
+    Stats every playlist file and reads the ones that changed since they were last ingested.
+    Blocking. Returns (name, file_path, mtime, size, tracks) for each changed playlist,
+    with tracks as (title, location, duration_ms, file_size).
+    """
+    changed = []
+    for name, file_path in media_rows:
+        mtime, size = playlist_signature(file_path)
+        if size < 0:
+            logging.warning(f"Media index: can't read playlist '{name}' ({file_path}).")
+
+        if indexed_sources.get(name) == (file_path, mtime, size):
+            continue
+
+        tracks = []
+        if size >= 0:
+            try:
+                tracks = [(title, location, duration_ms, _file_size(location)) for title, location, duration_ms in load_xspf(file_path)]
+            except Exception as e:
+                logging.warning(f"Media index: failed to parse playlist '{name}' ({file_path}): {e}")
+                mtime, size = 0, -1
+        changed.append((name, file_path, mtime, size, tracks))
+    return changed
+
+def index_statements(changed, removed):
+    """
+    Returns the (sql, rows) pairs that replace the tracks and search entries of the changed playlists
+    and drop those of removed ones. Run each with executemany, in order, inside one transaction.
+    """
+    stale_names = [(name,) for name in removed] + [(name,) for name, *_ in changed]
+    track_rows = []
+    search_rows = []
+    for name, _, _, _, tracks in changed:
+        search_rows.append((name, name, None))
+        for position, (title, location, duration_ms, file_size) in enumerate(tracks):
+            track_rows.append((name, position, title, location, duration_ms, file_size))
+            if title:
+                search_rows.append((title, name, position))
+
+    return [
+        ("DELETE FROM tracks WHERE playlist = ?", stale_names),
+        ("DELETE FROM media_search WHERE name = ?", stale_names),
+        ("DELETE FROM media_search_trigram WHERE name = ?", stale_names),
+        ("DELETE FROM playlist_sources WHERE name = ?", [(name,) for name in removed]),
+        ("INSERT INTO tracks (playlist, position, title, location, duration_ms, file_size) VALUES (?, ?, ?, ?, ?, ?)", track_rows),
+        ("INSERT INTO media_search (title, name, position) VALUES (?, ?, ?)", search_rows),
+        ("INSERT INTO media_search_trigram (title, name, position) VALUES (?, ?, ?)", search_rows),
+        (
+            "INSERT OR REPLACE INTO playlist_sources (name, file_path, mtime, size) VALUES (?, ?, ?, ?)",
+            [(name, file_path, mtime, size) for name, file_path, mtime, size, _ in changed]
+        ),
+    ]
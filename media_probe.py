@@ -0,0 +1,82 @@
+# media_probe.py
+import logging
+import re
+import threading
+import vlc
+
+# Track selection shared by live playback and the background prober.
+# Tracks are (track id, name) pairs; ids are libvlc elementary stream ids, which is what
+# audio_set_track/video_set_spu and the :audio-track-id/:sub-track-id options take.
+
+def _is_english(name):
+    name = name.lower()
+    return "english" in name or re.search(r"\[(en|eng)\]", name) is not None
+
+def choose_audio_track(tracks):
+    """Returns the id of the first English audio track, else the first real track, else None."""
+    for track_id, name in tracks:
+        if name and _is_english(name):
+            return track_id
+    for track_id, name in tracks:
+        if track_id != -1: # -1 is often 'Disable'
+            return track_id
+    return None
+
+def choose_subtitle_track(tracks):
+    """Returns the id of the first non-forced English subtitle track, else the first forced English one, else None."""
+    forced_track_id = None
+    for track_id, name in tracks:
+        if not name or not _is_english(name):
+            continue
+        if "forced" not in name.lower():
+            return track_id
+        if forced_track_id is None: # Only take the first forced one
+            forced_track_id = track_id
+    return forced_track_id
+
+def decode_name(value):
+    """Decodes a track name or language as returned by libvlc (bytes or None)."""
+    return value.decode("utf-8", errors="ignore") if value else ""
+
+def _track_name(track):
+    description = decode_name(track.description)
+    language = decode_name(track.language)
+    if description and language:
+        return f"{description} [{language}]"
+    return description or (f"[{language}]" if language else f"Track {track.id}")
+
+def probe_media(instance, location, timeout_ms):
+    """
+    Parses a media item with libvlc without playing it. Blocking; run it on a worker thread.
+    Returns {"duration_ms", "audio_tracks", "subtitle_tracks"} with tracks as [(id, name)], or None if parsing failed.
+    """
+    media = instance.media_new(location)
+    if not media:
+        return None
+    parsed = threading.Event()
+    events = media.event_manager()
+    events.event_attach(vlc.EventType.MediaParsedChanged, lambda event: parsed.set())
+    try:
+        if media.parse_with_options(vlc.MediaParseFlag.local, timeout_ms) != 0:
+            return None
+        parsed.wait(timeout_ms / 1000 + 1)
+        if media.get_parsed_status() != vlc.MediaParsedStatus.done:
+            logging.warning(f"Probe of '{location}' did not finish: {media.get_parsed_status()}")
+            return None
+
+        audio_tracks = []
+        subtitle_tracks = []
+        for track in media.tracks_get() or []:
+            if track.type == vlc.TrackType.audio:
+                audio_tracks.append((track.id, _track_name(track)))
+            elif track.type == vlc.TrackType.ext: # Text (subtitle) tracks
+                subtitle_tracks.append((track.id, _track_name(track)))
+        duration_ms = media.get_duration()
+        return {
+            "duration_ms": duration_ms if duration_ms > 0 else None,
+            "audio_tracks": audio_tracks,
+            "subtitle_tracks": subtitle_tracks,
+        }
+    finally:
+        events.event_detach(vlc.EventType.MediaParsedChanged)
+        media.release()
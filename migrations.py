@@ -0,0 +1,307 @@
+# migrations.py
+import logging
+from typing import NamedTuple
+
+class AddColumn(NamedTuple):
+    """Migration step that adds a column unless it is already there (for databases created before migrations existed)."""
+    table: str
+    column: str
+    definition: str
+
+    def sql(self):
+        return f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}"
+
+# Each database has an ordered list of migrations, and each migration is a list of steps.
+# A database's PRAGMA user_version is the number of migrations already applied to it.
+# Never edit or reorder a migration that has shipped; append a new one instead.
+
+TOKERS_MIGRATIONS = [
+    # 1: toke_stats. The AddColumn steps bring databases from before user_version tracking up to date.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS toke_stats (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT
+        )
+        ''',
+        AddColumn("toke_stats", "toke_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "solo_toke_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "tokes_saved_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "four_twenty_tokes_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "wake_and_bake_tokes_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "toke_club_sessions_count", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "current_streak", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "longest_streak", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("toke_stats", "last_toke_date", "TEXT"),
+    ],
+    # 2: Leaderboard indexes, so top-N queries read only the first rows of each index.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_toke_count ON toke_stats (toke_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_solo_toke_count ON toke_stats (solo_toke_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_tokes_saved_count ON toke_stats (tokes_saved_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_four_twenty_tokes_count ON toke_stats (four_twenty_tokes_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_wake_and_bake_tokes_count ON toke_stats (wake_and_bake_tokes_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_toke_club_sessions_count ON toke_stats (toke_club_sessions_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_current_streak ON toke_stats (current_streak DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_stats_longest_streak ON toke_stats (longest_streak DESC)",
+    ],
+    # 3: Append-only session log. toke_stats can be recomputed from it with !rebuildtokestats.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS toke_sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            ended_at TEXT NOT NULL,
+            started_by INTEGER,
+            participant_count INTEGER NOT NULL,
+            toke_club INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS toke_participants (
+            session_id INTEGER NOT NULL REFERENCES toke_sessions (session_id),
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            joined_at TEXT NOT NULL,
+            saved_toke INTEGER NOT NULL DEFAULT 0,
+            four_twenty INTEGER NOT NULL DEFAULT 0,
+            wake_and_bake INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, user_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_toke_sessions_started_at ON toke_sessions (started_at)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_participants_joined_at ON toke_participants (joined_at)",
+        "CREATE INDEX IF NOT EXISTS idx_toke_participants_user ON toke_participants (user_id, joined_at)",
+    ],
+]
+
+ACHIEVEMENTS_MIGRATIONS = [
+    # 1: Earned achievements and !earlytoke counters.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_id INTEGER NOT NULL,
+            achievement_id TEXT NOT NULL,
+            timestamp_earned DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, achievement_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS earlytoke_attempts (
+            user_id INTEGER PRIMARY KEY,
+            attempts INTEGER DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS earlytoke_lifetime (
+            user_id INTEGER PRIMARY KEY,
+            count INTEGER DEFAULT 0
+        )
+        ''',
+    ],
+]
+
+MEDIA_MIGRATIONS = [
+    # 1: Media library (playlist name -> XSPF path).
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS media (
+            name TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL
+        )
+        ''',
+    ],
+    # 2: Search index over playlist names and every track title.
+    # Rows with a NULL position are the playlists themselves; search_sources records which file version was indexed.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS search_sources (
+            name TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL
+        )
+        ''',
+        "CREATE VIRTUAL TABLE IF NOT EXISTS media_search USING fts5(title, name UNINDEXED, position UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS media_search_trigram USING fts5(title, name UNINDEXED, position UNINDEXED, tokenize = 'trigram')",
+    ],
+    # 3: Every playlist's tracks, so a playlist loads with one indexed query instead of re-reading its XSPF.
+    # search_sources becomes playlist_sources, since it now records what the tracks table was built from too.
+    [
+        "ALTER TABLE search_sources RENAME TO playlist_sources",
+        '''
+        CREATE TABLE IF NOT EXISTS tracks (
+            playlist TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            title TEXT,
+            location TEXT NOT NULL,
+            duration_ms INTEGER,
+            file_size INTEGER,
+            PRIMARY KEY (playlist, position)
+        ) WITHOUT ROWID
+        ''',
+        # Force the next refresh to re-ingest every playlist into the new table.
+        "DELETE FROM playlist_sources",
+    ],
+    # 4: Files found under the configured media roots by populate_db.py, so rescans only touch what changed.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS media_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 5: Background libvlc probe results per track location. Track lists are JSON [[id, name], ...];
+    # audio_track/subtitle_track are the chosen stream ids, applied when the item is loaded.
+    # A failed probe is stored with NULL track lists so it's only retried once the file changes.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS media_probe (
+            location TEXT PRIMARY KEY,
+            file_size INTEGER,
+            duration_ms INTEGER,
+            audio_tracks TEXT,
+            subtitle_tracks TEXT,
+            audio_track INTEGER,
+            subtitle_track INTEGER,
+            probed_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 6: Watch history per track location: first start, last finish, and how far it got, for !resume.
+    # finished stays 1 once an item has been watched to the end, even if it's rewatched part way later.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS watch_history (
+            location TEXT PRIMARY KEY,
+            started_at TEXT,
+            ended_at TEXT,
+            last_position_ms INTEGER NOT NULL DEFAULT 0,
+            duration_ms INTEGER,
+            finished INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 7: Change counters for tables that the bot caches, bumped by triggers so every writer (the bot,
+    # populate_db.py, clear_db.py) invalidates the caches and nothing else does.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS library_generation (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        "INSERT OR IGNORE INTO library_generation (name) VALUES ('media')",
+        "CREATE TRIGGER IF NOT EXISTS media_generation_insert AFTER INSERT ON media BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'media'; END",
+        "CREATE TRIGGER IF NOT EXISTS media_generation_delete AFTER DELETE ON media BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'media'; END",
+        # populate_db.py upserts every playlist on each run; only a real change counts
+        "CREATE TRIGGER IF NOT EXISTS media_generation_update AFTER UPDATE ON media WHEN old.name IS NOT new.name OR old.file_path IS NOT new.file_path BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'media'; END",
+    ],
+    # 8: Counter for playlist_sources, which every (re-)ingest of a playlist's tracks writes, so ProbeCog reloads
+    # XSPF durations after ingests by the bot or populate_db.py. INSERT OR REPLACE fires the insert trigger.
+    [
+        "INSERT OR IGNORE INTO library_generation (name) VALUES ('playlist_sources')",
+        "CREATE TRIGGER IF NOT EXISTS playlist_sources_generation_insert AFTER INSERT ON playlist_sources BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'playlist_sources'; END",
+        "CREATE TRIGGER IF NOT EXISTS playlist_sources_generation_update AFTER UPDATE ON playlist_sources BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'playlist_sources'; END",
+        "CREATE TRIGGER IF NOT EXISTS playlist_sources_generation_delete AFTER DELETE ON playlist_sources BEGIN UPDATE library_generation SET generation = generation + 1 WHERE name = 'playlist_sources'; END",
+    ],
+    # 9: Tracks with an empty <title/> were ingested with an empty title instead of their file name;
+    # force the next refresh to re-ingest every playlist.
+    [
+        "DELETE FROM playlist_sources",
+    ],
+]
+
+QUEUE_MIGRATIONS = [
+    # 1: The shared playlist's mutation log and the last playback checkpoint, for resuming after a restart.
+    # Journal rows are TrackQueue mutations (op, JSON data) in seq order; replaying them rebuilds the queue.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS queue_journal (
+            seq INTEGER PRIMARY KEY,
+            op TEXT NOT NULL,
+            data TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS playback_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            current_index INTEGER NOT NULL,
+            location TEXT,
+            position_ms INTEGER,
+            playing INTEGER NOT NULL,
+            channel_id INTEGER,
+            message_id INTEGER,
+            saved_at TEXT NOT NULL
+        )
+        ''',
+    ],
+]
+
+def _column_names(rows):
+    return {row[1] for row in rows}
+
+async def migrate(conn, migrations, db_name):
+    """
+    Brings an aiosqlite connection's database up to date with its migration list.
+    When nothing is pending this is a single PRAGMA user_version read; otherwise every pending migration
+    is applied in one transaction together with the new user_version.
+    """
+    async with conn.execute("PRAGMA user_version") as cursor:
+        (version,) = await cursor.fetchone()
+    target = len(migrations)
+    if version >= target:
+        if version > target:
+            logging.warning(f"Database '{db_name}' is at schema version {version}, newer than this code ({target}).")
+        return version
+
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-read under the write lock in case another process migrated in the meantime.
+        async with conn.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        for number, steps in enumerate(migrations[version:], start=version + 1):
+            for step in steps:
+                if isinstance(step, AddColumn):
+                    async with conn.execute(f"PRAGMA table_info({step.table})") as cursor:
+                        if step.column in _column_names(await cursor.fetchall()):
+                            continue
+                    step = step.sql()
+                await conn.execute(step)
+            logging.info(f"Applied migration {number} to database '{db_name}'.")
+        await conn.execute(f"PRAGMA user_version = {max(version, target)}")
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+    return target
+
+def migrate_sync(conn, migrations, db_name):
+    """sqlite3 counterpart of migrate(), for the command line scripts."""
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    target = len(migrations)
+    if version >= target:
+        if version > target:
+            logging.warning(f"Database '{db_name}' is at schema version {version}, newer than this code ({target}).")
+        return version
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        for number, steps in enumerate(migrations[version:], start=version + 1):
+            for step in steps:
+                if isinstance(step, AddColumn):
+                    if step.column in _column_names(conn.execute(f"PRAGMA table_info({step.table})").fetchall()):
+                        continue
+                    step = step.sql()
+                conn.execute(step)
+            logging.info(f"Applied migration {number} to database '{db_name}'.")
+        conn.execute(f"PRAGMA user_version = {max(version, target)}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return target
@@ -1,73 +1,166 @@
 import sqlite3
 import logging
 import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import config
+from migrations import migrate_sync, MEDIA_MIGRATIONS
+import media_index
 
-DATABASE_FILE = "media_library.db"
-PLAYLIST_DIR = "playlists"
+DATABASE_FILE = config.MEDIA_DB
 
-def add_media(name, file_path):
+# Scans the configured playlist and media roots and brings the media database in line with them:
+# new and changed entries are upserted, vanished ones are pruned, and unchanged rows are left alone.
+# Everything is written in one transaction, so the bot never sees a half-synced library.
+
+def _scan_directory(directory, extensions):
+    """
+    Returns ({path: (size, mtime_ns)} for every file under directory with one of the extensions,
+    [folders that couldn't be listed]).
+    """
+    found = {}
+    unreadable = []
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            logging.warning(f"Skipping '{current}': {e}")
+            unreadable.append(current)
+    return found, unreadable
+
+def scan_roots(pool, roots, extensions):
+    """
+    Scans the roots in parallel, one task per top level folder.
+    Returns ({path: (size, mtime_ns)}, available roots, skipped folders). Roots that are missing or can't be
+    listed (e.g. an unplugged drive) are skipped rather than available, and so is any folder that couldn't be
+    listed part way through; nothing under a skipped folder gets pruned.
+    """
+    available = []
+    skipped = []
+    futures = []
+    found = {}
+    for root in roots:
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            logging.warning(f"Root '{root}' is not available; leaving its entries as they are.")
+            skipped.append(root)
+            continue
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        futures.append(pool.submit(_scan_directory, entry.path, extensions))
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            logging.warning(f"Can't list root '{root}' ({e}); leaving its entries as they are.")
+            skipped.append(root)
+            continue
+        available.append(root)
+    for future in futures:
+        directory_found, unreadable = future.result()
+        found.update(directory_found)
+        skipped += unreadable
+    return found, available, skipped
+
+def _is_under(path, roots):
+    path = os.path.normcase(os.path.abspath(path))
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in map(os.path.normcase, roots))
+
+def sync_playlists(conn, pool, roots):
+    """
+    Returns the (sql, rows) pairs that bring the media table in line with the .xspf files under the roots,
+    and the media table's (name, file_path) rows as they will be once those run.
+    """
+    found, available, skipped = scan_roots(pool, roots, {".xspf"})
+    scanned = {}
+    for path in sorted(found):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in scanned:
+            logging.warning(f"Playlist name '{name}' is used by both '{scanned[name]}' and '{path}'; keeping the first.")
+            continue
+        scanned[name] = path
+
+    existing = dict(conn.execute("SELECT name, file_path FROM media"))
+    upserts = [(name, path) for name, path in scanned.items() if existing.get(name) != path]
+    pruned = [
+        (name,) for name, path in existing.items()
+        if name not in scanned and not _is_under(path, skipped) and (_is_under(path, available) or not os.path.exists(path))
+    ]
+    logging.info(f"Playlists: {len(scanned)} found, {len(upserts)} new or moved, {len(pruned)} vanished.")
+
+    media = dict(existing)
+    for (name,) in pruned:
+        del media[name]
+    media.update(upserts)
+    return [
+        ("DELETE FROM media WHERE name = ?", pruned),
+        ("INSERT INTO media (name, file_path) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET file_path = excluded.file_path", upserts),
+    ], list(media.items())
+
+def sync_media_files(conn, pool, roots):
+    """Returns the (sql, rows) pairs that bring the media_files table in line with the files under the roots."""
+    found, _, skipped = scan_roots(pool, roots, config.MEDIA_EXTENSIONS)
+    existing = {path: (size, mtime_ns) for path, size, mtime_ns in conn.execute("SELECT path, size, mtime_ns FROM media_files")}
+    upserts = [(path, size, mtime_ns) for path, (size, mtime_ns) in found.items() if existing.get(path) != (size, mtime_ns)]
+    pruned = [(path,) for path in existing if path not in found and not _is_under(path, skipped)]
+    logging.info(f"Media files: {len(found)} found, {len(upserts)} new or changed, {len(pruned)} vanished.")
+    return [
+        ("DELETE FROM media_files WHERE path = ?", pruned),
+        (
+            "INSERT INTO media_files (path, size, mtime_ns) VALUES (?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns",
+            upserts
+        ),
+    ]
+
+def scan_library(playlist_roots, media_roots, workers=config.SCAN_WORKERS):
+    conn = sqlite3.connect(DATABASE_FILE, timeout=config.DB_BUSY_TIMEOUT_MS / 1000)
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO media (name, file_path) VALUES (?, ?)", (name, file_path))
-        conn.commit()
-        conn.close()
-        logging.info(f"Added media: {name} - {file_path}")
+        migrate_sync(conn, MEDIA_MIGRATIONS, DATABASE_FILE)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statements, media_rows = sync_playlists(conn, pool, playlist_roots)
+            statements += sync_media_files(conn, pool, media_roots)
+
+            # Expand new and changed playlists into the tracks table and search index, parsing them in parallel
+            indexed_sources = {name: (file_path, mtime, size) for name, file_path, mtime, size in conn.execute("SELECT name, file_path, mtime, size FROM playlist_sources")}
+            changed = [playlist for result in pool.map(lambda row: media_index.read_changed_playlists([row], indexed_sources), media_rows) for playlist in result]
+            media_names = {name for name, _ in media_rows}
+            removed = [name for name in indexed_sources if name not in media_names]
+            statements += media_index.index_statements(changed, removed)
+
+            with conn:
+                for sql, rows in statements:
+                    conn.executemany(sql, rows)
+        logging.info(f"Library scan finished in {time.perf_counter() - started:.2f}s: {len(changed)} playlist(s) re-ingested, {len(removed)} removed.")
     except sqlite3.Error as e:
         logging.error(f"Database error: {e}")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    # Ensure playlist directory exists
-    if not os.path.exists(PLAYLIST_DIR):
-        os.makedirs(PLAYLIST_DIR)
-        logging.warning(f"Created directory '{PLAYLIST_DIR}'. Please place your .xspf files there.")
-
-    # Dictionary of Name -> Filename
-    media_files = {
-        "South Park Season 5": "South Park Season 5.xspf",
-        "South Park Season 10": "South Park Season 10.xspf",
-        "The Bear": "The Bear.xspf",
-        "True Detective": "True Detective.xspf",
-        "TTN Bumps": "TTN Bumps.xspf",
-        "Twin Peaks": "Twin Peaks.xspf",
-        "WWDITS": "WWDITS.xspf",
-        "Adolescence": "Adolescence.xspf",
-        "Adult Animation": "Adult Animation.xspf",
-        "American Dad and Family Guy": "American Dad and Family Guy.xspf",
-        "American Dad": "American Dad.xspf",
-        "Archer": "Archer.xspf",
-        "ATLA": "ATLA.xspf",
-        "Bojack Horseman": "Bojack Horseman.xspf",
-        "Chainsaw Man": "Chainsaw Man.xspf",
-        "Comedy TV": "Comedy TV.xspf",
-        "Courage the Cowardly Dog": "Courage the Cowardly Dog.xspf",
-        "Cyberpunk": "Cyberpunk.xspf",
-        "Family Guy Season 23": "Family Guy Season 23.xspf",
-        "Futurama": "Futurama.xspf",
-        "Gravity Falls": "Gravity Falls.xspf",
-        "Hannibal": "Hannibal.xspf",
-        "Horror": "Horror.xspf",
-        "I Think You Should Leave": "I Think You Should Leave.xspf",
-        "IASIP": "IASIP.xspf",
-        "IASP Season 16": "IASP Season 16.xspf",
-        "KOTH": "KOTH.xspf",
-        "Movies": "Movies.xspf",
-        "Mr. Robot": "Mr. Robot.xspf",
-        "New Movies": "New Movies.xspf",
-        "Rick and Morty Season 8": "Rick and Morty Season 8.xspf",
-        "Saturday Morning Cartoons": "Saturday Morning Cartoons.xspf",
-        "Scream": "Scream.xspf"
-    }
-
-    for name, filename in media_files.items():
-        # Use absolute path based on current working directory
-        full_path = os.path.abspath(os.path.join(PLAYLIST_DIR, filename))
-        add_media(name, full_path)
-    add_media("Serial Experiments Lain", "F:\\VLC PLaylists\\Serial Experiments Lain.xspf")
-    add_media("Severance", "F:\\VLC PLaylists\\Severance.xspf")
-    add_media("Smiling Friends", "F:\\VLC PLaylists\\Smiling Friends.xspf")
-    add_media("Pluto", "F:\\VLC PLaylists\\Pluto.xspf")
-    
-    logging.info("Finished populating database.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Syncs the media library database with the playlist and media folders.")
+    parser.add_argument("--playlists", nargs="*", default=config.PLAYLIST_ROOTS, help="Folders to search for .xspf playlists (default: config.PLAYLIST_ROOTS)")
+    parser.add_argument("--media", nargs="*", default=config.MEDIA_ROOTS, help="Folders holding the media files (default: config.MEDIA_ROOTS)")
+    parser.add_argument("--workers", type=int, default=config.SCAN_WORKERS, help="Threads used to list folders and parse playlists")
+    args = parser.parse_args()
+
+    # Ensure the default playlist directory exists
+    if not os.path.exists("playlists"):
+        os.makedirs("playlists")
+        logging.warning("Created directory 'playlists'. Please place your .xspf files there.")
+
+    scan_library(args.playlists, args.media, args.workers)
@@ -0,0 +1,35 @@
+# prefetch.py
+import os
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+def warm_file(path, head_bytes, tail_bytes):
+    """
+    Pulls the start of a file, and its end (where containers like MKV and MP4 often keep their index),
+    into the OS page cache so the player doesn't cold-read them from a slow drive.
+    Uses posix_fadvise(WILLNEED) where the OS has it and otherwise reads and discards the bytes.
+    Blocking; returns the number of bytes warmed. Raises OSError if the file can't be read.
+    """
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        ranges = [(0, min(head_bytes, size))]
+        tail_start = max(size - tail_bytes, head_bytes)
+        if tail_start < size:
+            ranges.append((tail_start, size - tail_start))
+
+        if hasattr(os, "posix_fadvise"):
+            for offset, length in ranges:
+                os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+            return sum(length for _, length in ranges)
+
+        buffer = bytearray(READ_CHUNK_BYTES)
+        warmed = 0
+        for offset, length in ranges:
+            f.seek(offset)
+            while length > 0:
+                read = f.readinto(memoryview(buffer)[:min(length, READ_CHUNK_BYTES)])
+                if not read:
+                    break
+                warmed += read
+                length -= read
+        return warmed
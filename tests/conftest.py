@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The bot's modules are imported from the repository root, as treescord.py does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import sqlite3
+import pytest
+from migrations import migrate_sync, MEDIA_MIGRATIONS, TOKERS_MIGRATIONS
+
+def user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def table_names(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def test_fresh_database_gets_every_migration():
+    conn = sqlite3.connect(":memory:")
+    assert migrate_sync(conn, MEDIA_MIGRATIONS, "media") == len(MEDIA_MIGRATIONS)
+    assert user_version(conn) == len(MEDIA_MIGRATIONS)
+    assert {"media", "tracks", "playlist_sources", "media_probe", "watch_history", "library_generation", "media_generation_insert"} <= table_names(conn)
+    assert "search_sources" not in table_names(conn) # Renamed by migration 3
+
+    # Up to date: nothing runs again
+    assert migrate_sync(conn, MEDIA_MIGRATIONS, "media") == len(MEDIA_MIGRATIONS)
+
+def test_partly_migrated_database_gets_only_the_rest():
+    conn = sqlite3.connect(":memory:")
+    migrate_sync(conn, MEDIA_MIGRATIONS[:2], "media")
+    assert user_version(conn) == 2
+    conn.execute("INSERT INTO media (name, file_path) VALUES ('Show', 'show.xspf')")
+    conn.execute("INSERT INTO search_sources (name, file_path, mtime, size) VALUES ('Show', 'show.xspf', 1, 2)")
+    conn.commit()
+
+    assert migrate_sync(conn, MEDIA_MIGRATIONS, "media") == len(MEDIA_MIGRATIONS)
+    assert conn.execute("SELECT name, file_path FROM media").fetchall() == [("Show", "show.xspf")]
+    assert conn.execute("SELECT COUNT(*) FROM playlist_sources").fetchone() == (0,) # Cleared to force a re-ingest
+    assert "tracks" in table_names(conn)
+
+def test_database_from_before_versioning_gets_missing_columns_only():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE toke_stats (user_id INTEGER PRIMARY KEY, user_name TEXT, toke_count INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("INSERT INTO toke_stats (user_id, user_name, toke_count) VALUES (1, 'tester', 12)")
+    conn.commit()
+
+    migrate_sync(conn, TOKERS_MIGRATIONS, "tokers")
+    assert columns(conn, "toke_stats").count("toke_count") == 1
+    assert {"solo_toke_count", "current_streak", "longest_streak", "last_toke_date"} <= set(columns(conn, "toke_stats"))
+    assert conn.execute("SELECT toke_count, solo_toke_count FROM toke_stats WHERE user_id = 1").fetchone() == (12, 0)
+
+def test_failed_migration_rolls_back_everything():
+    conn = sqlite3.connect(":memory:")
+    broken = [["CREATE TABLE first (id INTEGER)"], ["CREATE TABLE second (id INTEGER)", "INSERT INTO missing VALUES (1)"]]
+    with pytest.raises(sqlite3.Error):
+        migrate_sync(conn, broken, "broken")
+    assert user_version(conn) == 0
+    assert "first" not in table_names(conn)
+
+def test_newer_database_is_left_alone():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA user_version = 99")
+    assert migrate_sync(conn, MEDIA_MIGRATIONS, "media") == 99
+    assert "media" not in table_names(conn)
@@ -0,0 +1,43 @@
+import asyncio
+import sqlite3
+import discord
+from discord.ext import commands
+import config
+from db_manager import db_manager
+from cogs.playlist_cog import PlaylistCog
+from cogs.queue_journal_cog import QueueJournalCog
+
+class PlaybackCog(commands.Cog):
+    """Stands in for the real PlaybackCog, which needs a VLC instance; nothing is playing."""
+    def __init__(self):
+        self.media_player = None
+        self.last_ctx = None
+
+async def start_bot():
+    bot = commands.Bot(command_prefix='!', intents=discord.Intents.default())
+    # Same order as treescord.py, so the cogs are removed in the same order on close.
+    await bot.add_cog(PlaylistCog(bot))
+    await bot.add_cog(PlaybackCog())
+    await bot.add_cog(QueueJournalCog(bot))
+    return bot
+
+def test_close_writes_pending_mutations(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "QUEUE_DB", str(tmp_path / "queue.db"))
+
+    async def run():
+        bot = await start_bot()
+        bot.get_cog('PlaylistCog').shared_playlist.extend([("A", "file:///a.mkv"), ("B", "file:///b.mkv")])
+        await bot.close()
+        await db_manager.close_all()
+
+        bot = await start_bot()
+        restored = [tuple(track) for track in bot.get_cog('PlaylistCog').shared_playlist]
+        await bot.close()
+        await db_manager.close_all()
+        return restored
+
+    restored = asyncio.run(run())
+    with sqlite3.connect(config.QUEUE_DB) as conn:
+        ops = [op for (op,) in conn.execute("SELECT op FROM queue_journal ORDER BY seq")]
+    assert ops == ["extend"]
+    assert restored == [("A", "file:///a.mkv"), ("B", "file:///b.mkv")]
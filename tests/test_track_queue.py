@@ -0,0 +1,104 @@
+import random
+import pytest
+from track_queue import TrackQueue
+
+def make_queue(count, journal=None):
+    queue = TrackQueue()
+    queue.journal = journal
+    queue.extend((f"Episode {i}", f"file:///shows/{i}.mkv") for i in range(count))
+    return queue
+
+def play_order(queue):
+    return [tuple(track) for track in queue]
+
+def test_indexing_and_iteration_follow_queue_order():
+    queue = make_queue(5)
+    assert len(queue) == 5 and queue
+    assert tuple(queue[2]) == ("Episode 2", "file:///shows/2.mkv")
+    assert [track.title for track in queue[1:4]] == ["Episode 1", "Episode 2", "Episode 3"]
+    assert [track.title for track in queue] == [f"Episode {i}" for i in range(5)]
+    assert not TrackQueue()
+
+def test_shuffle_is_a_permutation_and_unshuffle_keeps_the_current_track():
+    random.seed(4)
+    queue = make_queue(50)
+    original = play_order(queue)
+    version = queue.version
+    queue.shuffle()
+    assert queue.shuffled and queue.version > version
+    assert sorted(play_order(queue)) == sorted(original)
+    assert play_order(queue) != original
+
+    current = queue[17]
+    position = queue.unshuffle(17)
+    assert not queue.shuffled
+    assert queue[position] is current
+    assert play_order(queue) == original
+
+def test_unshuffle_of_an_unshuffled_queue_or_a_missing_position():
+    queue = make_queue(3)
+    assert queue.unshuffle(2) == 2
+    queue.shuffle()
+    assert queue.unshuffle(-1) == -1
+
+def test_unshuffle_with_duplicate_locations_finds_the_same_entry():
+    random.seed(1)
+    queue = TrackQueue()
+    queue.extend([("A", "file:///a.mkv"), ("B", "file:///b.mkv"), ("A again", "file:///a.mkv")])
+    queue.shuffle()
+    position = next(i for i, track in enumerate(queue) if track.title == "A again")
+    assert queue[queue.unshuffle(position)].title == "A again"
+
+def test_extend_while_shuffled_plays_new_tracks_last_in_order():
+    random.seed(2)
+    queue = make_queue(10)
+    queue.shuffle()
+    shuffled = play_order(queue)
+    queue.extend([("New 1", "file:///new1.mkv"), ("New 2", "file:///new2.mkv")])
+    assert play_order(queue) == shuffled + [("New 1", "file:///new1.mkv"), ("New 2", "file:///new2.mkv")]
+    queue.unshuffle(0)
+    assert [track.title for track in queue][-2:] == ["New 1", "New 2"]
+
+def test_set_title_renames_every_track_of_a_location_and_bumps_the_version():
+    journal = []
+    queue = TrackQueue()
+    queue.journal = journal
+    queue.extend([("https://youtu.be/x", "https://youtu.be/x"), ("Other", "file:///o.mkv"), ("https://youtu.be/x", "https://youtu.be/x")])
+    version = queue.version
+    queue.set_title("https://youtu.be/x", "A Video")
+    assert [track.title for track in queue] == ["A Video", "Other", "A Video"]
+    assert queue.version == version + 1
+    assert journal[-1] == ("title", ["https://youtu.be/x", "A Video"])
+
+    queue.set_title("https://youtu.be/x", "A Video") # Unchanged: nothing recorded
+    queue.set_title("https://youtu.be/missing", "Nope")
+    assert queue.version == version + 1 and len(journal) == 2
+
+def test_journal_replay_and_snapshot_rebuild_the_queue():
+    random.seed(3)
+    journal = []
+    queue = make_queue(8, journal)
+    queue.shuffle()
+    queue.append("Late", "file:///late.mkv")
+    queue.set_title("file:///shows/3.mkv", "Episode Three")
+    queue.clear()
+    queue.extend([("X", "file:///x.mkv"), ("Y", "file:///y.mkv"), ("Z", "file:///z.mkv")])
+    queue.shuffle()
+    queue.set_title("file:///y.mkv", "Why")
+
+    replayed = TrackQueue()
+    for op, data in journal:
+        replayed.replay(op, data)
+    assert play_order(replayed) == play_order(queue)
+
+    rebuilt = TrackQueue()
+    for op, data in queue.snapshot():
+        rebuilt.replay(op, data)
+    assert play_order(rebuilt) == play_order(queue)
+    assert rebuilt.shuffled
+    rebuilt.set_title("file:///x.mkv", "Ex") # The location index is rebuilt too
+    assert "Ex" in [track.title for track in rebuilt]
+
+def test_replay_rejects_unknown_mutations():
+    with pytest.raises(ValueError):
+        TrackQueue().replay("rotate", None)
@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+import pytest
+from db_manager import db_manager
+from cogs.trees_tracker_cog import RankIndex, TreesTrackerCog
+
+USER_ID = 42
+
+def record_join_after(tmp_path, last_toke_date, current_streak, longest_streak):
+    """Seeds a user who last toked on last_toke_date, records a join today, and returns (current, longest) streak."""
+    async def run():
+        cog = TreesTrackerCog(None)
+        cog.db_file = str(tmp_path / "tokers.db")
+        await cog._initialize_database()
+        if last_toke_date is not None:
+            async with db_manager.connection(cog.db_file) as conn:
+                await conn.execute(
+                    "INSERT INTO toke_stats (user_id, user_name, toke_count, current_streak, longest_streak, last_toke_date) VALUES (?, 'tester', 3, ?, ?, ?)",
+                    (USER_ID, current_streak, longest_streak, last_toke_date.isoformat())
+                )
+                await conn.commit()
+        row = await cog._record_toke_activity(USER_ID, "tester", {"toke_count": 1})
+        await db_manager.close_all()
+        return row[-2], row[-1]
+    return asyncio.run(run())
+
+def test_first_toke_starts_a_streak(tmp_path):
+    assert record_join_after(tmp_path, None, 0, 0) == (1, 1)
+
+def test_second_toke_on_the_same_day_keeps_the_streak(tmp_path):
+    assert record_join_after(tmp_path, datetime.date.today(), 4, 6) == (4, 6)
+
+@pytest.mark.parametrize("current_streak, longest_streak, expected", [(4, 4, (5, 5)), (2, 9, (3, 9))])
+def test_toke_on_the_next_day_extends_the_streak(tmp_path, current_streak, longest_streak, expected):
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    assert record_join_after(tmp_path, yesterday, current_streak, longest_streak) == expected
+
+def test_a_missed_day_restarts_the_streak(tmp_path):
+    assert record_join_after(tmp_path, datetime.date.today() - datetime.timedelta(days=3), 7, 7) == (1, 7)
+
+def test_rank_index_load_and_rank():
+    index = RankIndex(["toke_count", "longest_streak"])
+    index.load([(1, 10, 3), (2, 25, None), (3, 10, 7), (4, 0, 0)])
+    assert index.get_ranks(2) == {"toke_count": (25, 1, 3), "longest_streak": (0, None, 2)}
+    assert index.get_ranks(1)["toke_count"] == (10, 2, 3) # Ties share the better rank
+    assert index.get_ranks(3)["toke_count"] == (10, 2, 3)
+    assert index.get_ranks(4)["toke_count"] == (0, None, 3) # Zero isn't ranked
+    assert index.get_ranks(99) is None
+
+def test_rank_index_insert_update_and_add():
+    index = RankIndex(["toke_count", "longest_streak"])
+    index.load([(1, 10, 3), (2, 25, 1)])
+    index.update(5, {"toke_count": 30}) # New user; longest_streak stays 0
+    assert index.get_ranks(5) == {"toke_count": (30, 1, 3), "longest_streak": (0, None, 2)}
+    assert index.get_ranks(2)["toke_count"] == (25, 2, 3)
+
+    index.update(5, {"toke_count": 5}) # Moves down past both others
+    assert index.get_ranks(5)["toke_count"] == (5, 3, 3)
+    assert index.get_ranks(1)["toke_count"] == (10, 2, 3)
+
+    index.add(1, {"toke_count": 20, "longest_streak": 1})
+    assert index.get_ranks(1) == {"toke_count": (30, 1, 3), "longest_streak": (4, 1, 2)}
+
+    index.update(2, {"toke_count": 0}) # Drops out of the ranking
+    assert index.get_ranks(2)["toke_count"] == (0, None, 2)
+    assert index.get_ranks(5)["toke_count"] == (5, 2, 2)
@@ -0,0 +1,53 @@
+import os
+import config
+import xspf
+
+PLAYLIST = """<?xml version="1.0" encoding="UTF-8"?>
+<playlist xmlns="http://xspf.org/ns/0/" version="1">
+  <trackList>
+    <track><location>file:///shows/Pilot%20Episode.mkv</location><title>{title}</title><duration>1000</duration></track>
+    <track><location>file:///shows/Second.mkv</location><title/></track>
+    <track><location>file:///shows/Third.mkv</location></track>
+  </trackList>
+</playlist>
+"""
+
+def write_playlist(path, title):
+    path.write_text(PLAYLIST.format(title=title), encoding="utf-8")
+
+def test_parse_xspf_falls_back_to_file_name(tmp_path):
+    playlist = tmp_path / "show.xspf"
+    write_playlist(playlist, "Pilot")
+    assert xspf.parse_xspf(str(playlist)) == [
+        ("Pilot", "file:///shows/Pilot Episode.mkv", 1000),
+        ("Second.mkv", "file:///shows/Second.mkv", None),
+        ("Third.mkv", "file:///shows/Third.mkv", None),
+    ]
+
+def test_load_xspf_reparses_only_when_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "XSPF_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(xspf, "_memory_cache", type(xspf._memory_cache)())
+    parses = []
+    parse_xspf = xspf.parse_xspf
+    monkeypatch.setattr(xspf, "parse_xspf", lambda path: parses.append(path) or parse_xspf(path))
+    playlist = tmp_path / "show.xspf"
+    write_playlist(playlist, "Pilot")
+
+    assert xspf.load_xspf(str(playlist))[0][0] == "Pilot"
+    assert xspf.load_xspf(str(playlist))[0][0] == "Pilot"
+    assert len(parses) == 1
+
+    # A new process only has the disk cache
+    xspf._memory_cache.clear()
+    assert xspf.load_xspf(str(playlist))[0][0] == "Pilot"
+    assert len(parses) == 1
+
+    write_playlist(playlist, "Pilot (Extended)") # Size changes
+    assert xspf.load_xspf(str(playlist))[0][0] == "Pilot (Extended)"
+    assert len(parses) == 2
+
+    write_playlist(playlist, "Pilot (Remaster)") # Same size; only the mtime tells
+    stat = os.stat(playlist)
+    os.utime(playlist, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert xspf.load_xspf(str(playlist))[0][0] == "Pilot (Remaster)"
+    assert len(parses) == 3
@@ -0,0 +1,123 @@
+# track_queue.py
+import random
+import sys
+from array import array
+
+class Track:
+    """One queued item. Unpacks as (title, location), like the tuples the playlist used to hold."""
+    __slots__ = ("title", "location")
+
+    def __init__(self, title, location):
+        self.title = title
+        self.location = sys.intern(location) # Episodes of a show share long path prefixes; repeats share one string
+
+    def __iter__(self):
+        yield self.title
+        yield self.location
+
+    def __repr__(self):
+        return f"Track({self.title!r}, {self.location!r})"
+
+class TrackQueue:
+    """
+    The shared playlist: tracks in the order they were queued, plus an optional shuffle order kept as an integer
+    permutation over them, so shuffling and unshuffling never copy or compare tracks.
+    Indexing, len() and iteration follow play order (the shuffle order while shuffled).
+
+    Every change is an (op, data) mutation with JSON-friendly data. While journal is a list, mutations are appended
+    to it as they happen, and replay() applies them again, so the queue can be rebuilt from its mutation log.
+    """
+    __slots__ = ("tracks", "order", "positions", "version", "journal")
+
+    def __init__(self):
+        self.tracks = [] # Queue order
+        self.order = None # array of indexes into tracks, in play order, while shuffled
+        self.positions = {} # location -> indexes into tracks, so retitling a location doesn't scan the queue
+        self.version = 0 # Bumped whenever the play order or a title changes
+        self.journal = None # Mutations not yet written out, when someone is recording them
+
+    @property
+    def shuffled(self):
+        return self.order is not None
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __bool__(self):
+        return bool(self.tracks)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self.tracks)))]
+        return self.tracks[self.order[position] if self.order is not None else position]
+
+    def __iter__(self):
+        if self.order is None:
+            return iter(self.tracks)
+        return (self.tracks[i] for i in self.order)
+
+    def append(self, title, location):
+        self.extend([(title, location)])
+
+    def extend(self, items):
+        """Adds (title, location) pairs at the end; while shuffled they play after the shuffled tracks, in the order given."""
+        self._record("extend", [[title, location] for title, location in items])
+
+    def clear(self):
+        self._record("clear", None)
+
+    def shuffle(self):
+        """Shuffles the play order. Reshuffling an already shuffled queue starts from a fresh permutation."""
+        order = list(range(len(self.tracks)))
+        random.shuffle(order)
+        self._record("shuffle", order)
+
+    def unshuffle(self, position):
+        """Restores queue order and returns where the track at position (in shuffle order) ended up, or -1."""
+        if self.order is None:
+            return position
+        new_position = self.order[position] if 0 <= position < len(self.order) else -1
+        self._record("unshuffle", None)
+        return new_position
+
+    def set_title(self, location, title):
+        """Renames the tracks for location, e.g. a queued YouTube link once its video title is known."""
+        if any(self.tracks[i].title != title for i in self.positions.get(location, ())):
+            self._record("title", [location, title])
+
+    def snapshot(self):
+        """Returns the shortest list of mutations that rebuilds the queue as it is now."""
+        mutations = [("clear", None), ("extend", [[track.title, track.location] for track in self.tracks])]
+        if self.order is not None:
+            mutations.append(("shuffle", self.order.tolist()))
+        return mutations
+
+    def _record(self, op, data):
+        self.replay(op, data)
+        if self.journal is not None:
+            self.journal.append((op, data))
+
+    def replay(self, op, data):
+        """Applies one mutation without recording it."""
+        if op == "extend":
+            start = len(self.tracks)
+            self.tracks.extend(Track(title, location) for title, location in data)
+            for i in range(start, len(self.tracks)):
+                self.positions.setdefault(self.tracks[i].location, []).append(i)
+            if self.order is not None:
+                self.order.extend(range(start, len(self.tracks)))
+        elif op == "clear":
+            self.tracks = []
+            self.order = None
+            self.positions = {}
+        elif op == "shuffle":
+            self.order = array("l", data)
+        elif op == "unshuffle":
+            self.order = None
+        elif op == "title":
+            location, title = data
+            for i in self.positions.get(location, ()):
+                self.tracks[i].title = title
+        else:
+            raise ValueError(f"Unknown queue mutation '{op}'.")
+        self.version += 1
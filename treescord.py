@@ -6,6 +6,7 @@ import subprocess
 from dotenv import load_dotenv
 import logging
 import config
+from db_manager import db_manager
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
@@ -45,24 +46,29 @@ def refresh_vlc_plugin_cache():
         logging.warning("vlc-cache-gen.exe or plugins folder not found. Skipping cache refresh.")
 
 instance = None
-try:
-    # Attempt to refresh cache before creating instance
-    refresh_vlc_plugin_cache()
-
-    # Add hardware acceleration and other performance-related flags.
-    vlc_args = config.VLC_ARGS
-    instance = vlc.Instance(*vlc_args)
-    logging.info(f"VLC instance created successfully with args: {' '.join(vlc_args)}")
-except Exception as e:
-    logging.error(f"Fatal: Failed to create VLC instance: {e}")
-    logging.error("The bot cannot run without a VLC instance. Please ensure VLC is installed correctly.")
-    # We don't exit here to allow the bot to run for development/testing of other features, 
-    # but playback won't work.
-    
+# The yt-dlp resolver's worker processes re-import this module on Windows; only the bot's own process
+# creates the VLC instance and connects to Discord.
+if __name__ == "__main__":
+    try:
+        # Attempt to refresh cache before creating instance
+        refresh_vlc_plugin_cache()
+
+        # Add hardware acceleration and other performance-related flags.
+        vlc_args = config.VLC_ARGS
+        instance = vlc.Instance(*vlc_args)
+        logging.info(f"VLC instance created successfully with args: {' '.join(vlc_args)}")
+    except Exception as e:
+        logging.error(f"Fatal: Failed to create VLC instance: {e}")
+        logging.error("The bot cannot run without a VLC instance. Please ensure VLC is installed correctly.")
+        # We don't exit here to allow the bot to run for development/testing of other features, 
+        # but playback won't work.
+
 async def setup_hook():
     from cogs.playback_cog import PlaybackCog
     from cogs.playlist_cog import PlaylistCog
     from cogs.database_cog import DatabaseCog
+    from cogs.probe_cog import ProbeCog
+    from cogs.queue_journal_cog import QueueJournalCog
     from cogs.volume_cog import VolumeCog
     from cogs.toke_cog import TokeCog
     from cogs.remote_cog import RemoteCog
@@ -71,8 +77,10 @@ async def setup_hook():
 
     # Initialize the cogs
     database_cog = DatabaseCog(bot)
+    probe_cog = ProbeCog(bot, instance)
     playlist_cog = PlaylistCog(bot)
     playback_cog = PlaybackCog(bot, instance)  # Pass the instance.
+    queue_journal_cog = QueueJournalCog(bot)
     volume_cog = VolumeCog(bot)
     toke_cog = TokeCog(bot)
     remote_cog = RemoteCog(bot)
@@ -81,8 +89,10 @@ async def setup_hook():
 
     # Add the cogs to the bot
     await bot.add_cog(database_cog)
+    await bot.add_cog(probe_cog) # After DatabaseCog, which migrates the media database
     await bot.add_cog(playlist_cog)
     await bot.add_cog(playback_cog)
+    await bot.add_cog(queue_journal_cog) # After PlaylistCog and PlaybackCog, whose state it restores
     await bot.add_cog(volume_cog)
     await bot.add_cog(toke_cog)
     await bot.add_cog(remote_cog)
@@ -98,6 +108,19 @@ async def setup_hook():
 
 bot.setup_hook = setup_hook
 
+_bot_close = bot.close
+
+async def close():
+    # Checkpoint the queue while PlaybackCog is still loaded; unloading it stops the player.
+    queue_journal_cog = bot.get_cog('QueueJournalCog')
+    if queue_journal_cog:
+        await queue_journal_cog.flush()
+    # bot.close() unloads the cogs first, so anything they flush on unload still has its connection.
+    await _bot_close()
+    await db_manager.close_all()
+
+bot.close = close
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
@@ -125,12 +148,12 @@ async def help(ctx, command_name=None):
 
     help_embed = discord.Embed(title="Bot Commands", description="📃List of available commands:)")
     categories = {
-        "Playback": ["!play", "!pause", "!stop", "!status", "!forward", "!rewind"],
+        "Playback": ["!play", "!resume", "!pause", "!stop", "!status", "!forward", "!rewind"],
         "Volume": ["!volume", "!mute", "!unmute"],
         "Playlist": ["!playlist", "!add", "!clear", "!next", "!previous", "!jump", "!shuffle", "!unshuffle"],
-        "Media Library": ["!media or !list"],
+        "Media Library": ["!media or !list", "!find"],
         "Toke": ["!toke", "!leaderboard", "!l8toke", "!earlytoke"],
-        "Stats & Achievements": ["!stats", "!achievements"],
+        "Stats & Achievements": ["!stats", "!rank", "!achievements"],
         "Remote Control": ["!remote"]
     }
     for category, commands_list in categories.items():
@@ -169,4 +192,5 @@ async def getemojis(ctx):
          current_chunk += "```"
          await ctx.send(current_chunk)
 
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# xspf.py
+import defusedxml.ElementTree as ET
+from urllib.parse import unquote
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import threading
+import config
+
+TRACK_LIST_TAG = "{http://xspf.org/ns/0/}trackList"
+TRACK_TAG = "{http://xspf.org/ns/0/}track"
+TITLE_TAG = "{http://xspf.org/ns/0/}title"
+LOCATION_TAG = "{http://xspf.org/ns/0/}location"
+DURATION_TAG = "{http://xspf.org/ns/0/}duration"
+
+CACHE_FORMAT = 3 # Bump when the shape of the cached tracks changes
+
+def parse_xspf(file_path):
+    """
+    Returns the (title, location, duration_ms) of every track in an XSPF playlist, in playlist order.
+    duration_ms is None when the playlist doesn't record it.
+    The file is streamed with iterparse and each track element is dropped once read,
+    so memory stays flat even for playlists with thousands of entries.
+    """
+    media_files = []
+    track_list = None
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == TRACK_LIST_TAG and track_list is None:
+                track_list = elem
+            continue
+        if elem.tag != TRACK_TAG:
+            continue
+
+        location = elem.findtext(LOCATION_TAG)
+        if location:
+            location = unquote(location)
+            title = elem.findtext(TITLE_TAG) or os.path.basename(location) # An empty <title/> falls back too
+            duration = elem.findtext(DURATION_TAG)
+            duration_ms = int(duration) if duration and duration.strip().isdigit() else None
+            media_files.append((title, location, duration_ms))
+        if track_list is not None:
+            track_list.clear() # Tracks already read are no longer needed
+    return media_files
+
+# Parsed playlists, most recently used last: file path -> ((mtime_ns, size), tracks)
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+def _disk_cache_path(file_path):
+    digest = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+    return os.path.join(config.XSPF_CACHE_DIR, f"{digest}.json")
+
+def _read_disk_cache(file_path, signature):
+    try:
+        with open(_disk_cache_path(file_path), encoding="utf-8") as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable playlist cache for '{file_path}': {e}")
+        return None
+    if cached.get("format") != CACHE_FORMAT or cached.get("path") != os.path.abspath(file_path):
+        return None
+    if (cached.get("mtime_ns"), cached.get("size")) != signature:
+        return None
+    return tuple((title, location, duration_ms) for title, location, duration_ms in cached["tracks"])
+
+def _write_disk_cache(file_path, signature, tracks):
+    cache_path = _disk_cache_path(file_path)
+    temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(config.XSPF_CACHE_DIR, exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "format": CACHE_FORMAT,
+                "path": os.path.abspath(file_path),
+                "mtime_ns": signature[0],
+                "size": signature[1],
+                "tracks": tracks,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, cache_path) # Readers never see a half-written cache file
+    except OSError as e:
+        logging.warning(f"Could not write playlist cache for '{file_path}': {e}")
+
+def load_xspf(file_path):
+    """
+    Cached parse_xspf(): returns the playlist's tracks as a tuple of (title, location, duration_ms).
+    Looks in memory, then in the on-disk cache, and only parses the XSPF when neither holds
+    the file's current mtime and size. Blocking; call it with asyncio.to_thread from the bot.
+    Raises OSError if the playlist file can't be read.
+    """
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _memory_cache_lock:
+        cached = _memory_cache.get(file_path)
+        if cached is not None and cached[0] == signature:
+            _memory_cache.move_to_end(file_path)
+            return cached[1]
+
+    tracks = _read_disk_cache(file_path, signature)
+    if tracks is None:
+        tracks = tuple(parse_xspf(file_path))
+        _write_disk_cache(file_path, signature, tracks)
+        logging.info(f"Parsed playlist '{file_path}' ({len(tracks)} tracks).")
+
+    with _memory_cache_lock:
+        _memory_cache[file_path] = (signature, tracks)
+        _memory_cache.move_to_end(file_path)
+        while len(_memory_cache) > config.XSPF_MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return tracks
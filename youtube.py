@@ -0,0 +1,345 @@
+# youtube.py
+import asyncio
+import collections
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse, parse_qs
+import yt_dlp
+
+# Helpers for YouTube links and the stream URLs yt-dlp resolves them to.
+
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def is_youtube_url(location):
+    return "youtube.com/" in location or "youtu.be/" in location
+
+def placeholder_title(url):
+    """Title shown for a queued YouTube link until it's resolved."""
+    return f"YouTube video {video_id(url) or url}"
+
+CHANNEL_PATH_PATTERN = re.compile(r"^/(@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+)(/[^/]*)?/?$")
+UNAVAILABLE_TITLES = {"[Private video]", "[Deleted video]"}
+
+def collection_url(url):
+    """
+    Returns the URL to list for a YouTube playlist or channel link (a channel's Videos tab when no tab is given),
+    or None if the link is a single video. A watch link that also names a playlist counts as the video.
+    """
+    if video_id(url):
+        return None
+    parsed = urlparse(url.strip() if "://" in url else "https://" + url.strip())
+    if not (parsed.hostname or "").lower().endswith("youtube.com"):
+        return None
+    if parsed.path.rstrip("/") == "/playlist" and "list" in parse_qs(parsed.query):
+        return parsed.geturl()
+    match = CHANNEL_PATH_PATTERN.match(parsed.path)
+    if match:
+        return parsed.geturl() if match.group(2) and match.group(2) != "/" else f"https://www.youtube.com/{match.group(1)}/videos"
+    return None
+
+def video_id(url):
+    """
+    Returns the 11 character video id of a YouTube watch, short, embed, live or youtu.be link,
+    or None if the link doesn't point at a single video.
+    """
+    parsed = urlparse(url.strip() if "://" in url else "https://" + url.strip())
+    host = (parsed.hostname or "").lower()
+    candidate = None
+    if host == "youtu.be":
+        candidate = parsed.path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        query = parse_qs(parsed.query)
+        if "v" in query:
+            candidate = query["v"][0]
+        else:
+            parts = parsed.path.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = parts[1]
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+def stream_expiry(stream_url):
+    """
+    Returns the unix time a googlevideo stream URL stops working, from its expire parameter
+    (?expire=... or /expire/.../ in manifest URLs), or None if it has none.
+    """
+    parsed = urlparse(stream_url)
+    expire = parse_qs(parsed.query).get("expire", [None])[0]
+    if expire is None:
+        match = re.search(r"/expire/(\d+)", parsed.path)
+        expire = match.group(1) if match else None
+    try:
+        return int(expire) if expire is not None else None
+    except ValueError:
+        return None
+
+def extract_stream(url, socket_timeout):
+    """
+    Resolves a YouTube link to (title, stream URL) with yt-dlp, or (None, error message).
+    Blocking and CPU heavy; YoutubeResolver runs it in a worker process.
+    """
+    ydl_opts = {
+        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'socket_timeout': socket_timeout,
+    }
+    try:
+        logging.info(f"yt-dlp: Attempting to extract info for {url}")
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            video_url = info.get('url')
+            title = info.get('title', 'Unknown YouTube Video')
+
+            if not video_url:
+                logging.error(f"yt-dlp: Could not extract 'url' directly from info for {url} using primary format. Checking 'formats' list as fallback.")
+
+                selected_format_info = None
+                if 'formats' in info:
+                    # Priority 1: MP4 with video and audio
+                    for f_info in reversed(info['formats']):
+                        if f_info.get('url','').startswith('http') and \
+                           f_info.get('vcodec') != 'none' and f_info.get('vcodec') is not None and \
+                           f_info.get('acodec') != 'none' and f_info.get('acodec') is not None and \
+                           f_info.get('ext') == 'mp4':
+                            selected_format_info = f_info
+                            break
+
+                    # Priority 2: Any format with video and audio
+                    if not selected_format_info:
+                        for f_info in reversed(info['formats']):
+                            if f_info.get('url','').startswith('http') and \
+                               f_info.get('vcodec') != 'none' and f_info.get('vcodec') is not None and \
+                               f_info.get('acodec') != 'none' and f_info.get('acodec') is not None:
+                                selected_format_info = f_info
+                                break
+
+                    # Priority 3: As a last resort for audio, pick any format with audio, even if audio-only.
+                    # This might be less desirable if video is expected, but ensures audio if the above fail.
+                    if not selected_format_info:
+                        for f_info in reversed(info['formats']):
+                            if f_info.get('url','').startswith('http') and \
+                               f_info.get('acodec') != 'none' and f_info.get('acodec') is not None:
+                                selected_format_info = f_info
+                                logging.warning(f"yt-dlp: Fallback selected a format that might be audio-only to ensure audio presence: {f_info.get('format_id')}")
+                                break
+
+                if selected_format_info:
+                    video_url = selected_format_info.get('url')
+                    title = info.get('title', selected_format_info.get('title', 'Unknown YouTube Video')) # Keep original title if possible
+                    logging.info(f"yt-dlp: Using fallback format. URL: {video_url} (Format ID: {selected_format_info.get('format_id')}, vcodec: {selected_format_info.get('vcodec')}, acodec: {selected_format_info.get('acodec')})")
+
+            if not video_url:
+                logging.error(f"yt-dlp: Failed to get a streamable URL for {url}.")
+                return None, "Failed to get a streamable URL from YouTube."
+
+            logging.info(f"yt-dlp: Extracted title='{title}', url='{video_url}'")
+            return title, video_url
+    except yt_dlp.utils.DownloadError as e:
+        logging.error(f"yt-dlp DownloadError for {url}: {e}")
+        error_message = str(e)
+        user_friendly_error = "Could not process YouTube link (video may be unavailable, private, or region-locked)."
+        if "is not available" in error_message or "Private video" in error_message or "Video unavailable" in error_message:
+            pass # Default message is good
+        return None, user_friendly_error
+    except Exception as e:
+        logging.error(f"yt-dlp: Unexpected error for {url}: {e}", exc_info=True)
+        return None, "An unexpected error occurred while fetching YouTube video information."
+
+def extract_playlist_page(url, start, end, socket_timeout):
+    """
+    Lists entries start to end (1-based, inclusive) of a playlist or channel with flat extraction, which reads
+    only the listing pages and not the videos. Returns (playlist title, entries) with entries as (title, watch URL),
+    or None for entries that can't be played (private, deleted, not a video); or (None, error message).
+    Blocking; YoutubeResolver runs it in a worker process.
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'playliststart': start,
+        'playlistend': end,
+        'lazy_playlist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'socket_timeout': socket_timeout,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        entries = []
+        for entry in info.get('entries') or []:
+            if not entry or entry.get('ie_key') != 'Youtube' or not entry.get('id') or entry.get('title') in UNAVAILABLE_TITLES:
+                entries.append(None)
+                continue
+            watch_url = f"https://www.youtube.com/watch?v={entry['id']}"
+            entries.append((entry.get('title') or placeholder_title(watch_url), watch_url))
+        logging.info(f"yt-dlp: Listed entries {start}-{start + len(entries) - 1} of {url}")
+        return info.get('title') or url, entries
+    except yt_dlp.utils.DownloadError as e:
+        logging.error(f"yt-dlp DownloadError listing {url}: {e}")
+        return None, "Could not read YouTube playlist (it may be private or unavailable)."
+    except Exception as e:
+        logging.error(f"yt-dlp: Unexpected error listing {url}: {e}", exc_info=True)
+        return None, "An unexpected error occurred while reading the YouTube playlist."
+
+def _init_worker():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [yt-dlp worker] %(message)s')
+
+class YoutubeResolver:
+    """
+    Runs yt-dlp jobs (extract_stream, extract_playlist_page) in a small pool of worker processes, so yt-dlp's CPU work doesn't hold the bot's GIL
+    and delay the gateway heartbeat or other commands.
+    Requests wait in one queue per user and are handed to the workers round robin, so one user resolving a
+    batch of links doesn't hold everyone else up. Each request is given up on after a timeout; an extraction
+    that is already running keeps its worker until yt-dlp returns, so a hung site can't pile up more work.
+    If a worker process dies, the pool is replaced and the jobs it took down are retried once.
+    """
+    def __init__(self, workers, timeout_seconds, max_queued_per_user):
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self.max_queued_per_user = max_queued_per_user
+        self.pool = None
+        self.queues = collections.OrderedDict() # user -> deque of (function, args, future), in round robin order
+        self.queued = None
+        self.free_workers = None
+        self.dispatcher = None
+
+    def start(self):
+        self.pool = self._new_pool()
+        self.queued = asyncio.Event()
+        self.free_workers = asyncio.Semaphore(self.workers)
+        self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def _replace_pool(self, broken_pool):
+        """Replaces a pool that lost a worker. Every job on it fails together, so only the first one replaces it."""
+        if self.pool is not broken_pool:
+            return
+        logging.error("yt-dlp: A worker process died; restarting the worker pool.")
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._new_pool()
+
+    def shutdown(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+        for jobs in self.queues.values():
+            for _, _, future in jobs:
+                future.cancel()
+        self.queues.clear()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def resolve(self, url, user=None):
+        """Queues url for user and returns (title, stream URL) or (None, error message)."""
+        return await self.run(user, extract_stream, url, self.timeout_seconds)
+
+    async def list_playlist(self, url, start, end, user=None):
+        """Queues a page of a playlist or channel for user; returns what extract_playlist_page does."""
+        return await self.run(user, extract_playlist_page, url, start, end, self.timeout_seconds)
+
+    async def run(self, user, function, url, *args):
+        """
+        Queues function(url, *args) for user and returns its result, or (None, error message) if it couldn't be run
+        in time. function must be a module level function returning (None, error message) on failure.
+        """
+        if self.dispatcher is None or self.dispatcher.done():
+            return None, "The YouTube resolver is not running."
+        jobs = self.queues.setdefault(user, collections.deque())
+        if len(jobs) >= self.max_queued_per_user:
+            return None, f"You already have {len(jobs)} YouTube links waiting to be resolved; try again in a moment."
+        future = asyncio.get_running_loop().create_future()
+        job = (function, (url, *args), future)
+        jobs.append(job)
+        self.queued.set()
+        try:
+            return await asyncio.wait_for(future, self.timeout_seconds)
+        except asyncio.TimeoutError:
+            logging.warning(f"yt-dlp: Gave up on {url} after {self.timeout_seconds}s.")
+            return None, "Timed out while fetching YouTube video information."
+        finally:
+            self._unqueue(user, job)
+
+    def _unqueue(self, user, job):
+        """Drops a job that was given up on while still queued, so it no longer counts against its user."""
+        jobs = self.queues.get(user)
+        if not jobs:
+            return
+        try:
+            jobs.remove(job)
+        except ValueError:
+            return # Already handed to a worker
+        if not jobs:
+            del self.queues[user]
+
+    def _next_job(self):
+        while self.queues:
+            user, jobs = next(iter(self.queues.items()))
+            job = jobs.popleft()
+            if jobs:
+                self.queues.move_to_end(user) # Next user's turn
+            else:
+                del self.queues[user]
+            if not job[2].done(): # Skip requests that timed out while queued
+                return job
+        return None
+
+    async def _dispatch(self):
+        while True:
+            await self.free_workers.acquire()
+            job = self._next_job()
+            while job is None:
+                self.queued.clear()
+                await self.queued.wait()
+                job = self._next_job()
+
+            self._submit(*job)
+
+    def _submit(self, function, args, future, retried=False):
+        """Starts a job on a worker whose slot is already taken; _finish() gives the slot back."""
+        url = args[0]
+        pool = self.pool
+        try:
+            extraction = asyncio.get_running_loop().run_in_executor(pool, function, *args)
+        except BrokenProcessPool:
+            self._retry_or_fail(pool, function, args, future, retried)
+            return
+        except Exception as e:
+            self.free_workers.release()
+            logging.error(f"yt-dlp: Could not start a worker for {url}: {e}")
+            future.set_result((None, "An unexpected error occurred while fetching YouTube video information."))
+            return
+        extraction.add_done_callback(lambda done: self._finish(done, pool, function, args, future, retried))
+
+    def _retry_or_fail(self, pool, function, args, future, retried):
+        self._replace_pool(pool)
+        if retried or future.done():
+            self.free_workers.release()
+            if not future.done():
+                logging.error(f"yt-dlp: Worker died again for {args[0]}; giving up.")
+                future.set_result((None, "An unexpected error occurred while fetching YouTube video information."))
+            return
+        logging.warning(f"yt-dlp: Retrying {args[0]} on the new worker pool.")
+        self._submit(function, args, future, retried=True)
+
+    def _finish(self, extraction, pool, function, args, future, retried):
+        if not extraction.cancelled() and isinstance(extraction.exception(), BrokenProcessPool):
+            self._retry_or_fail(pool, function, args, future, retried)
+            return
+        self.free_workers.release()
+        if future.done():
+            return
+        url = args[0]
+        if extraction.cancelled():
+            future.cancel()
+        elif extraction.exception():
+            logging.error(f"yt-dlp: Worker failed for {url}: {extraction.exception()}")
+            future.set_result((None, "An unexpected error occurred while fetching YouTube video information."))
+        else:
+            future.set_result(extraction.result())